@@ -1,18 +1,54 @@
 import os
 import json
 import uuid
+import functools
+import tempfile
 import hashlib
 import random
 import time
 import smtplib
 import ssl
-from datetime import timedelta
+import threading
+import csv
+import re
+import sqlite3
+import io
+import queue
+import struct
+import mmap
+import bisect
+import sys
+from array import array
+import heapq
+import mimetypes
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import date, timedelta
 from email.message import EmailMessage
+from urllib.parse import quote
+import click
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory
+from flask import Flask, Request, Response, abort, g, render_template, request, jsonify, session, redirect, url_for, send_file
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    import fcntl
+except ImportError:  # Windows: locks below fall back to in-process only
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # Reports fall back to plain Python loops
+    np = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Photos are served at full size only
+    Image = ImageOps = None
+
 # Resolve paths from this file so behavior is stable under WSGI/any CWD.
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 load_dotenv(os.path.join(BASE_DIR, '.env'))
@@ -24,8 +60,8 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
 app.config['SESSION_REFRESH_EACH_REQUEST'] = True
 
 # Base data directory
-DATA_DIR = os.path.join(BASE_DIR, 'data')
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
+DATA_DIR = os.getenv('DATA_DIR') or os.path.join(BASE_DIR, 'data')
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER') or os.path.join(BASE_DIR, 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 # Ensure directories exist
@@ -33,6 +69,8 @@ os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+if os.getenv('UPLOAD_OFFLOAD', '').strip().lower() == 'sendfile':
+    app.config['USE_X_SENDFILE'] = True
 
 # Main admin credential management (username + hashed password)
 MAIN_CREDENTIALS_FILE = 'main_credential.json'
@@ -67,8 +105,7 @@ def load_main_credentials():
     # default credentials (username: faculty, password: 1) in simple text; backend will not rewrite it
     default = {'username': 'faculty', 'password': '1'}
     try:
-        with open(path, 'w') as f:
-            json.dump(default, f, indent=2)
+        atomic_write_json(path, default)
     except Exception:
         pass
     return default
@@ -86,8 +123,7 @@ def save_main_credentials(data):
         payload['password_hash'] = data.get('password_hash')
     else:
         payload['password'] = '1'
-    with open(path, 'w') as f:
-        json.dump(payload, f, indent=2)
+    atomic_write_json(path, payload)
 
 
 def verify_main_password(stored_hash, password):
@@ -131,6 +167,19 @@ def verify_password_sha256_or_plain(stored_value, password):
 def should_upgrade_to_sha256(stored_value):
     return bool(stored_value) and not is_sha256_hex(str(stored_value))
 
+
+def check_password(stored_value, password, current):
+    # Sections at the current schema hold only SHA-256 hashes
+    if current:
+        return str(stored_value or '') == hash_password_sha256(password)
+    return verify_password_sha256_or_plain(stored_value, password)
+
+def upload_name_from_url(url):
+    # Stored name of an '/uploads/<name>' URL (records older than 'storedFilename')
+    url = str(url or '')
+    return url.rsplit('/', 1)[-1] if '/uploads/' in url else None
+
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -144,16 +193,115 @@ def is_main_admin():
     return session.get('user_type') == 'faculty'
 
 
+# The session carries only identifiers (student id / secondary userId plus the
+# section); records are looked up through the section cache once per request,
+# so cookies stay small and edits show up immediately. The returned dicts are
+# the shared cached objects: treat them as read-only.
+
+def current_student():
+    if session.get('user_type') != 'student':
+        return None
+    if 'current_student' not in g:
+        course = session.get('student_course')
+        year = session.get('student_year')
+        section = session.get('student_section')
+        student_id = session.get('student_id')
+        g.current_student = None
+        if all([course, year, section, student_id]):
+            g.current_student = find_student(course, year, section, student_id)
+    return g.current_student
+
+
+def current_secondary_profile():
+    if session.get('user_type') != 'secondary':
+        return None
+    if 'current_secondary_profile' not in g:
+        ctx = session.get('secondary_admin') or {}
+        course, year, section = ctx.get('course'), ctx.get('year'), ctx.get('section')
+        user_id = session.get('user_id')
+        g.current_secondary_profile = None
+        if all([course, year, section, user_id]):
+            for adm in get_secondary_admins(course, year, section):
+                if adm.get('userId') == user_id:
+                    g.current_secondary_profile = adm
+                    break
+    return g.current_secondary_profile
+
+
+# Authorization context
+# g.auth is built once per request: role, user id, the (course, year, section)
+# the user belongs to (None for the main admin) and, for secondary admins, a
+# frozenset of assigned subjects. Secondary contexts are cached per user
+# together with the secondary_admin list they were built from; a reloaded list
+# (edited here or by another process) or save_secondary_admins rebuilds them.
+
+AuthContext = namedtuple('AuthContext', 'role user_id scope subjects')
+AUTH_CACHE = {}  # (course, year, section, userId) -> (admins list, AuthContext)
+AUTH_CACHE_LOCK = threading.Lock()
+ANONYMOUS = AuthContext(None, None, None, frozenset())
+
+
+def build_auth_context():
+    utype = session.get('user_type')
+    if utype == 'faculty':
+        return AuthContext('faculty', 'faculty', None, frozenset())
+    if utype == 'student':
+        scope = (session.get('student_course'), session.get('student_year'), session.get('student_section'))
+        return AuthContext('student', session.get('student_id'), scope if all(scope) else None, frozenset())
+    if utype != 'secondary':
+        return ANONYMOUS
+    ctx = session.get('secondary_admin') or {}
+    scope = (ctx.get('course'), ctx.get('year'), ctx.get('section'))
+    user_id = session.get('user_id')
+    if not all(scope):
+        return AuthContext('secondary', user_id, None, frozenset())
+    admins = get_secondary_admins(*scope)
+    key = scope + (user_id,)
+    with AUTH_CACHE_LOCK:
+        cached = AUTH_CACHE.get(key)
+    if cached is not None and cached[0] is admins:
+        return cached[1]
+    subjects = next((a.get('subjects') or [] for a in admins if a.get('userId') == user_id), [])
+    auth = AuthContext('secondary', user_id, scope, frozenset(subjects))
+    with AUTH_CACHE_LOCK:
+        AUTH_CACHE[key] = (admins, auth)
+    return auth
+
+
+def invalidate_auth_context(course, year, section):
+    with AUTH_CACHE_LOCK:
+        for key in [k for k in AUTH_CACHE if k[:3] == (course, year, section)]:
+            del AUTH_CACHE[key]
+
+
 @app.before_request
 def keep_login_session_alive():
     # Keep logged-in sessions persistent and refresh expiry while user is active.
     if session.get('user_type'):
         session.permanent = True
         session.modified = True
+        # Slim down sessions issued before they carried ids only
+        legacy = session.pop('student_data', None)
+        if legacy and not session.get('student_id'):
+            session['student_id'] = legacy.get('id')
+        ctx = session.get('secondary_admin')
+        if ctx and 'profile' in ctx:
+            session['secondary_admin'] = {k: v for k, v in ctx.items() if k != 'profile'}
+
+
+@app.before_request
+def load_auth_context():
+    g.auth = build_auth_context()
 
 # OTP helpers for password reset
 OTP_TTL_SECONDS = 300
-OTP_STORE = {}
+# Limits per OTP_RATE_WINDOW: reset requests per email and per client address,
+# verify attempts per client address; each reset allows OTP_MAX_VERIFY_ATTEMPTS codes
+OTP_RATE_WINDOW = 900
+OTP_MAX_REQUESTS_PER_EMAIL = 5
+OTP_MAX_REQUESTS_PER_ADDR = 20
+OTP_MAX_VERIFY_PER_ADDR = 30
+OTP_MAX_VERIFY_ATTEMPTS = 5
 
 SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', '465'))
@@ -169,126 +317,1557 @@ SMTP_FROM = (
 SMTP_SECURITY = os.getenv('SMTP_SECURITY', 'ssl').strip().lower()  # ssl, starttls, or auto
 
 
-def _cleanup_otp_store():
-    now = int(time.time())
-    expired = [k for k, v in OTP_STORE.items() if int(v.get('expiresAt', 0)) <= now]
-    for k in expired:
-        OTP_STORE.pop(k, None)
+# Ephemeral token store
+# OTP reset entries and rate-limit counters that expire on their own. The
+# default 'sqlite' backend keeps them in TOKEN_DB_PATH, shared by every worker
+# process; TOKEN_BACKEND=memory keeps them in this process only (single-worker
+# runs). Both index entries by expiry, so a purge touches only expired ones.
+
+TOKEN_BACKEND = os.getenv('TOKEN_BACKEND', 'sqlite').strip().lower()
+TOKEN_DB_PATH = os.getenv('TOKEN_DB_PATH') or os.path.join(DATA_DIR, 'tokens.sqlite3')
+TOKEN_PURGE_SECONDS = 30
+TOKEN_LOCAL = threading.local()
+TOKEN_MEMORY = {}  # (kind, key) -> (expires_at, value)
+TOKEN_EXPIRY_HEAP = []  # (expires_at, kind, key); entries replaced since are skipped
+TOKEN_LOCK = threading.Lock()
+TOKEN_STATE = {'purged_at': 0.0}
+
+
+def get_token_conn():
+    conn = getattr(TOKEN_LOCAL, 'conn', None)
+    if conn is not None and TOKEN_LOCAL.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(TOKEN_DB_PATH, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS tokens (kind TEXT NOT NULL, key TEXT NOT NULL, '
+                 'value TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (kind, key))')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tokens_expires_at ON tokens (expires_at)')
+    TOKEN_LOCAL.conn, TOKEN_LOCAL.pid = conn, os.getpid()
+    return conn
+
+
+def token_put(kind, key, value, ttl):
+    expires_at = time.time() + ttl
+    if TOKEN_BACKEND == 'memory':
+        with TOKEN_LOCK:
+            TOKEN_MEMORY[(kind, key)] = (expires_at, value)
+            heapq.heappush(TOKEN_EXPIRY_HEAP, (expires_at, kind, key))
+        return
+    get_token_conn().execute('INSERT OR REPLACE INTO tokens (kind, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                             (kind, key, json.dumps(value), expires_at))
+
+
+def token_get(kind, key):
+    now = time.time()
+    if TOKEN_BACKEND == 'memory':
+        with TOKEN_LOCK:
+            item = TOKEN_MEMORY.get((kind, key))
+        return item[1] if item and item[0] > now else None
+    row = get_token_conn().execute('SELECT value FROM tokens WHERE kind = ? AND key = ? AND expires_at > ?',
+                                   (kind, key, now)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def token_pop(kind, key):
+    if TOKEN_BACKEND == 'memory':
+        with TOKEN_LOCK:
+            TOKEN_MEMORY.pop((kind, key), None)
+        return
+    get_token_conn().execute('DELETE FROM tokens WHERE kind = ? AND key = ?', (kind, key))
+
+
+def rate_limited(kind, key, limit, window):
+    # Counts one hit in a fixed window; True once the window has seen more than limit hits
+    now = time.time()
+    if TOKEN_BACKEND == 'memory':
+        with TOKEN_LOCK:
+            item = TOKEN_MEMORY.get((kind, key))
+            if item and item[0] > now:
+                TOKEN_MEMORY[(kind, key)] = (item[0], item[1] + 1)
+                return item[1] + 1 > limit
+            TOKEN_MEMORY[(kind, key)] = (now + window, 1)
+            heapq.heappush(TOKEN_EXPIRY_HEAP, (now + window, kind, key))
+        return 1 > limit
+    conn = get_token_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT value, expires_at FROM tokens WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        if row and row[1] > now:
+            hits = json.loads(row[0]) + 1
+            conn.execute('UPDATE tokens SET value = ? WHERE kind = ? AND key = ?', (json.dumps(hits), kind, key))
+        else:
+            hits = 1
+            conn.execute('INSERT OR REPLACE INTO tokens (kind, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                         (kind, key, '1', now + window))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return hits > limit
+
+
+def purge_expired_tokens():
+    # At most every TOKEN_PURGE_SECONDS per process; cost is the number of expired entries
+    now = time.time()
+    with TOKEN_LOCK:
+        if now - TOKEN_STATE['purged_at'] < TOKEN_PURGE_SECONDS:
+            return
+        TOKEN_STATE['purged_at'] = now
+        if TOKEN_BACKEND == 'memory':
+            while TOKEN_EXPIRY_HEAP and TOKEN_EXPIRY_HEAP[0][0] <= now:
+                expires_at, kind, key = heapq.heappop(TOKEN_EXPIRY_HEAP)
+                item = TOKEN_MEMORY.get((kind, key))
+                if item and item[0] == expires_at:
+                    del TOKEN_MEMORY[(kind, key)]
+            return
+    get_token_conn().execute('DELETE FROM tokens WHERE expires_at <= ?', (now,))
 
 
 def _new_otp_code():
     return f"{random.randint(0, 999999):06d}"
 
 
-def send_otp_email(to_email, otp, role_label='Account'):
-    if not SMTP_USER or not SMTP_APP_PASSWORD or not SMTP_FROM:
-        return False, 'SMTP is not configured. Set SMTP_USER plus SMTP_APP_PASSWORD (or SMTP_PASS) and SMTP_FROM_EMAIL (or FROM_EMAIL).'
+def smtp_config_error():
+    if not SMTP_FROM or (SMTP_SECURITY != 'none' and (not SMTP_USER or not SMTP_APP_PASSWORD)):
+        return 'SMTP is not configured. Set SMTP_USER plus SMTP_APP_PASSWORD (or SMTP_PASS) and SMTP_FROM_EMAIL (or FROM_EMAIL).'
+    return None
+
+
+def smtp_connect():
+    # Logged-in SMTP connection. SMTP_SECURITY=auto tries STARTTLS:587 then
+    # SSL:465; 'none' is plain SMTP for local relays and test servers.
+    if SMTP_SECURITY == 'auto':
+        attempts = [('starttls', 587), ('ssl', 465)]
+    elif SMTP_SECURITY in ('starttls', 'none'):
+        attempts = [(SMTP_SECURITY, SMTP_PORT)]
+    else:
+        attempts = [('ssl', SMTP_PORT)]
+
+    last_error = None
+    for mode, port in attempts:
+        server = None
+        try:
+            if mode == 'ssl':
+                server = smtplib.SMTP_SSL(SMTP_HOST, port, context=ssl.create_default_context(), timeout=20)
+            else:
+                server = smtplib.SMTP(SMTP_HOST, port, timeout=20)
+                if mode == 'starttls':
+                    server.ehlo()
+                    server.starttls(context=ssl.create_default_context())
+                    server.ehlo()
+            if SMTP_USER and SMTP_APP_PASSWORD:
+                server.login(SMTP_USER, SMTP_APP_PASSWORD)
+            return server
+        except Exception as e:
+            last_error = e
+            if server is not None:
+                close_smtp(server)
+    raise last_error or smtplib.SMTPException('SMTP send failed')
 
+
+def close_smtp(server):
     try:
-        msg = EmailMessage()
-        msg['Subject'] = 'Student Track Recorder OTP Verification'
-        msg['From'] = SMTP_FROM
-        msg['To'] = to_email
-        msg.set_content(
-            f"""
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def send_otp_email(to_email, otp, role_label='Account'):
+    # Queues the OTP mail and returns at once; delivery happens in mail_worker
+    err = smtp_config_error()
+    if err:
+        return False, err
+    body = f"""
 Your OTP for {role_label} password reset is: {otp}
 
 This OTP is valid for {OTP_TTL_SECONDS // 60} minutes.
 If you did not request this reset, please ignore this email.
 """.strip()
-        )
+    try:
+        enqueue_mail(to_email, 'Student Track Recorder OTP Verification', body,
+                     expires_at=int(time.time()) + OTP_TTL_SECONDS)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+# Outbound mail queue
+# Mail is spooled to data/.mail_outbox/<id>.json and sent by MAIL_WORKERS
+# threads, each keeping one logged-in SMTP connection open between messages.
+# A worker claims a message by renaming it into sending/, so every message is
+# sent once even with several app processes sharing the outbox. Failures go
+# back to the outbox with exponential backoff and end up in failed/ after
+# MAIL_MAX_ATTEMPTS; messages past their expiresAt (OTPs) are dropped rather
+# than delivered late. Anything left over from a restart is picked up again.
+
+MAIL_DIR = os.path.join(DATA_DIR, '.mail_outbox')  # dot name: not listed as a course
+LEGACY_MAIL_DIR = os.path.join(DATA_DIR, 'mail_outbox')
+MAIL_SENDING_DIR = os.path.join(MAIL_DIR, 'sending')
+MAIL_FAILED_DIR = os.path.join(MAIL_DIR, 'failed')
+MAIL_WORKERS = int(os.getenv('MAIL_WORKERS', '2'))
+MAIL_MAX_ATTEMPTS = 6
+MAIL_RETRY_SECONDS = 15  # doubled after every failed attempt
+MAIL_POLL_SECONDS = 5  # how often an idle pool looks for due retries
+MAIL_IDLE_SECONDS = 60  # pooled connections unused this long are closed
+MAIL_CLAIM_TIMEOUT = 600  # claims older than this belong to a dead worker
+MAIL_QUEUE = queue.SimpleQueue()
+MAIL_STATE = {'workers': [], 'sent': 0, 'failed': 0, 'expired': 0}
+MAIL_LOCK = threading.Lock()
+
+
+def enqueue_mail(to_email, subject, body, expires_at=None):
+    os.makedirs(MAIL_DIR, exist_ok=True)
+    mail_id = f"{time.time_ns():x}_{uuid.uuid4().hex[:8]}"  # sorts in arrival order
+    atomic_write_json(os.path.join(MAIL_DIR, mail_id + '.json'), {
+        'id': mail_id,
+        'to': to_email,
+        'subject': subject,
+        'body': body,
+        'expiresAt': expires_at,
+        'attempts': 0,
+        'nextAttempt': 0,
+        'lastError': None
+    })
+    start_mail_workers()
+    MAIL_QUEUE.put(mail_id)
+    return mail_id
+
+
+def start_mail_workers():
+    with MAIL_LOCK:
+        workers = [t for t in MAIL_STATE['workers'] if t.is_alive()]
+        for index in range(len(workers), MAIL_WORKERS):
+            worker = threading.Thread(target=mail_worker, args=(index,), name=f'mail-{index}', daemon=True)
+            worker.start()
+            workers.append(worker)
+        MAIL_STATE['workers'] = workers
+
+
+def due_mail_ids():
+    # Outbox ids whose next attempt is due; stale claims are returned to the outbox first
+    now = time.time()
+    if os.path.isdir(MAIL_SENDING_DIR):
+        for name in os.listdir(MAIL_SENDING_DIR):
+            path = os.path.join(MAIL_SENDING_DIR, name)
+            try:
+                if name.endswith('.json') and now - os.path.getmtime(path) > MAIL_CLAIM_TIMEOUT:
+                    os.replace(path, os.path.join(MAIL_DIR, name))
+            except OSError:
+                pass
+    due = []
+    try:
+        names = sorted(os.listdir(MAIL_DIR))
+    except OSError:
+        return due
+    for name in names:
+        if name.startswith('.') or not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(MAIL_DIR, name), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if entry.get('nextAttempt', 0) <= now:
+            due.append(name[:-5])
+    return due
+
+
+def claim_mail(mail_id):
+    os.makedirs(MAIL_SENDING_DIR, exist_ok=True)
+    path = os.path.join(MAIL_SENDING_DIR, mail_id + '.json')
+    try:
+        os.rename(os.path.join(MAIL_DIR, mail_id + '.json'), path)
+        os.utime(path)  # claim time, for stale-claim recovery
+        with open(path, 'r') as f:
+            return path, json.load(f)
+    except FileNotFoundError:
+        return None, None  # another worker got it first
+    except (OSError, ValueError):
+        return path, None
+
+
+def finish_mail(path, outcome):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    with MAIL_LOCK:
+        MAIL_STATE[outcome] += 1
+
+
+def retry_mail(path, entry, error):
+    entry['attempts'] = entry.get('attempts', 0) + 1
+    entry['lastError'] = str(error)
+    if entry['attempts'] >= MAIL_MAX_ATTEMPTS:
+        target_dir = MAIL_FAILED_DIR
+        with MAIL_LOCK:
+            MAIL_STATE['failed'] += 1
+    else:
+        target_dir = MAIL_DIR
+        entry['nextAttempt'] = time.time() + MAIL_RETRY_SECONDS * 2 ** (entry['attempts'] - 1)
+    os.makedirs(target_dir, exist_ok=True)
+    atomic_write_json(path, entry)
+    os.replace(path, os.path.join(target_dir, os.path.basename(path)))
 
-        # If SMTP_SECURITY=auto, try STARTTLS:587 first then SSL:465.
-        if SMTP_SECURITY == 'auto':
-            attempts = [('starttls', 587), ('ssl', 465)]
-        elif SMTP_SECURITY == 'starttls':
-            attempts = [('starttls', SMTP_PORT)]
-        else:
-            attempts = [('ssl', SMTP_PORT)]
 
-        last_error = None
-        for mode, port in attempts:
+def mail_worker(index):
+    server, last_used = None, 0.0
+    while True:
+        try:
+            mail_id = MAIL_QUEUE.get(timeout=MAIL_POLL_SECONDS)
+        except queue.Empty:
+            if server is not None and time.time() - last_used > MAIL_IDLE_SECONDS:
+                close_smtp(server)
+                server = None
+            if index == 0:
+                for mail_id in due_mail_ids():
+                    MAIL_QUEUE.put(mail_id)
+            continue
+        path, entry = claim_mail(mail_id)
+        if path is None:
+            continue
+        if entry is None:
+            retry_mail(path, {'id': mail_id, 'attempts': MAIL_MAX_ATTEMPTS}, 'unreadable queue entry')
+            continue
+        if entry.get('expiresAt') and entry['expiresAt'] <= time.time():
+            finish_mail(path, 'expired')
+            continue
+        msg = EmailMessage()
+        msg['Subject'] = entry.get('subject') or ''
+        msg['From'] = SMTP_FROM
+        msg['To'] = entry.get('to')
+        msg.set_content(entry.get('body') or '')
+        try:
+            if server is None:
+                server = smtp_connect()
             try:
-                if mode == 'starttls':
-                    with smtplib.SMTP(SMTP_HOST, port, timeout=20) as server:
-                        server.ehlo()
-                        server.starttls(context=ssl.create_default_context())
-                        server.ehlo()
-                        server.login(SMTP_USER, SMTP_APP_PASSWORD)
-                        server.send_message(msg)
+                server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # The pooled connection was dropped by the server while idle
+                server = smtp_connect()
+                server.send_message(msg)
+            last_used = time.time()
+        except Exception as e:
+            if server is not None and not isinstance(e, smtplib.SMTPRecipientsRefused):
+                close_smtp(server)
+                server = None
+            retry_mail(path, entry, e)
+            continue
+        finish_mail(path, 'sent')
+
+# Crash-safe storage helpers
+# Documents are written to a temp file in the same directory, fsynced and then
+# renamed over the target, so readers never see a half-written file.
+# Read-modify-write sequences hold an exclusive lock that works across threads
+# (RLock) and across worker processes (flock on a lock file).
+
+FILE_LOCKS = {}
+FILE_LOCKS_GUARD = threading.Lock()
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path, data):
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+
+@contextmanager
+def file_lock(lock_path):
+    # Re-entrant within a thread; only the outermost holder takes the flock,
+    # and the entry is dropped once no thread holds or waits for the lock
+    with FILE_LOCKS_GUARD:
+        state = FILE_LOCKS.get(lock_path)
+        if state is None:
+            state = FILE_LOCKS[lock_path] = {'rlock': threading.RLock(), 'depth': 0, 'fd': None, 'owner': None,
+                                             'docs': {}, 'users': 0}
+        state['users'] += 1
+    try:
+        with state['rlock']:
+            state['depth'] += 1
+            try:
+                if state['depth'] == 1:
+                    state['owner'] = threading.get_ident()
+                    if fcntl is not None and os.path.isdir(os.path.dirname(lock_path)):
+                        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+                        state['fd'] = fd
+                yield
+            finally:
+                state['depth'] -= 1
+                if state['depth'] == 0:
+                    state['owner'] = None
+                    state['docs'] = {}
+                    if state['fd'] is not None:
+                        fd, state['fd'] = state['fd'], None
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                        os.close(fd)
+    finally:
+        with FILE_LOCKS_GUARD:
+            state['users'] -= 1
+            if state['users'] == 0 and FILE_LOCKS.get(lock_path) is state:
+                del FILE_LOCKS[lock_path]
+
+
+def section_lock(course, year, section):
+    return file_lock(os.path.join(DATA_DIR, course, year, section, '.lock'))
+
+
+def section_dir(course, year, section):
+    # The section's directory, or None unless every part is a plain name that stays inside DATA_DIR
+    parts = (course, year, section)
+    if not all(parts) or any(p in {'.', '..'} or '/' in p or os.sep in p or '\0' in p for p in parts):
+        return None
+    root = os.path.realpath(DATA_DIR)
+    path = os.path.realpath(os.path.join(root, *parts))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+
+def with_section_lock(view):
+    # Serialize a route's load/modify/save of section files; the section comes
+    # from the URL, or from the session for student/secondary self-service routes.
+    # Anonymous requests reach the view (which answers 401) without a lock, and
+    # sections that do not exist yet are not locked either.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if g.auth.role is None:
+            return view(*args, **kwargs)
+        course, year, section = kwargs.get('course'), kwargs.get('year'), kwargs.get('section')
+        if not all([course, year, section]) and g.auth.scope:
+            course, year, section = g.auth.scope
+        if not all([course, year, section]):
+            return view(*args, **kwargs)
+        path = section_dir(course, year, section)
+        if path is None:
+            return jsonify({'success': False, 'error': 'Invalid section'}), 400
+        if not os.path.isdir(path):
+            return view(*args, **kwargs)
+        with section_lock(course, year, section):
+            return view(*args, **kwargs)
+    return wrapper
+
+# Section document cache
+# Parsed section JSON documents are kept in memory keyed by
+# (course, year, section, kind) and revalidated against the file's
+# inode/mtime/size, so edits made by other processes are still picked up.
+# The cache holds only saved snapshots, which are never modified: readers
+# share them, while a thread holding the section lock gets its own working
+# copy of each document (the same one for every read until it releases the
+# lock), and saving caches a fresh copy of what was written.
+
+SECTION_CACHE_MAX_ENTRIES = int(os.getenv('SECTION_CACHE_MAX_ENTRIES', '512'))
+SECTION_CACHE = OrderedDict()
+SECTION_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+SECTION_CACHE_LOCK = threading.Lock()
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _section_cache_put(key, stamp, data):
+    with SECTION_CACHE_LOCK:
+        SECTION_CACHE[key] = (stamp, data)
+        SECTION_CACHE.move_to_end(key)
+        while len(SECTION_CACHE) > SECTION_CACHE_MAX_ENTRIES:
+            SECTION_CACHE.popitem(last=False)
+            SECTION_CACHE_STATS['evictions'] += 1
+
+
+def _copy_doc(data):
+    return json.loads(json.dumps(data))
+
+
+def _working_docs(key):
+    # The calling thread's working copies when it holds the section lock, else None
+    state = FILE_LOCKS.get(os.path.join(DATA_DIR, key[0], key[1], key[2], '.lock'))
+    if state is not None and state['owner'] == threading.get_ident():
+        return state['docs']
+    return None
+
+
+def read_section_json(key, path, default, label):
+    # Returns the parsed document, or None when the file does not exist
+    working = _working_docs(key)
+    if working is not None and key in working:
+        return working[key]
+    data = _read_section_snapshot(key, path, default, label)
+    if working is not None and data is not None:
+        data = working[key] = _copy_doc(data)
+    return data
+
+
+def _read_section_snapshot(key, path, default, label):
+    if STORAGE_BACKEND == 'sqlite':
+        return read_section_sqlite(key)
+    stamp = _file_stamp(path)
+    if stamp is None:
+        with SECTION_CACHE_LOCK:
+            SECTION_CACHE.pop(key, None)
+        return None
+    with SECTION_CACHE_LOCK:
+        cached = SECTION_CACHE.get(key)
+        if cached is not None and cached[0] == stamp:
+            SECTION_CACHE.move_to_end(key)
+            SECTION_CACHE_STATS['hits'] += 1
+            return cached[1]
+        SECTION_CACHE_STATS['misses'] += 1
+    try:
+        with open(path, 'r') as f:
+            # Check if file is empty
+            content = f.read().strip()
+        data = json.loads(content) if content else default()
+    except (json.JSONDecodeError, Exception) as e:
+        print(f"Error reading {label} file: {e}")
+        return default()
+    _section_cache_put(key, stamp, data)
+    return data
+
+
+def write_section_json(key, path, data):
+    # Write-through: a copy of the saved document becomes the cached snapshot,
+    # and the caller's object stays its working copy
+    if STORAGE_BACKEND == 'sqlite':
+        version = sqlite_write_section(key, data)
+        _section_cache_put(key, version, _copy_doc(data))
+    else:
+        atomic_write_json(path, data)
+        stamp = _file_stamp(path)
+        if stamp is not None:
+            _section_cache_put(key, stamp, _copy_doc(data))
+    working = _working_docs(key)
+    if working is not None:
+        working[key] = data
+
+
+def section_cache_stats():
+    with SECTION_CACHE_LOCK:
+        out = dict(SECTION_CACHE_STATS)
+        out['entries'] = len(SECTION_CACHE)
+    out['maxEntries'] = SECTION_CACHE_MAX_ENTRIES
+    lookups = out['hits'] + out['misses']
+    out['hitRate'] = round(out['hits'] / lookups, 4) if lookups else 0.0
+    return out
+
+# Storage backends
+# STORAGE_BACKEND=json (default) keeps one JSON file per section document.
+# STORAGE_BACKEND=sqlite keeps the same documents as rows in an SQLite database
+# (WAL mode) and saves only the rows that changed since the last load/save.
+# The course/year/section directories remain the hierarchy (and hold the lock
+# files) in both modes; the load_*/save_* helpers are unchanged for callers.
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').strip().lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH') or os.path.join(DATA_DIR, 'store.sqlite3')
+
+# Section file name for each document kind (JSON backend and migration source)
+SECTION_FILES = {
+    'students': 'students.json',
+    'activities': 'activities.json',
+    'secondary_admin': 'secondary_admin.json',
+    'attendance': 'attendance.json',
+    'attendance_issues': 'Attendance_issue.json',
+    'messages': 'messages.json',
+    'chat': 'chat.json',
+    'certificates': 'certificates.json',
+    'scrutiny': 'scrutiny.json',
+    'notes': 'notes.json',
+    'sequences': 'sequences.json',
+    'schema': 'schema.json',
+}
+
+# table -> (key columns, value columns, indexed column groups); every table is
+# also keyed by course/year/section
+SQLITE_TABLES = {
+    'students': (['pos'], ['id', 'roll_number', 'email', 'doc'], [['id'], ['roll_number', 'email']]),
+    'activities': (['pos'], ['id', 'doc'], []),
+    'secondary_admins': (['pos'], ['id', 'user_id', 'doc'], [['user_id']]),
+    'attendance_subjects': (['pos'], ['subject'], []),
+    'attendance_counts': (['subject', 'student_id', 'day'], ['present', 'absent'], [['student_id']]),
+    'attendance_totals': (['subject', 'student_id'], ['present', 'absent', 'last_marked'], []),
+    'attendance_student_totals': (['student_id'], ['present', 'absent', 'last_marked'], []),
+    'attendance_issues': (['pos'], ['id', 'subject', 'student_id', 'doc'], [['student_id']]),
+    'direct_messages': (['thread', 'pos'], ['id', 'doc'], []),
+    'chat_groups': (['group_id'], ['doc'], []),
+    'chat_messages': (['group_id', 'pos'], ['id', 'doc'], []),
+    'certificates': (['student_id', 'pos'], ['id', 'doc'], []),
+    'scrutiny_requests': (['pos'], ['id', 'student_id', 'status', 'doc'], [['student_id']]),
+    'notes': (['subject', 'pos'], ['id', 'doc'], []),
+}
+
+# kind -> parts as (document key, shape, table, [(column, item field)]).
+# Shapes: 'list' is a list of objects (document key None: the document itself),
+# 'grouped' is a dict of lists, 'map' is a dict of objects.
+SQLITE_KINDS = {
+    'students': [(None, 'list', 'students', [('id', 'id'), ('roll_number', 'rollNumber'), ('email', 'email')])],
+    'activities': [(None, 'list', 'activities', [('id', 'id')])],
+    'secondary_admin': [(None, 'list', 'secondary_admins', [('id', 'id'), ('user_id', 'userId')])],
+    'attendance_issues': [('issues', 'list', 'attendance_issues', [('id', 'id'), ('subject', 'subject'), ('student_id', 'studentId')])],
+    'messages': [('threads', 'grouped', 'direct_messages', [('id', 'id')])],
+    'chat': [('groups', 'map', 'chat_groups', []), ('messages', 'grouped', 'chat_messages', [('id', 'id')])],
+    'certificates': [('byStudent', 'grouped', 'certificates', [('id', 'id')])],
+    'scrutiny': [('requests', 'list', 'scrutiny_requests', [('id', 'id'), ('student_id', 'studentId'), ('status', 'status')])],
+    'notes': [('bySubject', 'grouped', 'notes', [('id', 'id')])],
+    'sequences': [],  # small dict, kept whole in section_docs
+    'schema': [],
+}
+# Attendance is split by hand (see _explode_attendance)
+ATTENDANCE_TABLES = ['attendance_subjects', 'attendance_counts', 'attendance_totals', 'attendance_student_totals']
+
+SQLITE_LOCAL = threading.local()
+SQLITE_ROWS = OrderedDict()  # key -> (version, rows, extra) as last loaded/saved, for diffing
+SQLITE_ROWS_LOCK = threading.Lock()
+
+
+def kind_tables(kind):
+    if kind == 'attendance':
+        return ATTENDANCE_TABLES
+    return [part[2] for part in SQLITE_KINDS[kind]]
+
+
+def get_sqlite_conn():
+    # One connection per thread (and per process, for report workers)
+    conn = getattr(SQLITE_LOCAL, 'conn', None)
+    if conn is not None and SQLITE_LOCAL.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(SQLITE_PATH, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    SQLITE_LOCAL.conn, SQLITE_LOCAL.pid = conn, os.getpid()
+    return conn
+
+
+def init_sqlite_schema():
+    conn = get_sqlite_conn()
+    conn.execute('CREATE TABLE IF NOT EXISTS section_docs (course TEXT NOT NULL, year TEXT NOT NULL, '
+                 'section TEXT NOT NULL, kind TEXT NOT NULL, version INTEGER NOT NULL, extra TEXT NOT NULL, '
+                 'PRIMARY KEY (course, year, section, kind))')
+    conn.execute('CREATE TABLE IF NOT EXISTS blob_refs (name TEXT PRIMARY KEY, refs INTEGER NOT NULL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS message_logs (course TEXT NOT NULL, year TEXT NOT NULL, '
+                 'section TEXT NOT NULL, stream TEXT NOT NULL, seq INTEGER NOT NULL, doc TEXT NOT NULL, '
+                 'PRIMARY KEY (course, year, section, stream, seq))')
+    for table, (key_cols, value_cols, indexes) in SQLITE_TABLES.items():
+        cols = ', '.join([f'{c} TEXT NOT NULL' if c != 'pos' else 'pos INTEGER NOT NULL' for c in key_cols]
+                         + [f'{c}' for c in value_cols])
+        pk = ', '.join(['course', 'year', 'section'] + key_cols)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (course TEXT NOT NULL, year TEXT NOT NULL, '
+                     f'section TEXT NOT NULL, {cols}, PRIMARY KEY ({pk}))')
+        for index_cols in indexes:
+            name = f"idx_{table}_{'_'.join(index_cols)}"
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(index_cols)})")
+
+
+def _item_doc(item):
+    return json.dumps(item, sort_keys=True)
+
+
+def _explode_items(items, fields):
+    rows = {}
+    for pos, item in enumerate(items or []):
+        obj = item if isinstance(item, dict) else {}
+        rows[(pos,)] = tuple(None if obj.get(f) is None else str(obj.get(f)) for _, f in fields) + (_item_doc(item),)
+    return rows
+
+
+def _explode_attendance(data):
+    rows = {table: {} for table in ATTENDANCE_TABLES}
+    rows['attendance_subjects'] = {(pos,): (str(s),) for pos, s in enumerate(data.get('subjects') or [])}
+    for subject in (data.get('records') or {}):
+        for student_id in data['records'][subject]:
+            entry = get_att_rec_entry(data, subject, student_id)
+            for day in set(entry['present']) | set(entry['absent']):
+                pr, ab = entry['present'].get(day, 0), entry['absent'].get(day, 0)
+                if pr or ab:
+                    rows['attendance_counts'][(subject, student_id, day)] = (pr, ab)
+    for subject, per_subject in (data.get('totals') or {}).items():
+        for student_id, t in per_subject.items():
+            rows['attendance_totals'][(subject, student_id)] = (t['present'], t['absent'], t['lastMarked'])
+    for student_id, t in (data.get('studentTotals') or {}).items():
+        rows['attendance_student_totals'][(student_id,)] = (t['present'], t['absent'], t['lastMarked'])
+    extra = {k: v for k, v in data.items() if k not in {'subjects', 'records', 'totals', 'studentTotals'}}
+    # Remember which containers exist, including subjects with no marks yet
+    extra['$keys'] = [k for k in ('subjects', 'records', 'totals', 'studentTotals') if k in data]
+    extra['$records'] = list(data.get('records') or {})
+    return rows, extra
+
+
+def _assemble_attendance(rows, extra):
+    extra = dict(extra)
+    keys = extra.pop('$keys')
+    data = {}
+    if 'subjects' in keys:
+        data['subjects'] = [v[0] for _, v in sorted(rows['attendance_subjects'].items())]
+    if 'records' in keys:
+        records = data['records'] = {subject: {} for subject in extra.pop('$records')}
+        for (subject, student_id, day), (pr, ab) in sorted(rows['attendance_counts'].items()):
+            entry = records.setdefault(subject, {}).setdefault(student_id, {'present': {}, 'absent': {}})
+            if pr:
+                entry['present'][day] = pr
+            if ab:
+                entry['absent'][day] = ab
+    extra.pop('$records', None)
+    if 'totals' in keys:
+        data['totals'] = {}
+        for (subject, student_id), (pr, ab, last) in rows['attendance_totals'].items():
+            data['totals'].setdefault(subject, {})[student_id] = {'present': pr, 'absent': ab, 'lastMarked': last}
+    if 'studentTotals' in keys:
+        data['studentTotals'] = {k[0]: {'present': pr, 'absent': ab, 'lastMarked': last}
+                                 for k, (pr, ab, last) in rows['attendance_student_totals'].items()}
+    data.update(extra)
+    return data
+
+
+def explode_section_doc(kind, data):
+    # Split a section document into table rows plus a small JSON remainder
+    if kind == 'attendance':
+        return _explode_attendance(data)
+    rows = {}
+    extra = {}
+    if isinstance(data, dict):
+        covered = {part[0] for part in SQLITE_KINDS[kind]}
+        extra = {k: v for k, v in data.items() if k not in covered}
+    for key, shape, table, fields in SQLITE_KINDS[kind]:
+        value = data if key is None else (data.get(key) if isinstance(data, dict) else None)
+        if key is not None:
+            if key not in data:
+                rows[table] = {}
+                continue
+            extra['$' + key] = list(value or {}) if shape != 'list' else True
+        if shape == 'list':
+            rows[table] = _explode_items(value, fields)
+        elif shape == 'grouped':
+            rows[table] = {}
+            for group, items in (value or {}).items():
+                for k, v in _explode_items(items, fields).items():
+                    rows[table][(group,) + k] = v
+        else:
+            rows[table] = {(name,): (_item_doc(item),) for name, item in (value or {}).items()}
+    return rows, extra
+
+
+def assemble_section_doc(kind, rows, extra):
+    if kind == 'attendance':
+        return _assemble_attendance(rows, extra)
+    parts = SQLITE_KINDS[kind]
+    if parts and parts[0][0] is None:
+        return [json.loads(v[-1]) for _, v in sorted(rows[parts[0][2]].items())]
+    data = {k: v for k, v in extra.items() if not k.startswith('$')}
+    for key, shape, table, _ in parts:
+        if '$' + key not in extra:
+            continue
+        if shape == 'list':
+            data[key] = [json.loads(v[-1]) for _, v in sorted(rows[table].items())]
+        elif shape == 'grouped':
+            groups = data[key] = {name: [] for name in extra['$' + key]}
+            for (group, _), v in sorted(rows[table].items()):
+                groups.setdefault(group, []).append(json.loads(v[-1]))
+        else:
+            items = {k[0]: json.loads(v[-1]) for k, v in rows[table].items()}
+            data[key] = {name: items[name] for name in extra['$' + key] if name in items}
+    return data
+
+
+def _sqlite_load_rows(conn, key):
+    course, year, section, kind = key
+    rows = {}
+    for table in kind_tables(kind):
+        key_cols, value_cols, _ = SQLITE_TABLES[table]
+        n = len(key_cols)
+        cur = conn.execute(f"SELECT {', '.join(key_cols + value_cols)} FROM {table} "
+                           'WHERE course=? AND year=? AND section=?', (course, year, section))
+        rows[table] = {tuple(r[:n]): tuple(r[n:]) for r in cur}
+    return rows
+
+
+def _sqlite_remember(key, version, rows, extra):
+    with SQLITE_ROWS_LOCK:
+        SQLITE_ROWS[key] = (version, rows, extra)
+        SQLITE_ROWS.move_to_end(key)
+        while len(SQLITE_ROWS) > SECTION_CACHE_MAX_ENTRIES:
+            SQLITE_ROWS.popitem(last=False)
+
+
+def sqlite_read_section(key, cached_version=None):
+    # Returns (version, document), (version, None) when cached_version is still
+    # current, or None when the document does not exist
+    conn = get_sqlite_conn()
+    conn.execute('BEGIN')
+    try:
+        row = conn.execute('SELECT version, extra FROM section_docs WHERE course=? AND year=? AND section=? AND kind=?',
+                           key).fetchone()
+        if row is None:
+            return None
+        if row[0] == cached_version:
+            return row[0], None
+        rows = _sqlite_load_rows(conn, key)
+    finally:
+        conn.execute('COMMIT')
+    extra = json.loads(row[1])
+    _sqlite_remember(key, row[0], rows, extra)
+    return row[0], assemble_section_doc(key[3], rows, extra)
+
+
+def sqlite_write_section(key, data):
+    # Diff against the rows last seen for this document and write only the changes
+    course, year, section, kind = key
+    new_rows, new_extra = explode_section_doc(kind, data)
+    conn = get_sqlite_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT version, extra FROM section_docs WHERE course=? AND year=? AND section=? AND kind=?',
+                           key).fetchone()
+        with SQLITE_ROWS_LOCK:
+            known = SQLITE_ROWS.get(key)
+        if row is not None and known is not None and known[0] == row[0]:
+            old_rows = known[1]
+        else:
+            old_rows = _sqlite_load_rows(conn, key)
+        for table, rows in new_rows.items():
+            key_cols, value_cols, _ = SQLITE_TABLES[table]
+            old = old_rows.get(table) or {}
+            gone = [(course, year, section) + k for k in old if k not in rows]
+            changed = [(course, year, section) + k + v for k, v in rows.items() if old.get(k) != v]
+            if gone:
+                where = ' AND '.join(f'{c}=?' for c in ['course', 'year', 'section'] + key_cols)
+                conn.executemany(f'DELETE FROM {table} WHERE {where}', gone)
+            if changed:
+                cols = ['course', 'year', 'section'] + key_cols + value_cols
+                conn.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(cols)}) "
+                                 f"VALUES ({', '.join('?' * len(cols))})", changed)
+        extra_json = json.dumps(new_extra)
+        if row is None:
+            version = 1
+            conn.execute('INSERT INTO section_docs (course, year, section, kind, version, extra) VALUES (?, ?, ?, ?, ?, ?)',
+                         key + (version, extra_json))
+        else:
+            version = row[0] + 1
+            if row[1] != extra_json:
+                conn.execute('UPDATE section_docs SET version=?, extra=? WHERE course=? AND year=? AND section=? AND kind=?',
+                             (version, extra_json) + key)
+            else:
+                conn.execute('UPDATE section_docs SET version=? WHERE course=? AND year=? AND section=? AND kind=?',
+                             (version,) + key)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    _sqlite_remember(key, version, new_rows, new_extra)
+    return version
+
+
+def sqlite_delete_sections(course, year=None, section=None):
+    where = ['course=?']
+    params = [course]
+    if year is not None:
+        where.append('year=?')
+        params.append(year)
+    if section is not None:
+        where.append('section=?')
+        params.append(section)
+    conn = get_sqlite_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table in ['section_docs', 'message_logs'] + list(SQLITE_TABLES):
+            conn.execute(f"DELETE FROM {table} WHERE {' AND '.join(where)}", params)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def read_section_sqlite(key):
+    # Cached read: the document's version number plays the part of the file stamp
+    with SECTION_CACHE_LOCK:
+        cached = SECTION_CACHE.get(key)
+    result = sqlite_read_section(key, cached[0] if cached is not None else None)
+    if result is None:
+        with SECTION_CACHE_LOCK:
+            SECTION_CACHE.pop(key, None)
+        return None
+    version, data = result
+    if data is None:
+        with SECTION_CACHE_LOCK:
+            if key in SECTION_CACHE:
+                SECTION_CACHE.move_to_end(key)
+            SECTION_CACHE_STATS['hits'] += 1
+        return cached[1]
+    with SECTION_CACHE_LOCK:
+        SECTION_CACHE_STATS['misses'] += 1
+    _section_cache_put(key, version, data)
+    return data
+
+
+def _read_json_file(path, default):
+    try:
+        with open(path, 'r') as f:
+            content = f.read().strip()
+        return json.loads(content) if content else default
+    except (OSError, ValueError):
+        return default
+
+
+def read_section_uncached(course, year, section, kind, default):
+    # Bypasses the section cache; used by report worker processes
+    if STORAGE_BACKEND == 'sqlite':
+        result = sqlite_read_section((course, year, section, kind))
+        return default if result is None else result[1]
+    return _read_json_file(os.path.join(DATA_DIR, course, year, section, SECTION_FILES[kind]), default)
+
+
+def drop_section_docs(course, year=None, section=None):
+    # Forget stored documents for a deleted course/year/section
+    prefix = tuple(p for p in (course, year, section) if p is not None)
+    with SECTION_CACHE_LOCK:
+        for key in [k for k in SECTION_CACHE if k[:len(prefix)] == prefix]:
+            del SECTION_CACHE[key]
+    with SQLITE_ROWS_LOCK:
+        for key in [k for k in SQLITE_ROWS if k[:len(prefix)] == prefix]:
+            del SQLITE_ROWS[key]
+    if STORAGE_BACKEND == 'sqlite':
+        sqlite_delete_sections(course, year, section)
+    unindex_search_under(course, year, section)
+    forget_content_index(course, year, section)
+
+# Append-only message logs
+# Chat and direct messages live in per-stream logs ('chat/<group_id>',
+# 'dm/<studentId>|<teacherId>') rather than
+# in the section documents, so sending costs one append and reading costs one
+# page. Messages are numbered by seq (1-based, in append order), which is the
+# pagination cursor. In the JSON backend a stream is a directory of JSON Lines
+# segments (LOG_SEGMENT_SIZE messages each) plus 'index', a packed array of
+# byte offsets into the segments; in the SQLite backend it is rows of
+# message_logs.
+
+LOG_SEGMENT_SIZE = 1000
+LOG_OFFSET = struct.Struct('<Q')
+LOG_PAGE_DEFAULT = 50
+LOG_PAGE_MAX = 200
+
+
+def get_log_dir(course, year, section, stream):
+    kind, name = stream.split('/', 1)
+    return os.path.join(DATA_DIR, course, year, section, 'logs', kind, quote(name, safe=''))
+
+
+def _log_segment_path(log_dir, seq):
+    return os.path.join(log_dir, f'{(seq - 1) // LOG_SEGMENT_SIZE:08d}.jsonl')
+
+
+def log_count(course, year, section, stream):
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_sqlite_conn().execute('SELECT MAX(seq) FROM message_logs WHERE course=? AND year=? AND section=? AND stream=?',
+                                        (course, year, section, stream)).fetchone()
+        return row[0] or 0
+    try:
+        size = os.path.getsize(os.path.join(get_log_dir(course, year, section, stream), 'index'))
+    except OSError:
+        return 0
+    return size // LOG_OFFSET.size
+
+
+def log_append(course, year, section, stream, record):
+    # Returns the new message's seq
+    if STORAGE_BACKEND == 'sqlite':
+        conn = get_sqlite_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT MAX(seq) FROM message_logs WHERE course=? AND year=? AND section=? AND stream=?',
+                               (course, year, section, stream)).fetchone()
+            seq = (row[0] or 0) + 1
+            conn.execute('INSERT INTO message_logs (course, year, section, stream, seq, doc) VALUES (?, ?, ?, ?, ?, ?)',
+                         (course, year, section, stream, seq, json.dumps(record)))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return seq
+    with section_lock(course, year, section):
+        log_dir = get_log_dir(course, year, section, stream)
+        os.makedirs(log_dir, exist_ok=True)
+        index_path = os.path.join(log_dir, 'index')
+        count = log_count(course, year, section, stream)
+        seq = count + 1
+        segment_path = _log_segment_path(log_dir, seq)
+        # The line is durable before the index points at it; a crash in
+        # between leaves an unreferenced line that readers never see
+        with open(segment_path, 'ab') as f:
+            offset = f.tell()
+            f.write((json.dumps(record) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(index_path, 'ab') as f:
+            f.truncate(count * LOG_OFFSET.size)  # drop a torn trailing entry
+            f.write(LOG_OFFSET.pack(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        if seq % LOG_SEGMENT_SIZE == 1:
+            _fsync_dir(log_dir)
+    return seq
+
+
+def log_page(course, year, section, stream, before=None, after=None, limit=LOG_PAGE_DEFAULT):
+    # Up to limit records (each with 'seq'), oldest first: the first ones after
+    # `after`, otherwise the latest ones before `before` (or overall)
+    limit = max(1, min(int(limit), LOG_PAGE_MAX))
+    if STORAGE_BACKEND == 'sqlite':
+        conn = get_sqlite_conn()
+        base = 'SELECT seq, doc FROM message_logs WHERE course=? AND year=? AND section=? AND stream=?'
+        params = (course, year, section, stream)
+        if after is not None:
+            rows = conn.execute(base + ' AND seq > ? ORDER BY seq LIMIT ?', params + (after, limit)).fetchall()
+        else:
+            upper = before if before is not None else 2 ** 62
+            rows = conn.execute(base + ' AND seq < ? ORDER BY seq DESC LIMIT ?', params + (upper, limit)).fetchall()[::-1]
+        return [dict(json.loads(doc), seq=seq) for seq, doc in rows]
+    count = log_count(course, year, section, stream)
+    if after is not None:
+        lo = max(after, 0) + 1
+        hi = min(count, lo + limit - 1)
+    else:
+        hi = count if before is None else min(count, before - 1)
+        lo = max(1, hi - limit + 1)
+    if hi < lo:
+        return []
+    log_dir = get_log_dir(course, year, section, stream)
+    with open(os.path.join(log_dir, 'index'), 'rb') as f:
+        f.seek((lo - 1) * LOG_OFFSET.size)
+        offsets = [o for (o,) in LOG_OFFSET.iter_unpack(f.read((hi - lo + 1) * LOG_OFFSET.size))]
+    out = []
+    segment, segment_path = None, None
+    try:
+        for seq, offset in enumerate(offsets, lo):
+            path = _log_segment_path(log_dir, seq)
+            if path != segment_path:
+                if segment is not None:
+                    segment.close()
+                segment, segment_path = open(path, 'rb'), path
+            segment.seek(offset)
+            out.append(dict(json.loads(segment.readline()), seq=seq))
+    finally:
+        if segment is not None:
+            segment.close()
+    return out
+
+
+def parse_log_cursor():
+    # Reads before/after (alias since)/limit query args; raises ValueError on bad input
+    before = request.args.get('before')
+    after = request.args.get('after') or request.args.get('since')
+    limit = request.args.get('limit')
+    return (int(before) if before else None,
+            int(after) if after else None,
+            int(limit) if limit else LOG_PAGE_DEFAULT)
+
+# Upload paths
+# Uploaded files live in hash-prefix shards, UPLOAD_FOLDER/ab/cd/<name> where
+# abcd starts the SHA-1 of the name, so no directory grows past a few thousand
+# entries. URLs stay /uploads/<name>. Files from the old flat layout are still
+# found until the migrator below has moved them into their shards.
+
+UPLOAD_MIGRATION_BATCH = 200
+# Stored names are unique and never rewritten, so browsers may keep them for a year
+UPLOAD_CACHE_SECONDS = int(os.getenv('UPLOAD_CACHE_SECONDS', str(365 * 24 * 3600)))
+# Hand file bodies to the front server: '' (serve here), 'sendfile' (X-Sendfile:
+# Apache/lighttpd) or 'accel' (nginx X-Accel-Redirect to an internal location
+# mapped onto UPLOAD_FOLDER at UPLOAD_ACCEL_PREFIX)
+UPLOAD_OFFLOAD = os.getenv('UPLOAD_OFFLOAD', '').strip().lower()
+UPLOAD_ACCEL_PREFIX = '/' + os.getenv('UPLOAD_ACCEL_PREFIX', '/protected-uploads/').strip('/') + '/'
+
+
+def upload_shard_path(name):
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return os.path.join(UPLOAD_FOLDER, digest[:2], digest[2:4], name)
+
+
+def is_upload_name(name):
+    return bool(name) and os.path.basename(name) == name and not name.startswith('.')
+
+
+def resolve_upload(name):
+    # Existing file for a stored name (sharded, else legacy flat); the sharded path if neither exists
+    path = upload_shard_path(name)
+    if not os.path.exists(path):
+        flat = os.path.join(UPLOAD_FOLDER, name)
+        if os.path.isfile(flat):
+            return flat
+    return path
+
+
+def upload_response(name, path, etag=None):
+    # The stored name doubles as a strong ETag; Range and If-None-Match/
+    # If-Modified-Since are answered with 206/304 by make_conditional
+    etag = etag or name
+    if UPLOAD_OFFLOAD == 'accel':
+        rel = os.path.relpath(path, UPLOAD_FOLDER).replace(os.sep, '/')
+        stat = os.stat(path)
+        response = Response(mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response.set_etag(etag)
+        response.last_modified = int(stat.st_mtime)
+        response.make_conditional(request)
+        if response.status_code != 304:
+            # nginx follows the redirect whatever the status, so a 304 goes without it
+            response.headers['X-Accel-Redirect'] = UPLOAD_ACCEL_PREFIX + quote(rel)
+    else:
+        response = send_file(path, etag=etag, conditional=True, max_age=UPLOAD_CACHE_SECONDS)
+    response.cache_control.public = True
+    response.cache_control.max_age = UPLOAD_CACHE_SECONDS
+    response.cache_control.immutable = True
+    return response
+
+
+def new_upload_path(name):
+    # Where to write a newly uploaded file
+    path = upload_shard_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def uploads_lock():
+    # Serializes moves by the migrator with deletes
+    return file_lock(os.path.join(UPLOAD_FOLDER, '.uploads.lock'))
+
+
+def remove_upload(name):
+    if not is_upload_name(name):
+        return
+    with uploads_lock():
+        try:
+            os.remove(resolve_upload(name))
+        except OSError:
+            pass
+    drop_thumbnails(name)
+
+
+def migrate_flat_uploads(pause=0.0):
+    # Moves flat files into their shards; safe to stop and rerun at any point,
+    # since whatever is still flat is what remains to do. Returns files moved.
+    moved = 0
+    while True:
+        batch = []
+        with os.scandir(UPLOAD_FOLDER) as entries:
+            for entry in entries:
+                if entry.is_file() and is_upload_name(entry.name):
+                    batch.append(entry.name)
+                    if len(batch) >= UPLOAD_MIGRATION_BATCH:
+                        break
+        if not batch:
+            return moved
+        for name in batch:
+            with uploads_lock():
+                flat = os.path.join(UPLOAD_FOLDER, name)
+                if not os.path.isfile(flat):
+                    continue
+                target = new_upload_path(name)
+                if os.path.exists(target):
+                    os.remove(flat)  # already moved by an earlier, interrupted run
                 else:
-                    with smtplib.SMTP_SSL(SMTP_HOST, port, context=ssl.create_default_context(), timeout=20) as server:
-                        server.login(SMTP_USER, SMTP_APP_PASSWORD)
-                        server.send_message(msg)
-                return True, None
-            except Exception as e:
-                last_error = e
-
-        return False, str(last_error) if last_error else 'SMTP send failed'
-    except Exception as e:
-        return False, str(e)
+                    os.replace(flat, target)
+                moved += 1
+        if pause:
+            time.sleep(pause)
+
+
+def start_upload_migration():
+    # Background migration in one process at a time; the others skip it
+    if fcntl is None:
+        return
+    fd = os.open(os.path.join(UPLOAD_FOLDER, '.migrate.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return
+
+    def run():
+        try:
+            moved = migrate_flat_uploads(pause=0.05)
+            if moved:
+                print(f"Moved {moved} uploads into sharded directories")
+        except Exception as e:
+            print(f"Upload migration stopped: {e}")
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    threading.Thread(target=run, name='upload-migration', daemon=True).start()
+
+# Image thumbnails
+# /uploads/<photo>?w=N serves a downscaled copy, N rounded up to one of
+# THUMB_WIDTHS, from UPLOAD_FOLDER/.thumbs/<w>/<shard>/<name>. Copies are built on
+# first request, or ahead of time by a background worker when a photo is
+# uploaded, and evicted least-recently-used first once the cache passes
+# THUMB_CACHE_MAX_BYTES. Removing a photo drops its copies. Without Pillow the
+# original is served.
+
+THUMB_DIR = os.path.join(UPLOAD_FOLDER, '.thumbs')
+THUMB_WIDTHS = (48, 96, 160, 320)
+THUMB_WARM_WIDTHS = (96, 160)  # the sizes the UI asks for
+THUMB_CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+THUMB_TOUCH_SECONDS = 3600  # refresh a hit's mtime (its LRU stamp) at most hourly
+THUMB_QUEUE = queue.SimpleQueue()
+THUMB_STATE = {'bytes': None, 'worker': None}  # this process's estimate of the cache size
+THUMB_LOCK = threading.Lock()
+
+
+def thumb_width(value):
+    # Requested width rounded up to a cached size; None means serve the original
+    try:
+        width = int(value)
+    except (TypeError, ValueError):
+        return None
+    if width <= 0:
+        return None
+    for size in THUMB_WIDTHS:
+        if width <= size:
+            return size
+    return None
+
+
+def thumb_path(name, width):
+    return os.path.join(THUMB_DIR, str(width), os.path.relpath(upload_shard_path(name), UPLOAD_FOLDER))
+
+
+def make_thumbnail(name, width):
+    # Cached thumbnail path, built if missing; None when the upload can't be thumbnailed
+    path = thumb_path(name, width)
+    try:
+        stat = os.stat(path)
+        if time.time() - stat.st_mtime > THUMB_TOUCH_SECONDS:
+            os.utime(path)
+        return path
+    except OSError:
+        pass
+    if Image is None or not allowed_file(name):
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with Image.open(resolve_upload(name)) as img:
+            fmt = img.format
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((width, width * 4))
+            if fmt == 'JPEG' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(tmp, format=fmt)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return None
+    note_thumbnail_bytes(os.path.getsize(path))
+    return path
+
+
+def note_thumbnail_bytes(size):
+    with THUMB_LOCK:
+        total = THUMB_STATE['bytes']
+        if total is not None and total + size <= THUMB_CACHE_MAX_BYTES:
+            THUMB_STATE['bytes'] = total + size
+            return
+    # First thumbnail in this process, or over the cap: measure (and trim) for real
+    total = evict_thumbnails()
+    with THUMB_LOCK:
+        THUMB_STATE['bytes'] = total
+
+
+def evict_thumbnails():
+    # Deletes the least recently used copies down to 80% of the cap; returns the bytes kept
+    entries = []
+    for root, _, files in os.walk(THUMB_DIR):
+        for fn in files:
+            if fn.endswith('.tmp'):
+                continue
+            path = os.path.join(root, fn)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if total > THUMB_CACHE_MAX_BYTES:
+        entries.sort()
+        for _, size, path in entries:
+            if total <= THUMB_CACHE_MAX_BYTES * 0.8:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+    return total
+
+
+def drop_thumbnails(name):
+    for width in THUMB_WIDTHS:
+        try:
+            os.remove(thumb_path(name, width))
+        except OSError:
+            pass
+
+
+def queue_thumbnails(name):
+    # Pre-builds the UI sizes for a newly uploaded photo off the request thread
+    if Image is None or not name:
+        return
+    with THUMB_LOCK:
+        if THUMB_STATE['worker'] is None:
+            worker = threading.Thread(target=thumbnail_worker, name='thumbnails', daemon=True)
+            worker.start()
+            THUMB_STATE['worker'] = worker
+    THUMB_QUEUE.put(name)
+
+
+def thumbnail_worker():
+    while True:
+        name = THUMB_QUEUE.get()
+        for width in THUMB_WARM_WIDTHS:
+            make_thumbnail(name, width)
+
+
+# Content-addressed uploads
+# Multipart file parts are spooled straight into UPLOAD_TMP_DIR while their
+# SHA-256 is computed (see UploadRequest). Attachments are then stored once per
+# content as '<sha256>.<ext>' (in its upload shard) and reference counted, so the
+# same file attached in several places takes one blob; records keep pointing at
+# it through 'storedFilename'/'url' as before. Files stored before this have no
+# reference count and are treated as having a single owner.
+
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_FOLDER, '.incoming')
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+
+class HashingUploadFile:
+    # File object handed to the multipart parser: hashes while spooling to disk
+    def __init__(self):
+        self._file = tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, prefix='part-')
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadFile()
+
+
+app.request_class = UploadRequest
+
+
+# Reference counts live under a dot directory so they are never listed as a course
+BLOB_REFS_DIR = os.path.join(DATA_DIR, '.blob_refs')
+LEGACY_BLOB_REFS_DIR = os.path.join(DATA_DIR, 'blob_refs')
+
+
+def blob_lock():
+    return file_lock(os.path.join(DATA_DIR, '.blobs.lock'))
+
+
+def get_blob_refs(name):
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_sqlite_conn().execute('SELECT refs FROM blob_refs WHERE name=?', (name,)).fetchone()
+        return row[0] if row else None
+    return _read_json_file(os.path.join(BLOB_REFS_DIR, name + '.json'), None)
+
+
+def set_blob_refs(name, refs):
+    # refs=None forgets the blob
+    if STORAGE_BACKEND == 'sqlite':
+        conn = get_sqlite_conn()
+        if refs is None:
+            conn.execute('DELETE FROM blob_refs WHERE name=?', (name,))
+        else:
+            conn.execute('INSERT OR REPLACE INTO blob_refs (name, refs) VALUES (?, ?)', (name, refs))
+        return
+    path = os.path.join(BLOB_REFS_DIR, name + '.json')
+    if refs is None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write_json(path, refs)
+
+
+def _spool_with_hash(stream):
+    # For file objects that did not come through UploadRequest
+    tmp = tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, prefix='part-')
+    digest = hashlib.sha256()
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        tmp.write(chunk)
+    return tmp, digest.hexdigest()
+
+
+def store_upload(file):
+    # Stores an uploaded FileStorage as a content-addressed blob, adds a
+    # reference and returns (original secure filename, stored filename)
+    orig_fn = secure_filename(file.filename)
+    ext = orig_fn.rsplit('.', 1)[-1].lower() if '.' in orig_fn else ''
+    stream = file.stream
+    if isinstance(stream, HashingUploadFile):
+        tmp, digest = stream, stream.sha256.hexdigest()
+    else:
+        tmp, digest = _spool_with_hash(stream)
+    tmp.flush()
+    os.fsync(tmp.fileno())
+    stored = f"{digest}.{ext}" if ext else digest
+    with blob_lock():
+        path = resolve_upload(stored)
+        if not os.path.exists(path):
+            path = new_upload_path(stored)
+            # The spool file is already on the same filesystem: link it into place
+            try:
+                os.link(tmp.name, path)
+            except OSError:
+                import shutil
+                shutil.copyfile(tmp.name, path)
+            os.chmod(path, 0o644)
+            _fsync_dir(os.path.dirname(path))
+            refs = 0
+        else:
+            refs = get_blob_refs(stored) or 0
+        set_blob_refs(stored, refs + 1)
+    if tmp is not stream:
+        tmp.close()
+    return orig_fn, stored
+
+
+def release_upload(stored):
+    # Drops one reference; the blob is deleted with its last one
+    if not is_upload_name(stored):
+        return
+    with blob_lock():
+        refs = get_blob_refs(stored)
+        if refs is not None and refs > 1:
+            set_blob_refs(stored, refs - 1)
+            return
+        set_blob_refs(stored, None)
+        remove_upload(stored)
 
 # Helper functions for data management
 
+# Hierarchy cache
+# The course/year/section directory tree is scanned once and kept in memory as
+# {course: {year: [sections]}} (names sorted). Routes that add or delete a
+# course, year or section call invalidate_hierarchy, which also rewrites
+# DATA_DIR/.hierarchy so other worker processes rescan; a cache hit costs one
+# stat of that file and no directory reads. Directories created by other means
+# (e.g. restored by hand) appear after the next invalidation or restart.
+
+HIERARCHY_STAMP_FILE = os.path.join(DATA_DIR, '.hierarchy')
+HIERARCHY = {'stamp': None, 'tree': None}
+HIERARCHY_LOCK = threading.Lock()
+
+
+def _subdirs(path):
+    try:
+        with os.scandir(path) as entries:
+            return sorted(e.name for e in entries if e.is_dir() and not e.name.startswith('.'))
+    except OSError:
+        return []
+
+
+def load_hierarchy():
+    # The read-only cached tree
+    stamp = _file_stamp(HIERARCHY_STAMP_FILE)
+    with HIERARCHY_LOCK:
+        if HIERARCHY['tree'] is not None and HIERARCHY['stamp'] == stamp:
+            return HIERARCHY['tree']
+    tree = {}
+    for course in _subdirs(DATA_DIR):
+        course_path = os.path.join(DATA_DIR, course)
+        tree[course] = {year: _subdirs(os.path.join(course_path, year)) for year in _subdirs(course_path)}
+    with HIERARCHY_LOCK:
+        HIERARCHY['tree'] = tree
+        HIERARCHY['stamp'] = stamp
+    return tree
+
+
+def invalidate_hierarchy():
+    with HIERARCHY_LOCK:
+        HIERARCHY['tree'] = None
+    atomic_write_json(HIERARCHY_STAMP_FILE, {'changedAt': time.time()})
+
+
 def get_courses():
-    courses = []
-    if os.path.exists(DATA_DIR):
-        for item in os.listdir(DATA_DIR):
-            if os.path.isdir(os.path.join(DATA_DIR, item)):
-                courses.append(item)
-    return courses
+    return list(load_hierarchy())
 
 
 def get_years(course):
-    years = []
-    course_path = os.path.join(DATA_DIR, course)
-    if os.path.exists(course_path):
-        for item in os.listdir(course_path):
-            if os.path.isdir(os.path.join(course_path, item)):
-                years.append(item)
-    return years
+    return list(load_hierarchy().get(course) or {})
 
 
 def get_sections(course, year):
-    sections = []
-    year_path = os.path.join(DATA_DIR, course, year)
-    if os.path.exists(year_path):
-        for item in os.listdir(year_path):
-            if os.path.isdir(os.path.join(year_path, item)):
-                sections.append(item)
-    return sections
+    return list((load_hierarchy().get(course) or {}).get(year) or [])
+
+
+def section_counts(course, year, section):
+    # From the section document cache, so counts follow every edit
+    students = read_section_doc(course, year, section, 'students')
+    admins = read_section_doc(course, year, section, 'secondary_admin')
+    attendance = read_section_doc(course, year, section, 'attendance')
+    return {
+        'students': len(students) if isinstance(students, list) else 0,
+        'teachers': len(admins) if isinstance(admins, list) else 0,
+        'subjects': len(attendance.get('subjects') or []) if isinstance(attendance, dict) else 0,
+    }
 
 
 def get_students(course, year, section):
     students_path = os.path.join(DATA_DIR, course, year, section, "students.json")
-    if os.path.exists(students_path):
-        try:
-            with open(students_path, 'r') as f:
-                # Check if file is empty
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading students file: {e}")
-            return []
-    return []
+    data = read_section_json((course, year, section, 'students'), students_path, list, 'students')
+    return data if data is not None else []
 
 
 def get_activities(course, year, section):
     activities_path = os.path.join(DATA_DIR, course, year, section, "activities.json")
-    if os.path.exists(activities_path):
-        try:
-            with open(activities_path, 'r') as f:
-                # Check if file is empty
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading activities file: {e}")
-            return []
-    return []
+    data = read_section_json((course, year, section, 'activities'), activities_path, list, 'activities')
+    return data if data is not None else []
 
 
 def save_students(course, year, section, students):
@@ -297,8 +1876,9 @@ def save_students(course, year, section, students):
         os.makedirs(section_path)
 
     students_path = os.path.join(section_path, "students.json")
-    with open(students_path, 'w') as f:
-        json.dump(students, f, indent=2)
+    write_section_json((course, year, section, 'students'), students_path, students)
+    drop_id_index(course, year, section, 'students')
+    index_search_section(course, year, section, students)
 
 
 def save_activities(course, year, section, activities):
@@ -307,24 +1887,15 @@ def save_activities(course, year, section, activities):
         os.makedirs(section_path)
 
     activities_path = os.path.join(section_path, "activities.json")
-    with open(activities_path, 'w') as f:
-        json.dump(activities, f, indent=2)
+    write_section_json((course, year, section, 'activities'), activities_path, activities)
+    drop_id_index(course, year, section, 'activities')
 
 # Secondary admin (faculty profiles per section)
 
 def get_secondary_admins(course, year, section):
     path = os.path.join(DATA_DIR, course, year, section, 'secondary_admin.json')
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading secondary_admin file: {e}")
-            return []
-    return []
+    data = read_section_json((course, year, section, 'secondary_admin'), path, list, 'secondary_admin')
+    return data if data is not None else []
 
 
 def save_secondary_admins(course, year, section, data):
@@ -332,8 +1903,88 @@ def save_secondary_admins(course, year, section, data):
     if not os.path.exists(section_path):
         os.makedirs(section_path)
     path = os.path.join(section_path, 'secondary_admin.json')
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    write_section_json((course, year, section, 'secondary_admin'), path, data)
+    drop_id_index(course, year, section, 'secondary_admin')
+    invalidate_auth_context(course, year, section)
+
+# Section ids
+# Students, professors and activities stay ordered lists on disk and in the
+# API. By-id access goes through an {id: item} dict built once per loaded list
+# and kept with it (rebuilt when the list is reloaded, resized or saved). New
+# ids come from per-section counters in sequences.json, so an id freed by a
+# delete is never handed out again.
+
+SECTION_ID_INDEX = {}  # (course, year, section, kind) -> (list, its length, {id: item})
+SECTION_ID_INDEX_LOCK = threading.Lock()
+
+
+def items_by_id(course, year, section, kind, items):
+    key = (course, year, section, kind)
+    with SECTION_ID_INDEX_LOCK:
+        cached = SECTION_ID_INDEX.get(key)
+    if cached is not None and cached[0] is items and cached[1] == len(items):
+        return cached[2]
+    index = {}
+    for item in items:
+        if isinstance(item, dict) and item.get('id'):
+            index.setdefault(item['id'], item)  # first wins, as the old list scans did
+    with SECTION_ID_INDEX_LOCK:
+        SECTION_ID_INDEX[key] = (items, len(items), index)
+    return index
+
+
+def drop_id_index(course, year, section, kind):
+    with SECTION_ID_INDEX_LOCK:
+        SECTION_ID_INDEX.pop((course, year, section, kind), None)
+
+
+def find_student(course, year, section, student_id, students=None):
+    if students is None:
+        students = get_students(course, year, section)
+    return items_by_id(course, year, section, 'students', students).get(student_id)
+
+
+def find_secondary_admin(course, year, section, prof_id, admins=None):
+    if admins is None:
+        admins = get_secondary_admins(course, year, section)
+    return items_by_id(course, year, section, 'secondary_admin', admins).get(prof_id)
+
+
+def find_activity(course, year, section, activity_id, activities=None):
+    if activities is None:
+        activities = get_activities(course, year, section)
+    return items_by_id(course, year, section, 'activities', activities).get(activity_id)
+
+
+def get_sequences(course, year, section):
+    path = os.path.join(DATA_DIR, course, year, section, 'sequences.json')
+    data = read_section_json((course, year, section, 'sequences'), path, dict, 'sequences')
+    return data if data is not None else {}
+
+
+def save_sequences(course, year, section, data):
+    section_path = os.path.join(DATA_DIR, course, year, section)
+    os.makedirs(section_path, exist_ok=True)
+    write_section_json((course, year, section, 'sequences'), os.path.join(section_path, 'sequences.json'), data)
+
+
+def allocate_id(course, year, section, prefix, index):
+    # Next '<prefix>_NNN' for the section; the caller holds the section lock.
+    # A counter seen for the first time starts past the highest id in index.
+    seqs = get_sequences(course, year, section)
+    n = seqs.get(prefix)
+    if n is None:
+        n = 0
+        for item_id in index:
+            head, _, num = str(item_id).rpartition('_')
+            if head == prefix and num.isdigit():
+                n = max(n, int(num))
+    n += 1
+    while f"{prefix}_{n:03d}" in index:
+        n += 1
+    seqs[prefix] = n
+    save_sequences(course, year, section, seqs)
+    return f"{prefix}_{n:03d}"
 
 # Attendance helpers
 
@@ -346,16 +1997,9 @@ def get_attendance_path(course, year, section):
 
 def load_attendance(course, year, section):
     path = get_attendance_path(course, year, section)
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return {"subjects": [], "records": {}}
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading attendance file: {e}")
-            return {"subjects": [], "records": {}}
+    data = read_section_json((course, year, section, 'attendance'), path, lambda: {"subjects": [], "records": {}}, 'attendance')
+    if data is not None:
+        return data
     # If file doesn't exist, create default
     data = {"subjects": [], "records": {}}
     save_attendance(course, year, section, data)
@@ -364,17 +2008,22 @@ def load_attendance(course, year, section):
 
 def save_attendance(course, year, section, data):
     path = get_attendance_path(course, year, section)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    write_section_json((course, year, section, 'attendance'), path, data)
 
 # Attendance records utilities (supports present/absent counts)
 
-def get_att_rec_entry(data, subject, student_id):
-    recs = data.setdefault('records', {}).setdefault(subject, {})
+def get_att_rec_entry(data, subject, student_id, current=False):
+    # Read-only: loaded documents are shared through the section cache.
+    # current: the section is at SCHEMA_VERSION, so entries are day -> count maps
+    if isinstance(data, AttendanceColumns):
+        return data.entry(subject, student_id)
+    recs = (data.get('records') or {}).get(subject) or {}
     entry = recs.get(student_id)
-    # If legacy list format, treat as present dates with count 1
     if entry is None:
         return {'present': {}, 'absent': {}}
+    if current and isinstance(entry, dict):
+        return {'present': dict(entry.get('present') or {}), 'absent': dict(entry.get('absent') or {})}
+    # If legacy list format, treat as present dates with count 1
     if isinstance(entry, list):
         counts = {}
         for dt in entry:
@@ -388,11 +2037,132 @@ def get_att_rec_entry(data, subject, student_id):
 
 
 def save_att_rec_entry(data, subject, student_id, entry):
+    # Build running totals from the previous state before it is overwritten
+    ensure_att_totals(data)
     recs = data.setdefault('records', {}).setdefault(subject, {})
     # Clean zero counts
     pr = {k: int(v) for k, v in (entry.get('present') or {}).items() if int(v) > 0}
     ab = {k: int(v) for k, v in (entry.get('absent') or {}).items() if int(v) > 0}
     recs[student_id] = {'present': pr, 'absent': ab}
+    update_att_totals(data, subject, student_id, pr, ab)
+
+# Attendance running totals
+# attendance.json keeps 'totals' (subject -> studentId -> counts) and
+# 'studentTotals' (studentId -> counts across subjects), where counts is
+# {'present', 'absent', 'lastMarked'}. They are adjusted whenever one
+# student's entry changes, so summaries never rescan the records.
+
+
+def _att_entry_totals(pr, ab):
+    days = list(pr) + list(ab)
+    return {'present': sum(pr.values()), 'absent': sum(ab.values()), 'lastMarked': max(days) if days else None}
+
+
+def ensure_att_totals(data):
+    # One-time backfill for documents written before totals existed
+    if 'totals' in data and 'studentTotals' in data:
+        return False
+    totals = {}
+    for subject in (data.get('records') or {}):
+        per_subject = totals.setdefault(subject, {})
+        for student_id in data['records'][subject]:
+            entry = get_att_rec_entry(data, subject, student_id)
+            per_subject[student_id] = _att_entry_totals(entry['present'], entry['absent'])
+    data['totals'] = totals
+    data['studentTotals'] = {}
+    for per_subject in totals.values():
+        for student_id, t in per_subject.items():
+            _add_student_totals(data, student_id, t, 1)
+    return True
+
+
+def _add_student_totals(data, student_id, t, sign):
+    overall = data['studentTotals'].setdefault(student_id, {'present': 0, 'absent': 0, 'lastMarked': None})
+    overall['present'] += sign * t['present']
+    overall['absent'] += sign * t['absent']
+    if sign > 0 and t['lastMarked'] and (overall['lastMarked'] or '') < t['lastMarked']:
+        overall['lastMarked'] = t['lastMarked']
+
+
+def _refresh_student_last_marked(data, student_id):
+    # Only this student's per-subject totals are consulted (O(subjects))
+    overall = data['studentTotals'].get(student_id)
+    if overall is None:
+        return
+    marks = [per[student_id]['lastMarked'] for per in data['totals'].values()
+             if student_id in per and per[student_id]['lastMarked']]
+    overall['lastMarked'] = max(marks) if marks else None
+    if not overall['present'] and not overall['absent'] and not marks:
+        data['studentTotals'].pop(student_id, None)
+
+
+def update_att_totals(data, subject, student_id, pr, ab):
+    per_subject = data['totals'].setdefault(subject, {})
+    old = per_subject.get(student_id)
+    new = _att_entry_totals(pr, ab)
+    if old:
+        _add_student_totals(data, student_id, old, -1)
+    per_subject[student_id] = new
+    _add_student_totals(data, student_id, new, 1)
+    if old and old.get('lastMarked') and old['lastMarked'] != new['lastMarked']:
+        _refresh_student_last_marked(data, student_id)
+
+
+def drop_att_subject_totals(data, subject):
+    ensure_att_totals(data)
+    per_subject = data['totals'].pop(subject, None) or {}
+    for student_id, t in per_subject.items():
+        _add_student_totals(data, student_id, t, -1)
+        _refresh_student_last_marked(data, student_id)
+
+
+def att_totals_view(t):
+    held = t['present'] + t['absent']
+    return {
+        'present': t['present'],
+        'absent': t['absent'],
+        'percentage': round(t['present'] * 100.0 / held, 2) if held else None,
+        'lastMarked': t['lastMarked']
+    }
+
+
+def normalize_att_dates(dates):
+    # Normalize dates to YYYY-MM-DD
+    norm_dates = []
+    for d in dates or []:
+        try:
+            norm_dates.append(str(d)[:10])
+        except Exception:
+            continue
+    return norm_dates
+
+
+def apply_att_change(data, subject, student_id, norm_dates, status, op, count):
+    # Apply one present/absent change for a student to a loaded attendance document
+    entry = get_att_rec_entry(data, subject, student_id)
+    if status in {'present', 'absent'} or op or (count is not None):
+        # New model: counts per date, with status present/absent and operations
+        if status not in {'present', 'absent'}:
+            status = 'present'
+        if not op:
+            op = 'increment'
+        # apply per date
+        for day in norm_dates:
+            cur = int(entry[status].get(day, 0))
+            if op == 'set':
+                entry[status][day] = max(int(count or 0), 0)
+            elif op in {'decrement', 'dec'}:
+                entry[status][day] = max(cur - (int(count or 1)), 0)
+            else:  # increment default
+                entry[status][day] = cur + (int(count or 1))
+    else:
+        # Legacy behavior: replace present dates with single count each
+        entry['present'] = {}
+        for day in norm_dates:
+            entry['present'][day] = 1
+        # Keep existing absent counts intact
+    save_att_rec_entry(data, subject, student_id, entry)
+    return entry
 
 
 def expand_counts(counts):
@@ -406,6 +2176,339 @@ def expand_counts(counts):
             out.extend([d] * n)
     return sorted(out)
 
+# Columnar attendance
+# attendance.json stays the document every writer edits. Readers that walk a
+# whole section (the windowed defaulter report, the attendance matrix, a
+# student's own records) instead use attendance.cols, a snapshot built from it:
+#   b'ATTC', u32 header length, JSON header {stamp, byteorder, base, days,
+#   declared, subjects, students, pairs}, padding to 2 bytes, then per (subject, student)
+#   pair a present and an absent uint16 vector indexed by day ordinal - base.
+# declared is the document's own subject list; subjects and student ids of the
+# records are interned once in the header. The vectors are
+# read straight out of an mmap. The header stamp is the JSON file's stamp (the
+# document version under SQLite), and a stale snapshot is rebuilt on the next
+# read. Documents the format can't reproduce exactly (odd day keys, zero or
+# >65535 counts) get no snapshot, and readers stay on the JSON.
+
+ATT_COLUMNS_MAGIC = b'ATTC'
+ATT_COLUMNS_FILE = 'attendance.cols'
+ATT_COLUMNS_LOCK = threading.Lock()
+ATT_COLUMNS_OPEN = {}  # (course, year, section) -> AttendanceColumns
+
+
+class AttendanceColumns:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:4] != ATT_COLUMNS_MAGIC:
+            raise ValueError('not an attendance columns file')
+        (size,) = struct.unpack_from('<I', self._mm, 4)
+        header = json.loads(self._mm[8:8 + size])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('attendance columns written on a different byte order')
+        self.stamp = header['stamp']
+        self.declared = header['declared']
+        self.subjects = header['subjects']
+        self.students = header['students']
+        self.base = header['base']
+        self.days = [date.fromordinal(self.base + i).isoformat() for i in range(header['days'])]
+        offset = 8 + size + (8 + size) % 2
+        self._values = memoryview(self._mm)[offset:].cast('H')
+        self._pairs = {}
+        for k, (subj, stu) in enumerate(header['pairs']):
+            self._pairs.setdefault(self.subjects[subj], {})[self.students[stu]] = k
+
+    def student_ids(self, subject):
+        return list(self._pairs.get(subject, {}))
+
+    def _vectors(self, subject, student_id):
+        k = self._pairs.get(subject, {}).get(student_id)
+        if k is None:
+            return None
+        n = len(self.days)
+        return self._values[2 * k * n:(2 * k + 1) * n], self._values[(2 * k + 1) * n:(2 * k + 2) * n]
+
+    def entry(self, subject, student_id):
+        # Same answer as get_att_rec_entry on the source document
+        vectors = self._vectors(subject, student_id)
+        if vectors is None:
+            return {'present': {}, 'absent': {}}
+        pr, ab = vectors
+        days = self.days
+        return {'present': {days[i]: n for i, n in enumerate(pr) if n},
+                'absent': {days[i]: n for i, n in enumerate(ab) if n}}
+
+    def counts(self, subject, student_id, date_from='', date_to='9999-99-99'):
+        # (present, absent) over days with date_from <= day <= date_to (string order, as the JSON path)
+        vectors = self._vectors(subject, student_id)
+        if vectors is None:
+            return 0, 0
+        lo, hi = bisect.bisect_left(self.days, date_from), bisect.bisect_right(self.days, date_to)
+        return sum(vectors[0][lo:hi]), sum(vectors[1][lo:hi])
+
+    def close(self):
+        self._values.release()
+        self._mm.close()
+
+
+def attendance_stamp(course, year, section):
+    # Identifies the attendance document as stored; None when it doesn't exist
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_sqlite_conn().execute('SELECT version FROM section_docs WHERE course=? AND year=? AND section=? '
+                                        "AND kind='attendance'", (course, year, section)).fetchone()
+        return ['sqlite', row[0]] if row else None
+    stamp = _file_stamp(os.path.join(DATA_DIR, course, year, section, 'attendance.json'))
+    return list(stamp) if stamp else None
+
+
+def build_attendance_columns(data, path, stamp):
+    # Converter: writes the snapshot for data; False when it can't be represented exactly
+    records = data.get('records') or {}
+    entries = []
+    day_ordinals = {}
+    for subject in records:
+        for student_id in records[subject]:
+            entry = get_att_rec_entry(data, subject, student_id)
+            for counts in (entry['present'], entry['absent']):
+                for day, n in counts.items():
+                    if not 0 < n <= 0xFFFF:
+                        return False
+                    if day not in day_ordinals:
+                        try:
+                            parsed = date.fromisoformat(day)
+                        except ValueError:
+                            return False
+                        if parsed.isoformat() != day:
+                            return False
+                        day_ordinals[day] = parsed.toordinal()
+            entries.append((subject, student_id, entry))
+    base = min(day_ordinals.values(), default=0)
+    ndays = max(day_ordinals.values(), default=base - 1) - base + 1
+    subjects = list(records)
+    subject_index = {s: i for i, s in enumerate(subjects)}
+    students, student_index, pairs = [], {}, []
+    values = array('H', bytes(2 * 2 * ndays * len(entries)))
+    for k, (subject, student_id, entry) in enumerate(entries):
+        if student_id not in student_index:
+            student_index[student_id] = len(students)
+            students.append(student_id)
+        pairs.append([subject_index[subject], student_index[student_id]])
+        for offset, counts in ((2 * k * ndays, entry['present']), ((2 * k + 1) * ndays, entry['absent'])):
+            for day, n in counts.items():
+                values[offset + day_ordinals[day] - base] = n
+    declared = data.get('subjects') if isinstance(data.get('subjects'), list) else []
+    header = json.dumps({'stamp': stamp, 'byteorder': sys.byteorder, 'base': base, 'days': ndays,
+                         'declared': declared, 'subjects': subjects, 'students': students, 'pairs': pairs}).encode('utf-8')
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + ATT_COLUMNS_FILE + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(ATT_COLUMNS_MAGIC + struct.pack('<I', len(header)) + header)
+            if (8 + len(header)) % 2:
+                f.write(b'\0')
+            values.tofile(f)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+def load_attendance_columns(course, year, section, data=None):
+    # Current snapshot for the section, rebuilt from the document if stale; None
+    # when the section has no attendance document or it can't be represented.
+    # data, when given, must have been read after this call started.
+    stamp = attendance_stamp(course, year, section)  # taken before the document is read
+    if stamp is None:
+        return None
+    key = (course, year, section)
+    with ATT_COLUMNS_LOCK:
+        cols = ATT_COLUMNS_OPEN.get(key)
+    if cols is not None and cols.stamp == stamp:
+        return cols
+    path = os.path.join(DATA_DIR, course, year, section, ATT_COLUMNS_FILE)
+    try:
+        cols = AttendanceColumns(path)
+    except (OSError, ValueError, KeyError):
+        cols = None
+    if cols is None or cols.stamp != stamp:
+        if cols is not None:
+            cols.close()
+        if data is None:
+            data = read_section_uncached(course, year, section, 'attendance', {})
+        if not isinstance(data, dict) or not build_attendance_columns(data, path, stamp):
+            return None
+        cols = AttendanceColumns(path)
+    with ATT_COLUMNS_LOCK:
+        # Older snapshots are left to the garbage collector: readers may still hold them
+        ATT_COLUMNS_OPEN[key] = cols
+    return cols
+
+# Attendance defaulter reports
+# Sections are loaded with plain file reads (no shared caches or locks) and
+# reduced to per-student present/absent counts per subject. The CLI spreads
+# the loading over worker processes; the request handler loads serially, as
+# forking a server process that has live threads and held locks is unsafe. The
+# counts are laid out as students x subjects arrays so the percentage and
+# threshold checks run in one pass with NumPy (a requirement); the dict-based
+# fallback for installs without it gives the same rows, only slower.
+
+REPORT_PARALLEL_MIN_SECTIONS = int(os.environ.get('REPORT_PARALLEL_MIN_SECTIONS', '16'))
+REPORT_COLUMNS = ['course', 'year', 'section', 'studentId', 'rollNumber', 'name',
+                  'subject', 'present', 'absent', 'percentage']
+
+
+def collect_section_attendance(job):
+    # Runs in report workers (no shared caches or locks): returns (course, year, section, roster, counts, backfilled)
+    # where counts is subject -> studentId -> (present, absent)
+    course, year, section, date_from, date_to = job
+    students = read_section_uncached(course, year, section, 'students', [])
+    roster = [(s.get('id'), s.get('rollNumber', ''), s.get('name', ''))
+              for s in students if isinstance(s, dict) and s.get('id')]
+    counts = {}
+    backfilled = False
+    if date_from or date_to:
+        # Date window: sum the per-day counts that fall inside it, from the
+        # columnar snapshot when there is one (no JSON parse at all)
+        lo, hi = date_from or '', date_to or '9999-99-99'
+        cols = load_attendance_columns(course, year, section)
+        if cols is not None:
+            for subject in cols.subjects:
+                counts[subject] = {sid: cols.counts(subject, sid, lo, hi) for sid in cols.student_ids(subject)}
+            return course, year, section, roster, counts, backfilled
+    data = read_section_uncached(course, year, section, 'attendance', {})
+    if not isinstance(data, dict):
+        data = {}
+    if date_from or date_to:
+        schema = read_section_uncached(course, year, section, 'schema', {}) or {}
+        current = int(schema.get('version') or 0) >= SCHEMA_VERSION
+        for subject in (data.get('records') or {}):
+            per_subject = counts.setdefault(subject, {})
+            for student_id in data['records'][subject]:
+                entry = get_att_rec_entry(data, subject, student_id, current)
+                pr = sum(n for d, n in entry['present'].items() if lo <= d <= hi)
+                ab = sum(n for d, n in entry['absent'].items() if lo <= d <= hi)
+                per_subject[student_id] = (pr, ab)
+    else:
+        backfilled = ensure_att_totals(data)
+        for subject, per_student in data['totals'].items():
+            counts[subject] = {sid: (t['present'], t['absent']) for sid, t in per_student.items()}
+    return course, year, section, roster, counts, backfilled
+
+
+def list_all_sections(course=None):
+    courses = [course] if course else get_courses()
+    return [(c, y, s) for c in courses for y in get_years(c) for s in get_sections(c, y)]
+
+
+def load_report_sections(jobs, workers=1):
+    # workers > 1 forks worker processes: only for the CLI, never in a request
+    if len(jobs) >= REPORT_PARALLEL_MIN_SECTIONS and workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(collect_section_attendance, jobs,
+                                     chunksize=max(1, len(jobs) // (workers * 4))))
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Parallel report load failed, falling back to serial: {e}")
+    return [collect_section_attendance(job) for job in jobs]
+
+
+def compute_defaulters(threshold, course=None, date_from=None, date_to=None, workers=1):
+    # Returns report rows (dicts keyed by REPORT_COLUMNS) for every student whose
+    # attendance in a subject is below threshold percent. All loading, backfilling
+    # and computing happens here, so callers stream only finished rows.
+    jobs = [(c, y, s, date_from, date_to) for c, y, s in list_all_sections(course)]
+    results = load_report_sections(jobs, workers)
+    for c, y, s, _, _, backfilled in results:
+        if backfilled:
+            # Persist totals for sections written before they existed, so the next report skips the rescan
+            with section_lock(c, y, s):
+                data = load_attendance(c, y, s)
+                if ensure_att_totals(data):
+                    save_attendance(c, y, s, data)
+
+    # Lay out the counts: one row per (section, student), one column per subject
+    subjects = []
+    subject_col = {}
+    students = []
+    present_cells = []
+    absent_cells = []
+    for c, y, s, roster, counts, _ in results:
+        row_of = {}
+        for student_id, roll, name in roster:
+            row_of[student_id] = len(students)
+            students.append((c, y, s, student_id, roll, name))
+        for subject, per_student in counts.items():
+            col = subject_col.get(subject)
+            if col is None:
+                col = subject_col[subject] = len(subjects)
+                subjects.append(subject)
+            for student_id, (pr, ab) in per_student.items():
+                row = row_of.get(student_id)
+                if row is None:  # records for a student no longer on the roster
+                    row = row_of[student_id] = len(students)
+                    students.append((c, y, s, student_id, '', ''))
+                present_cells.append((row, col, pr))
+                absent_cells.append((row, col, ab))
+
+    if np is not None:
+        shape = (len(students), len(subjects))
+        present = np.zeros(shape, dtype=np.int64)
+        absent = np.zeros(shape, dtype=np.int64)
+        if present_cells:
+            cells = np.array(present_cells, dtype=np.int64)
+            present[cells[:, 0], cells[:, 1]] = cells[:, 2]
+            cells = np.array(absent_cells, dtype=np.int64)
+            absent[cells[:, 0], cells[:, 1]] = cells[:, 2]
+        held = present + absent
+        pct = np.divide(present * 100.0, held, out=np.zeros(shape), where=held > 0)
+        rows, cols = np.nonzero((held > 0) & (pct < threshold))
+        hits = zip(rows.tolist(), cols.tolist(), present[rows, cols].tolist(),
+                   absent[rows, cols].tolist(), np.round(pct[rows, cols], 2).tolist())
+    else:
+        present = {(row, col): n for row, col, n in present_cells}
+        absent = {(row, col): n for row, col, n in absent_cells}
+        hits = []
+        for (row, col), pr in sorted(present.items()):
+            held = pr + absent[(row, col)]
+            if held and pr * 100.0 / held < threshold:
+                hits.append((row, col, pr, absent[(row, col)], round(pr * 100.0 / held, 2)))
+
+    report = []
+    for row, col, pr, ab, pct_value in hits:
+        c, y, s, student_id, roll, name = students[row]
+        report.append({
+            'course': c, 'year': y, 'section': s,
+            'studentId': student_id, 'rollNumber': roll, 'name': name,
+            'subject': subjects[col], 'present': pr, 'absent': ab, 'percentage': pct_value
+        })
+    return report
+
+
+def stream_report_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(REPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([row[k] for k in REPORT_COLUMNS])
+        if buf.tell() > 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def stream_report_json(rows):
+    yield '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + json.dumps(row)
+        first = False
+    yield ']'
+
 # Attendance issues helpers
 
 
@@ -418,16 +2521,10 @@ def get_attendance_issue_path(course, year, section):
 
 def load_attendance_issues(course, year, section):
     path = get_attendance_issue_path(course, year, section)
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return {"issues": []}
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading attendance issues file: {e}")
-            return {"issues": []}
+    data = read_section_json((course, year, section, 'attendance_issues'), path, lambda: {"issues": []}, 'attendance issues')
+    if data is not None:
+        return data
+    # If file doesn't exist, create default
     data = {"issues": []}
     save_attendance_issues(course, year, section, data)
     return data
@@ -435,8 +2532,552 @@ def load_attendance_issues(course, year, section):
 
 def save_attendance_issues(course, year, section, data):
     path = get_attendance_issue_path(course, year, section)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    write_section_json((course, year, section, 'attendance_issues'), path, data)
+
+# Login index helpers
+# Maps student (rollNumber, email) and secondary admin userId to the sections that
+# hold matching records, so logins and OTP lookups do not walk every section
+# directory. Keys are not unique across sections: logins try each candidate.
+
+LOGIN_INDEX_FILE = 'login_index.json'
+LOGIN_INDEX_VERSION = 2
+LOGIN_INDEX = {'stamp': None, 'data': None}
+
+
+def get_login_index_path():
+    return os.path.join(DATA_DIR, LOGIN_INDEX_FILE)
+
+
+def student_login_key(roll_number, email):
+    return f"{roll_number}|{email}"
+
+
+def build_login_index():
+    index = {'version': LOGIN_INDEX_VERSION, 'students': {}, 'secondary': {}}
+    for course in get_courses():
+        for year in get_years(course):
+            for section in get_sections(course, year):
+                for s in get_students(course, year, section):
+                    if s.get('id') and s.get('rollNumber') and s.get('email'):
+                        _add_login_entry(index['students'], student_login_key(s.get('rollNumber'), s.get('email')),
+                                         _login_entry(course, year, section, s))
+                for a in get_secondary_admins(course, year, section):
+                    if a.get('id') and a.get('userId'):
+                        _add_login_entry(index['secondary'], a.get('userId'), _login_entry(course, year, section, a))
+    return index
+
+
+def _login_entry(course, year, section, record):
+    return {'course': course, 'year': year, 'section': section, 'id': record.get('id')}
+
+
+def _add_login_entry(bucket, key, entry):
+    # Keys map to every record that uses them (duplicate roll numbers/userIds
+    # across sections), in section order
+    entries = bucket.setdefault(key, [])
+    if entry not in entries:
+        entries.append(entry)
+
+
+def _drop_login_entry(bucket, key, entry):
+    # Returns True when the entry was indexed under key
+    entries = bucket.get(key) or []
+    if entry not in entries:
+        return False
+    entries.remove(entry)
+    if not entries:
+        bucket.pop(key, None)
+    return True
+
+
+def login_index_lock():
+    return file_lock(os.path.join(DATA_DIR, '.login_index.lock'))
+
+
+def save_login_index(index):
+    path = get_login_index_path()
+    atomic_write_json(path, index)
+    LOGIN_INDEX['stamp'] = _file_stamp(path)
+    LOGIN_INDEX['data'] = index
+
+
+def rebuild_login_index():
+    with login_index_lock():
+        index = build_login_index()
+        save_login_index(index)
+    return index
+
+
+def load_login_index():
+    path = get_login_index_path()
+    stamp = _file_stamp(path)
+    if stamp is None:
+        # First run (or file removed): build from the section tree once
+        return rebuild_login_index()
+    # Reuse the parsed index unless another worker rewrote the file
+    if LOGIN_INDEX['data'] is not None and LOGIN_INDEX['stamp'] == stamp:
+        return LOGIN_INDEX['data']
+    try:
+        with open(path, 'r') as f:
+            content = f.read().strip()
+            index = json.loads(content) if content else {}
+    except (json.JSONDecodeError, Exception) as e:
+        print(f"Error reading login index file: {e}")
+        return rebuild_login_index()
+    if index.get('version') != LOGIN_INDEX_VERSION:
+        # Written by an older version (one section per key)
+        return rebuild_login_index()
+    index.setdefault('students', {})
+    index.setdefault('secondary', {})
+    LOGIN_INDEX['stamp'] = stamp
+    LOGIN_INDEX['data'] = index
+    return index
+
+
+def lookup_student_login(roll_number, email):
+    return load_login_index()['students'].get(student_login_key(roll_number, email)) or []
+
+
+def lookup_secondary_login(user_id):
+    return load_login_index()['secondary'].get(user_id) or []
+
+
+def _resolve_student_entry(entry, roll_number, email):
+    course, year, section = entry.get('course'), entry.get('year'), entry.get('section')
+    students = get_students(course, year, section)
+    s = find_student(course, year, section, entry.get('id'), students)
+    if s and s.get('rollNumber') == roll_number and s.get('email') == email:
+        return course, year, section, students, s
+    return None
+
+
+def _resolve_login_entries(entries, resolve, reindex):
+    # Resolves index entries to records; if any is stale (moved/edited
+    # record), rebuilds the index once and resolves the fresh entries
+    found = [resolve(entry) for entry in entries]
+    if None in found:
+        found = [resolve(entry) for entry in reindex(rebuild_login_index())]
+    return [f for f in found if f is not None]
+
+
+def find_students_by_login(roll_number, email):
+    # Returns [(course, year, section, students, student)] for every record with this roll number and email
+    if not roll_number or not email:
+        return []
+    return _resolve_login_entries(
+        lookup_student_login(roll_number, email),
+        lambda entry: _resolve_student_entry(entry, roll_number, email),
+        lambda index: index['students'].get(student_login_key(roll_number, email)) or [])
+
+
+def _resolve_secondary_entry(entry, user_id):
+    course, year, section = entry.get('course'), entry.get('year'), entry.get('section')
+    admins = get_secondary_admins(course, year, section)
+    a = find_secondary_admin(course, year, section, entry.get('id'), admins)
+    if a and a.get('userId') == user_id:
+        return course, year, section, admins, a
+    return None
+
+
+def find_secondary_admins_by_user_id(user_id):
+    # Returns [(course, year, section, admins, admin)] for every admin with this userId
+    if not user_id:
+        return []
+    return _resolve_login_entries(
+        lookup_secondary_login(user_id),
+        lambda entry: _resolve_secondary_entry(entry, user_id),
+        lambda index: index['secondary'].get(user_id) or [])
+
+
+def index_student_login(course, year, section, student, old_key=None):
+    with login_index_lock():
+        index = load_login_index()
+        students = index['students']
+        entry = _login_entry(course, year, section, student)
+        if old_key:
+            _drop_login_entry(students, old_key, entry)
+        if student.get('rollNumber') and student.get('email'):
+            _add_login_entry(students, student_login_key(student.get('rollNumber'), student.get('email')), entry)
+        save_login_index(index)
+
+
+def unindex_student_login(course, year, section, student):
+    with login_index_lock():
+        index = load_login_index()
+        key = student_login_key(student.get('rollNumber'), student.get('email'))
+        if _drop_login_entry(index['students'], key, _login_entry(course, year, section, student)):
+            save_login_index(index)
+
+
+def index_secondary_login(course, year, section, admin, old_user_id=None):
+    with login_index_lock():
+        index = load_login_index()
+        secondary = index['secondary']
+        entry = _login_entry(course, year, section, admin)
+        if old_user_id:
+            _drop_login_entry(secondary, old_user_id, entry)
+        if admin.get('userId'):
+            _add_login_entry(secondary, admin.get('userId'), entry)
+        save_login_index(index)
+
+
+def unindex_secondary_login(course, year, section, admin):
+    with login_index_lock():
+        index = load_login_index()
+        if _drop_login_entry(index['secondary'], admin.get('userId'), _login_entry(course, year, section, admin)):
+            save_login_index(index)
+
+
+def unindex_logins_under(course, year=None, section=None):
+    # Drop every entry that lives under a deleted course/year/section
+    with login_index_lock():
+        index = load_login_index()
+
+        def inside(entry):
+            return (entry.get('course') == course
+                    and (year is None or entry.get('year') == year)
+                    and (section is None or entry.get('section') == section))
+
+        changed = False
+        for bucket in ('students', 'secondary'):
+            for k in list(index[bucket]):
+                kept = [e for e in index[bucket][k] if not inside(e)]
+                if len(kept) == len(index[bucket][k]):
+                    continue
+                changed = True
+                if kept:
+                    index[bucket][k] = kept
+                else:
+                    index[bucket].pop(k, None)
+        if changed:
+            save_login_index(index)
+
+# Student search
+# An in-memory index over every section's students, by name, roll number and
+# email. Field values are split into lowercase words and each word is indexed
+# by its trigrams and its '^'-marked one- and two-letter prefixes, so a query
+# word matches any substring of three or more letters, or the start of a word
+# when shorter. save_students re-indexes its section and deleted sections are
+# dropped; changes written by other worker processes are picked up by
+# revalidating every section's student list at most every
+# SEARCH_REFRESH_SECONDS. The index is built by the first search.
+
+SEARCH_REFRESH_SECONDS = 5
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_FIELDS = (('rollNumber', 3), ('email', 2), ('name', 1))  # field, ranking weight
+# sections: (course, year, section) -> (students list indexed, keys)
+# docs: (course, year, section, studentId) -> (result, {field: words}, grams)
+# grams: gram -> keys
+SEARCH_INDEX = {'built': False, 'checked_at': 0.0, 'sections': {}, 'docs': {}, 'grams': {}}
+SEARCH_LOCK = threading.RLock()
+
+
+def search_words(text):
+    return [w for w in re.split(r'[^0-9a-z]+', str(text or '').lower()) if w]
+
+
+def search_grams(word):
+    marked = '^' + word
+    grams = {marked[:2], marked[:3]}
+    grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def query_grams(word):
+    # Every trigram of a longer query word; the marked start of a short one
+    if len(word) >= 3:
+        return {word[i:i + 3] for i in range(len(word) - 2)}
+    return {'^' + word}
+
+
+def _unindex_search_section(key):
+    entry = SEARCH_INDEX['sections'].pop(key, None)
+    if entry is None:
+        return
+    for doc_key in entry[1]:
+        doc = SEARCH_INDEX['docs'].pop(doc_key, None)
+        for gram in (doc[2] if doc else ()):
+            keys = SEARCH_INDEX['grams'].get(gram)
+            if keys is not None:
+                keys.discard(doc_key)
+                if not keys:
+                    del SEARCH_INDEX['grams'][gram]
+
+
+def _index_search_section(key, students):
+    _unindex_search_section(key)
+    doc_keys = set()
+    for student in students:
+        if not isinstance(student, dict) or not student.get('id'):
+            continue
+        doc_key = key + (student['id'],)
+        fields = {field: search_words(student.get(field)) for field, _ in SEARCH_FIELDS}
+        grams = set()
+        for words in fields.values():
+            for word in words:
+                grams.update(search_grams(word))
+        result = {
+            'studentId': student['id'],
+            'name': student.get('name', ''),
+            'rollNumber': student.get('rollNumber', ''),
+            'email': student.get('email', ''),
+            'course': key[0],
+            'year': key[1],
+            'section': key[2],
+        }
+        SEARCH_INDEX['docs'][doc_key] = (result, fields, grams)
+        for gram in grams:
+            SEARCH_INDEX['grams'].setdefault(gram, set()).add(doc_key)
+        doc_keys.add(doc_key)
+    SEARCH_INDEX['sections'][key] = (students, doc_keys)
+
+
+def index_search_section(course, year, section, students):
+    # Called by save_students; nothing to maintain until the first search
+    with SEARCH_LOCK:
+        if SEARCH_INDEX['built']:
+            _index_search_section((course, year, section), students)
+
+
+def unindex_search_under(course, year=None, section=None):
+    prefix = tuple(p for p in (course, year, section) if p is not None)
+    with SEARCH_LOCK:
+        for key in [k for k in SEARCH_INDEX['sections'] if k[:len(prefix)] == prefix]:
+            _unindex_search_section(key)
+
+
+def refresh_search_index():
+    # Build on first use; afterwards re-index sections whose student list was
+    # reloaded (written elsewhere) and drop sections that are gone
+    with SEARCH_LOCK:
+        now = time.monotonic()
+        if SEARCH_INDEX['built'] and now - SEARCH_INDEX['checked_at'] < SEARCH_REFRESH_SECONDS:
+            return
+        live = set()
+        for key in list_all_sections():
+            live.add(key)
+            students = get_students(*key)
+            entry = SEARCH_INDEX['sections'].get(key)
+            if entry is None or entry[0] is not students:
+                _index_search_section(key, students)
+        for key in [k for k in SEARCH_INDEX['sections'] if k not in live]:
+            _unindex_search_section(key)
+        SEARCH_INDEX['built'] = True
+        SEARCH_INDEX['checked_at'] = now
+
+
+def _search_score(fields, words):
+    # Per query word, the best field match: whole word > word start > substring,
+    # times the field weight; 0 when some query word matches nowhere
+    score = 0
+    for query_word in words:
+        best = 0
+        for field, weight in SEARCH_FIELDS:
+            for word in fields[field]:
+                if word == query_word:
+                    best = max(best, 3 * weight)
+                elif word.startswith(query_word):
+                    best = max(best, 2 * weight)
+                elif query_word in word:
+                    best = max(best, weight)
+        if not best:
+            return 0
+        score += best
+    return score
+
+
+def search_students(query, scope=None, offset=0, limit=SEARCH_PAGE_DEFAULT):
+    # Returns (total, page of results with 'score'); scope limits the search to
+    # sections starting with that (course[, year[, section]]) prefix
+    words = search_words(query)
+    if not words:
+        return 0, []
+    refresh_search_index()
+    limit = max(1, min(int(limit), SEARCH_PAGE_MAX))
+    with SEARCH_LOCK:
+        gram_sets = [SEARCH_INDEX['grams'].get(gram, set()) for word in words for gram in query_grams(word)]
+        gram_sets.sort(key=len)
+        candidates = set(gram_sets[0]) if gram_sets else set()
+        for keys in gram_sets[1:]:
+            if not candidates:
+                break
+            candidates &= keys
+        matches = []
+        for doc_key in candidates:
+            if scope and doc_key[:len(scope)] != tuple(scope):
+                continue
+            result, fields, _ = SEARCH_INDEX['docs'][doc_key]
+            score = _search_score(fields, words)
+            if score:
+                matches.append((-score, result['name'].lower(), doc_key, result))
+    matches.sort(key=lambda m: m[:3])
+    page = [dict(m[3], score=-m[0]) for m in matches[offset:offset + limit]]
+    return len(matches), page
+
+# Section schema versions
+# Each section records the version of its documents in schema.json. The steps
+# in SCHEMA_MIGRATIONS upgrade a section one version at a time under its section
+# lock, saving the version after each step, so an interrupted run picks up
+# where it stopped (steps are safe to repeat). New sections start at
+# SCHEMA_VERSION. For sections at the current version, readers skip the legacy
+# fallbacks: list-format attendance entries, plaintext passwords and stored file
+# names taken from URLs.
+
+
+def read_section_doc(course, year, section, kind):
+    # The raw document of any kind, or None when there is none
+    path = os.path.join(DATA_DIR, course, year, section, SECTION_FILES[kind])
+    return read_section_json((course, year, section, kind), path, lambda: None, kind)
+
+
+def write_section_doc(course, year, section, kind, data):
+    section_path = os.path.join(DATA_DIR, course, year, section)
+    os.makedirs(section_path, exist_ok=True)
+    write_section_json((course, year, section, kind), os.path.join(section_path, SECTION_FILES[kind]), data)
+
+
+def get_schema_version(course, year, section):
+    data = read_section_doc(course, year, section, 'schema')
+    return int(data.get('version') or 0) if isinstance(data, dict) else 0
+
+
+def save_schema_version(course, year, section, version):
+    write_section_doc(course, year, section, 'schema', {'version': version})
+
+
+def schema_current(course, year, section):
+    return get_schema_version(course, year, section) >= SCHEMA_VERSION
+
+
+def migrate_attendance_entries(course, year, section):
+    # List-format entries (one date per present mark) become day -> count maps
+    # with string days and int counts; running totals are backfilled
+    data = read_section_doc(course, year, section, 'attendance')
+    if not isinstance(data, dict):
+        return
+    changed = False
+    for subject, recs in (data.get('records') or {}).items():
+        for student_id, entry in recs.items():
+            normalized = get_att_rec_entry(data, subject, student_id)
+            if entry != normalized:
+                recs[student_id] = normalized
+                changed = True
+    if ensure_att_totals(data):
+        changed = True
+    if changed:
+        save_attendance(course, year, section, data)
+
+
+def _hash_plaintext(items, field):
+    changed = False
+    for item in items:
+        if isinstance(item, dict) and should_upgrade_to_sha256(item.get(field)):
+            item[field] = hash_password_sha256(item[field])
+            changed = True
+    return changed
+
+
+def migrate_password_hashes(course, year, section):
+    # Plaintext student and professor passwords are replaced by their SHA-256
+    students = read_section_doc(course, year, section, 'students')
+    if isinstance(students, list) and _hash_plaintext(students, 'secretPassword'):
+        save_students(course, year, section, students)
+    admins = read_section_doc(course, year, section, 'secondary_admin')
+    if isinstance(admins, list) and _hash_plaintext(admins, 'password'):
+        save_secondary_admins(course, year, section, admins)
+
+
+def _fill_stored_filename(record):
+    if isinstance(record, dict) and not record.get('storedFilename'):
+        name = upload_name_from_url(record.get('url'))
+        if name:
+            record['storedFilename'] = name
+            return True
+    return False
+
+
+def migrate_stored_filenames(course, year, section):
+    # Note files and certificates name their upload in 'storedFilename'
+    notes = read_section_doc(course, year, section, 'notes')
+    if isinstance(notes, dict):
+        changed = False
+        for arr in (notes.get('bySubject') or {}).values():
+            for note in arr or []:
+                changed = _fill_stored_filename(note.get('file')) or changed
+        if changed:
+            write_section_doc(course, year, section, 'notes', notes)
+    certs = read_section_doc(course, year, section, 'certificates')
+    if isinstance(certs, dict):
+        changed = False
+        for arr in (certs.get('byStudent') or {}).values():
+            for cert in arr or []:
+                changed = _fill_stored_filename(cert) or changed
+        if changed:
+            write_section_doc(course, year, section, 'certificates', certs)
+
+
+# (version, name, step); append new steps with the next version number
+SCHEMA_MIGRATIONS = [
+    (1, 'attendance-entries', migrate_attendance_entries),
+    (2, 'password-hashes', migrate_password_hashes),
+    (3, 'stored-filenames', migrate_stored_filenames),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def migrate_section_schema(course, year, section):
+    # Returns the number of steps applied
+    applied = 0
+    with section_lock(course, year, section):
+        version = get_schema_version(course, year, section)
+        for target, _name, step in SCHEMA_MIGRATIONS:
+            if target <= version:
+                continue
+            step(course, year, section)
+            save_schema_version(course, year, section, target)
+            applied += 1
+    return applied
+
+
+def migrate_all_sections(course=None, pause=0.0):
+    # Returns (sections upgraded, steps applied)
+    sections = steps = 0
+    for c, y, s in list_all_sections(course):
+        if schema_current(c, y, s):
+            continue
+        applied = migrate_section_schema(c, y, s)
+        if applied:
+            sections += 1
+            steps += applied
+        if pause:
+            time.sleep(pause)
+    return sections, steps
+
+
+def start_schema_migration():
+    # Background migration in one process at a time; the others skip it
+    if fcntl is None:
+        return
+    fd = os.open(os.path.join(DATA_DIR, '.schema_migrate.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return
+
+    def run():
+        try:
+            sections, steps = migrate_all_sections(pause=0.05)
+            if sections:
+                print(f"Upgraded {sections} sections to schema version {SCHEMA_VERSION} ({steps} steps)")
+        except Exception as e:
+            print(f"Schema migration stopped: {e}")
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    threading.Thread(target=run, name='schema-migration', daemon=True).start()
 
 # Initialize default data structure
 
@@ -464,21 +3105,228 @@ def initialize_default_data():
         save_secondary_admins(default_course, default_year, default_section, [])
         # Create chat storage file
         chat_path = os.path.join(section_path, 'chat.json')
-        with open(chat_path, 'w') as f:
-            json.dump({"groups": {}, "messages": {}}, f, indent=2)
+        write_section_json((default_course, default_year, default_section, 'chat'), chat_path, {"groups": {}})
         # Create certificates storage file
         cert_path = os.path.join(section_path, 'certificates.json')
-        with open(cert_path, 'w') as f:
-            json.dump({"byStudent": {}}, f, indent=2)
+        write_section_json((default_course, default_year, default_section, 'certificates'), cert_path, {"byStudent": {}})
         # Create scrutiny storage file
         scr_path = os.path.join(section_path, 'scrutiny.json')
-        with open(scr_path, 'w') as f:
-            json.dump({"requests": []}, f, indent=2)
+        write_section_json((default_course, default_year, default_section, 'scrutiny'), scr_path, {"requests": []})
+        # Nothing to migrate in a new section
+        save_schema_version(default_course, default_year, default_section, SCHEMA_VERSION)
+        invalidate_hierarchy()
 
 # Call this function when the app starts
+if os.path.isdir(LEGACY_BLOB_REFS_DIR) and not os.path.exists(BLOB_REFS_DIR):
+    os.rename(LEGACY_BLOB_REFS_DIR, BLOB_REFS_DIR)
+if os.path.isdir(LEGACY_MAIL_DIR) and not os.path.exists(MAIL_DIR):
+    os.rename(LEGACY_MAIL_DIR, MAIL_DIR)
+if STORAGE_BACKEND == 'sqlite':
+    init_sqlite_schema()
 initialize_default_data()
 # Ensure main credentials file exists on startup
 load_main_credentials()
+# Build the login index on first start (reused afterwards)
+load_login_index()
+# Move uploads from the old flat layout into shards in the background. Like
+# the schema migration below, `python app.py` starts it unless
+# UPLOAD_MIGRATION=off; other servers set UPLOAD_MIGRATION=on or run
+# `flask migrate-uploads`. Flat files are served until they are moved.
+if os.getenv('UPLOAD_MIGRATION', '').lower() == 'on':
+    start_upload_migration()
+# Bring sections written by older versions up to the current schema. Only on
+# request: importing the app (CLI commands, scripts, report workers) must not
+# start it. `python app.py` does unless SCHEMA_MIGRATION=off; other servers
+# set SCHEMA_MIGRATION=on or run `flask migrate-schema`.
+if os.getenv('SCHEMA_MIGRATION', '').lower() == 'on':
+    start_schema_migration()
+# Resume delivery of mail queued before a restart
+if os.path.isdir(MAIL_DIR):
+    start_mail_workers()
+
+
+@app.cli.command('rebuild-login-index')
+def rebuild_login_index_command():
+    # Use after editing section JSON files by hand
+    index = rebuild_login_index()
+    print(f"Indexed {len(index['students'])} students and {len(index['secondary'])} secondary admins")
+
+
+@app.cli.command('defaulters-report')
+@click.option('--threshold', default=75.0, show_default=True, help='Percentage below which a student is listed')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default='csv', show_default=True)
+@click.option('--course', default=None, help='Limit to one course')
+@click.option('--from', 'date_from', default=None, help='First day (YYYY-MM-DD)')
+@click.option('--to', 'date_to', default=None, help='Last day (YYYY-MM-DD)')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+@click.option('--output', type=click.File('w'), default='-', help='Output file (default: stdout)')
+def defaulters_report_command(threshold, fmt, course, date_from, date_to, workers, output):
+    rows = compute_defaulters(threshold, course, date_from, date_to, workers or os.cpu_count() or 1)
+    for chunk in (stream_report_json if fmt == 'json' else stream_report_csv)(rows):
+        output.write(chunk)
+
+
+@app.cli.command('convert-attendance')
+@click.option('--course', default=None, help='Limit to one course')
+@click.option('--verify', is_flag=True, help='Check every entry against the JSON document')
+def convert_attendance_command(course, verify):
+    # Builds attendance.cols for every section (readers otherwise build them on demand)
+    built, skipped, json_bytes, col_bytes = 0, 0, 0, 0
+    for c, y, s in list_all_sections(course):
+        stamp = attendance_stamp(c, y, s)
+        data = read_section_uncached(c, y, s, 'attendance', {})
+        path = os.path.join(DATA_DIR, c, y, s, ATT_COLUMNS_FILE)
+        if stamp is None or not isinstance(data, dict) or not build_attendance_columns(data, path, stamp):
+            skipped += 1
+            continue
+        built += 1
+        json_bytes += len(json.dumps(data.get('records') or {}))
+        col_bytes += os.path.getsize(path)
+        if verify:
+            cols = AttendanceColumns(path)
+            for subject in data.get('records') or {}:
+                for student_id in data['records'][subject]:
+                    if cols.entry(subject, student_id) != get_att_rec_entry(data, subject, student_id):
+                        raise click.ClickException(f"Mismatch in {c}/{y}/{s}: {subject} {student_id}")
+            cols.close()
+    print(f"Built {built} snapshots, skipped {skipped}; records {json_bytes} bytes as JSON, {col_bytes} as columns")
+
+
+@app.cli.command('migrate-to-sqlite')
+@click.option('--force', is_flag=True, help='Overwrite documents that already exist in the database')
+def migrate_to_sqlite_command(force):
+    # One-shot copy of the JSON section tree into SQLITE_PATH; set
+    # STORAGE_BACKEND=sqlite afterwards. The JSON files are left in place.
+    init_sqlite_schema()
+    copied = skipped = 0
+    for course, year, section in list_all_sections():
+        for kind, filename in SECTION_FILES.items():
+            path = os.path.join(DATA_DIR, course, year, section, filename)
+            if not os.path.exists(path):
+                continue
+            key = (course, year, section, kind)
+            exists = get_sqlite_conn().execute('SELECT 1 FROM section_docs WHERE course=? AND year=? AND section=? AND kind=?',
+                                               key).fetchone()
+            if exists and not force:
+                skipped += 1
+                continue
+            data = _read_json_file(path, None)
+            if data is None:
+                print(f"Skipping unreadable {path}")
+                continue
+            sqlite_write_section(key, data)
+            copied += 1
+    rebuild_login_index()
+    print(f"Copied {copied} documents into {SQLITE_PATH} ({skipped} already present)")
+
+
+@app.cli.command('migrate-schema')
+@click.option('--course', default=None, help='Only sections of this course')
+@click.option('--status', is_flag=True, help='Report section versions without migrating')
+def migrate_schema_command(course, status):
+    # Foreground version of the startup migration (same resumable steps)
+    if status:
+        versions = {}
+        for c, y, s in list_all_sections(course):
+            v = get_schema_version(c, y, s)
+            versions[v] = versions.get(v, 0) + 1
+        for v in sorted(versions):
+            print(f"version {v}: {versions[v]} sections")
+        return
+    sections, steps = migrate_all_sections(course)
+    print(f"Upgraded {sections} sections to schema version {SCHEMA_VERSION} ({steps} steps)")
+
+
+@app.cli.command('migrate-uploads')
+def migrate_uploads_command():
+    # Foreground version of the startup migration (same resumable steps)
+    print(f"Moved {migrate_flat_uploads()} uploads into sharded directories")
+
+
+@app.cli.command('simulate-subscribers')
+@click.option('--subscribers', default=300, show_default=True, help='Concurrent SSE subscribers')
+@click.option('--messages', default=20, show_default=True, help='Messages to publish')
+@click.option('--interval', default=0.05, show_default=True, help='Seconds between messages')
+def simulate_subscribers_command(subscribers, messages, interval):
+    # Local load test of the message hub: subscribers consume the real SSE
+    # generator in threads while messages are appended and published to one
+    # group of a throwaway section, which is removed afterwards
+    course, year, section = '__hub_simulation__', 'Year', 'Section'
+    os.makedirs(os.path.join(DATA_DIR, course, year, section), exist_ok=True)
+    save_chat(course, year, section, {'groups': {'sim': {'id': 'sim', 'name': 'Simulation', 'members': []}}})
+    latencies = []
+    done = threading.Barrier(subscribers + 1)
+    ready = threading.Semaphore(0)
+
+    def subscriber():
+        gen = message_event_stream(('teacher', 'faculty'), course, year, section)
+        received = 0
+        try:
+            next(gen)  # subscribed once the first frame is produced
+            ready.release()
+            for frame in gen:
+                if frame.startswith('id:'):
+                    sent = json.loads(frame.split('data: ', 1)[1])['message']['sentAt']
+                    latencies.append(time.perf_counter() - sent)
+                    received += 1
+                    if received == messages:
+                        break
+        finally:
+            gen.close()
+            done.wait()
+
+    threads = [threading.Thread(target=subscriber, daemon=True) for _ in range(subscribers)]
+    try:
+        for t in threads:
+            t.start()
+        for _ in threads:
+            ready.acquire()
+        started = time.perf_counter()
+        for i in range(messages):
+            log_append(course, year, section, 'chat/sim', {'id': f'sim_{i}', 'text': str(i), 'sentAt': time.perf_counter()})
+            hub_publish(course, year, section, 'chat/sim')
+            time.sleep(interval)
+        done.wait(timeout=max(60, HUB_HEARTBEAT_SECONDS * 2))
+        elapsed = time.perf_counter() - started
+    finally:
+        import shutil
+        shutil.rmtree(os.path.join(DATA_DIR, course), ignore_errors=True)
+        drop_section_docs(course)
+        invalidate_hierarchy()
+    latencies.sort()
+    expected = subscribers * messages
+    print(f"Delivered {len(latencies)}/{expected} messages to {subscribers} subscribers in {elapsed:.2f}s")
+    if latencies:
+        pick = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+        print(f"Latency ms: p50 {pick(0.5):.1f}, p95 {pick(0.95):.1f}, max {latencies[-1] * 1000:.1f}")
+
+
+@app.cli.command('mail-benchmark')
+@click.option('--to', 'to_email', required=True, help='Recipient for the test messages')
+@click.option('--count', default=200, show_default=True, help='Messages to queue')
+@click.option('--timeout', default=300, show_default=True, help='Seconds to wait for the queue to drain')
+def mail_benchmark_command(to_email, count, timeout):
+    # Throughput of the outbound queue against the configured SMTP server; point
+    # SMTP_HOST/SMTP_PORT at a local stand-in (SMTP_SECURITY=none) to measure it
+    err = smtp_config_error()
+    if err:
+        raise click.ClickException(err)
+    with MAIL_LOCK:
+        before = MAIL_STATE['sent'] + MAIL_STATE['failed']
+    started = time.perf_counter()
+    for i in range(count):
+        enqueue_mail(to_email, f'Queue benchmark {i}', f'Message {i} of {count}')
+    queued = time.perf_counter() - started
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with MAIL_LOCK:
+            sent, failed = MAIL_STATE['sent'], MAIL_STATE['failed']
+        if sent + failed - before >= count:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    print(f"Queued {count} messages in {queued:.2f}s ({count / max(queued, 1e-9):.0f}/s)")
+    print(f"Sent {sent}, failed {failed} in {elapsed:.2f}s ({sent / elapsed:.1f}/s) with {MAIL_WORKERS} workers")
 
 # Routes
 @app.route('/')
@@ -518,29 +3366,27 @@ def faculty_login():
             session['user_type'] = 'secondary'
             session['user_id'] = user_id
             return jsonify({'success': True, 'role': 'secondary'})
-        # Search in all sections
-        for course in get_courses():
-            for year in get_years(course):
-                for section in get_sections(course, year):
-                    try:
+        # Candidate sections from the login index; the password picks the record
+        for course, year, section, admins, admin in find_secondary_admins_by_user_id(user_id):
+            current = schema_current(course, year, section)
+            if check_password(admin.get('password'), password, current):
+                if not current and should_upgrade_to_sha256(admin.get('password')):
+                    with section_lock(course, year, section):
                         admins = get_secondary_admins(course, year, section)
-                        for admin in admins:
-                            if (admin.get('userId') == user_id and verify_password_sha256_or_plain(admin.get('password'), password)):
-                                if should_upgrade_to_sha256(admin.get('password')):
-                                    admin['password'] = hash_password_sha256(password)
-                                    save_secondary_admins(course, year, section, admins)
-                                session.permanent = True
-                                session['user_type'] = 'secondary'
-                                session['user_id'] = user_id
-                                session['secondary_admin'] = {
-                                    'profile': admin,
-                                    'course': course,
-                                    'year': year,
-                                    'section': section
-                                }
-                                return jsonify({'success': True, 'role': 'secondary'})
-                    except Exception:
-                        continue
+                        for a in admins:
+                            if a.get('id') == admin.get('id'):
+                                a['password'] = hash_password_sha256(password)
+                                admin = a
+                        save_secondary_admins(course, year, section, admins)
+                session.permanent = True
+                session['user_type'] = 'secondary'
+                session['user_id'] = user_id
+                session['secondary_admin'] = {
+                    'course': course,
+                    'year': year,
+                    'section': section
+                }
+                return jsonify({'success': True, 'role': 'secondary'})
         return jsonify({'success': False, 'error': 'Invalid credentials for secondary admin'})
 
     return jsonify({'success': False, 'error': 'Unknown account type'})
@@ -553,25 +3399,25 @@ def student_login():
     email = data.get('email')
     password = data.get('password')
 
-    # Search for student in all sections
-    for course in get_courses():
-        for year in get_years(course):
-            for section in get_sections(course, year):
-                students = get_students(course, year, section)
-                for student in students:
-                    if (student['rollNumber'] == roll_number and 
-                        student['email'] == email and 
-                        verify_password_sha256_or_plain(student.get('secretPassword'), password)):
-                        if should_upgrade_to_sha256(student.get('secretPassword')):
-                            student['secretPassword'] = hash_password_sha256(password)
-                            save_students(course, year, section, students)
-                        session.permanent = True
-                        session['user_type'] = 'student'
-                        session['student_data'] = student
-                        session['student_course'] = course
-                        session['student_year'] = year
-                        session['student_section'] = section
-                        return jsonify({'success': True})
+    # Candidate sections from the login index; the password picks the record
+    for course, year, section, students, student in find_students_by_login(roll_number, email):
+        current = schema_current(course, year, section)
+        if check_password(student.get('secretPassword'), password, current):
+            if not current and should_upgrade_to_sha256(student.get('secretPassword')):
+                with section_lock(course, year, section):
+                    students = get_students(course, year, section)
+                    for s in students:
+                        if s.get('id') == student.get('id'):
+                            s['secretPassword'] = hash_password_sha256(password)
+                            student = s
+                    save_students(course, year, section, students)
+            session.permanent = True
+            session['user_type'] = 'student'
+            session['student_id'] = student.get('id')
+            session['student_course'] = course
+            session['student_year'] = year
+            session['student_section'] = section
+            return jsonify({'success': True})
 
     return jsonify({'success': False, 'error': 'Invalid credentials'})
 
@@ -588,12 +3434,16 @@ def forgot_password_secondary():
 
 @app.route('/otp/request_password_reset', methods=['POST'])
 def otp_request_password_reset():
-    _cleanup_otp_store()
+    purge_expired_tokens()
     payload = request.get_json() or {}
     role = (payload.get('role') or '').strip().lower()
 
     if role not in {'student', 'secondary'}:
         return jsonify({'success': False, 'error': 'role must be student or secondary'}), 400
+    email = (payload.get('email') or '').strip()
+    if (rate_limited('otp_request_addr', request.remote_addr or '', OTP_MAX_REQUESTS_PER_ADDR, OTP_RATE_WINDOW)
+            or (email and rate_limited('otp_request_email', email.lower(), OTP_MAX_REQUESTS_PER_EMAIL, OTP_RATE_WINDOW))):
+        return jsonify({'success': False, 'error': 'Too many reset requests. Try again later.'}), 429
 
     if role == 'student':
         roll_number = (payload.get('rollNumber') or '').strip()
@@ -601,34 +3451,31 @@ def otp_request_password_reset():
         if not roll_number or not email:
             return jsonify({'success': False, 'error': 'rollNumber and email are required'}), 400
 
-        for course in get_courses():
-            for year in get_years(course):
-                for section in get_sections(course, year):
-                    students = get_students(course, year, section)
-                    for student in students:
-                        if student.get('rollNumber') == roll_number and student.get('email') == email:
-                            reset_id = uuid.uuid4().hex
-                            otp = _new_otp_code()
-                            sent, err = send_otp_email(email, otp, 'Student')
-                            if not sent:
-                                return jsonify({'success': False, 'error': f'Failed to send OTP email: {err}'}), 500
-                            OTP_STORE[reset_id] = {
-                                'role': 'student',
-                                'course': course,
-                                'year': year,
-                                'section': section,
-                                'studentId': student.get('id'),
-                                'rollNumber': roll_number,
-                                'email': email,
-                                'otp': otp,
-                                'expiresAt': int(time.time()) + OTP_TTL_SECONDS
-                            }
-                            return jsonify({
-                                'success': True,
-                                'resetId': reset_id,
-                                'expiresInSeconds': OTP_TTL_SECONDS,
-                                'message': 'OTP sent to your email address'
-                            })
+        found = find_students_by_login(roll_number, email)
+        if found:
+            course, year, section, _, student = found[0]
+            reset_id = uuid.uuid4().hex
+            otp = _new_otp_code()
+            sent, err = send_otp_email(email, otp, 'Student')
+            if not sent:
+                return jsonify({'success': False, 'error': f'Failed to send OTP email: {err}'}), 500
+            token_put('otp', reset_id, {
+                'role': 'student',
+                'course': course,
+                'year': year,
+                'section': section,
+                'studentId': student.get('id'),
+                'rollNumber': roll_number,
+                'email': email,
+                'otp': otp,
+                'expiresAt': int(time.time()) + OTP_TTL_SECONDS
+            }, OTP_TTL_SECONDS)
+            return jsonify({
+                'success': True,
+                'resetId': reset_id,
+                'expiresInSeconds': OTP_TTL_SECONDS,
+                'message': 'OTP sent to your email address'
+            })
         return jsonify({'success': False, 'error': 'Student not found for provided roll number and email'}), 404
 
     user_id = (payload.get('userId') or '').strip()
@@ -636,39 +3483,36 @@ def otp_request_password_reset():
     if not user_id or not email:
         return jsonify({'success': False, 'error': 'userId and email are required'}), 400
 
-    for course in get_courses():
-        for year in get_years(course):
-            for section in get_sections(course, year):
-                admins = get_secondary_admins(course, year, section)
-                for adm in admins:
-                    if adm.get('userId') == user_id and adm.get('email') == email:
-                        reset_id = uuid.uuid4().hex
-                        otp = _new_otp_code()
-                        sent, err = send_otp_email(email, otp, 'Secondary Admin')
-                        if not sent:
-                            return jsonify({'success': False, 'error': f'Failed to send OTP email: {err}'}), 500
-                        OTP_STORE[reset_id] = {
-                            'role': 'secondary',
-                            'course': course,
-                            'year': year,
-                            'section': section,
-                            'userId': user_id,
-                            'email': email,
-                            'otp': otp,
-                            'expiresAt': int(time.time()) + OTP_TTL_SECONDS
-                        }
-                        return jsonify({
-                            'success': True,
-                            'resetId': reset_id,
-                            'expiresInSeconds': OTP_TTL_SECONDS,
-                            'message': 'OTP sent to your email address'
-                        })
+    found = [f for f in find_secondary_admins_by_user_id(user_id) if f[4].get('email') == email]
+    if found:
+        course, year, section, _, adm = found[0]
+        reset_id = uuid.uuid4().hex
+        otp = _new_otp_code()
+        sent, err = send_otp_email(email, otp, 'Secondary Admin')
+        if not sent:
+            return jsonify({'success': False, 'error': f'Failed to send OTP email: {err}'}), 500
+        token_put('otp', reset_id, {
+            'role': 'secondary',
+            'course': course,
+            'year': year,
+            'section': section,
+            'userId': user_id,
+            'email': email,
+            'otp': otp,
+            'expiresAt': int(time.time()) + OTP_TTL_SECONDS
+        }, OTP_TTL_SECONDS)
+        return jsonify({
+            'success': True,
+            'resetId': reset_id,
+            'expiresInSeconds': OTP_TTL_SECONDS,
+            'message': 'OTP sent to your email address'
+        })
     return jsonify({'success': False, 'error': 'Secondary admin not found for provided userId and email'}), 404
 
 
 @app.route('/otp/verify_password_reset', methods=['POST'])
 def otp_verify_password_reset():
-    _cleanup_otp_store()
+    purge_expired_tokens()
     payload = request.get_json() or {}
     reset_id = (payload.get('resetId') or '').strip()
     otp = (payload.get('otp') or '').strip()
@@ -677,13 +3521,19 @@ def otp_verify_password_reset():
     if not reset_id or not otp or not new_password:
         return jsonify({'success': False, 'error': 'resetId, otp and newPassword are required'}), 400
 
-    entry = OTP_STORE.get(reset_id)
+    if rate_limited('otp_verify_addr', request.remote_addr or '', OTP_MAX_VERIFY_PER_ADDR, OTP_RATE_WINDOW):
+        return jsonify({'success': False, 'error': 'Too many attempts. Try again later.'}), 429
+    entry = token_get('otp', reset_id)
     if not entry:
         return jsonify({'success': False, 'error': 'Invalid or expired reset request'}), 400
     if int(entry.get('expiresAt', 0)) <= int(time.time()):
-        OTP_STORE.pop(reset_id, None)
+        token_pop('otp', reset_id)
         return jsonify({'success': False, 'error': 'OTP expired'}), 400
     if entry.get('otp') != otp:
+        # Guessing is capped per reset; the reset is void once the cap is hit
+        if rate_limited('otp_verify', reset_id, OTP_MAX_VERIFY_ATTEMPTS - 1, OTP_TTL_SECONDS):
+            token_pop('otp', reset_id)
+            return jsonify({'success': False, 'error': 'Too many invalid OTP attempts. Request a new OTP.'}), 429
         return jsonify({'success': False, 'error': 'Invalid OTP'}), 400
 
     role = entry.get('role')
@@ -694,20 +3544,22 @@ def otp_verify_password_reset():
         student_id = entry.get('studentId')
         roll_number = entry.get('rollNumber')
         email = entry.get('email')
-        students = get_students(course, year, section)
-        updated = False
-        for s in students:
-            if (student_id and s.get('id') == student_id) or (
-                s.get('rollNumber') == roll_number and s.get('email') == email
-            ):
-                if verify_password_sha256_or_plain(s.get('secretPassword'), new_password):
-                    return jsonify({'success': False, 'error': 'New password must be different from previous password'}), 400
-                s['secretPassword'] = hash_password_sha256(new_password)
-                updated = True
-                break
-        if not updated:
-            return jsonify({'success': False, 'error': 'Student not found'}), 404
-        save_students(course, year, section, students)
+        with section_lock(course, year, section):
+            students = get_students(course, year, section)
+            updated = None
+            for s in students:
+                if (student_id and s.get('id') == student_id) or (
+                    s.get('rollNumber') == roll_number and s.get('email') == email
+                ):
+                    if verify_password_sha256_or_plain(s.get('secretPassword'), new_password):
+                        return jsonify({'success': False, 'error': 'New password must be different from previous password'}), 400
+                    s['secretPassword'] = hash_password_sha256(new_password)
+                    updated = s
+                    break
+            if updated is None:
+                return jsonify({'success': False, 'error': 'Student not found'}), 404
+            save_students(course, year, section, students)
+        index_student_login(course, year, section, updated)
 
     elif role == 'secondary':
         course = entry.get('course')
@@ -715,28 +3567,24 @@ def otp_verify_password_reset():
         section = entry.get('section')
         user_id = entry.get('userId')
         email = entry.get('email')
-        admins = get_secondary_admins(course, year, section)
-        updated = False
-        for adm in admins:
-            if adm.get('userId') == user_id and adm.get('email') == email:
-                if verify_password_sha256_or_plain(adm.get('password'), new_password):
-                    return jsonify({'success': False, 'error': 'New password must be different from previous password'}), 400
-                adm['password'] = hash_password_sha256(new_password)
-                updated = True
-                break
-        if not updated:
-            return jsonify({'success': False, 'error': 'Secondary admin not found'}), 404
-        save_secondary_admins(course, year, section, admins)
-        if session.get('user_type') == 'secondary' and session.get('user_id') == user_id:
-            ctx = session.get('secondary_admin') or {}
-            prof = ctx.get('profile') or {}
-            prof['password'] = hash_password_sha256(new_password)
-            ctx['profile'] = prof
-            session['secondary_admin'] = ctx
+        with section_lock(course, year, section):
+            admins = get_secondary_admins(course, year, section)
+            updated = None
+            for adm in admins:
+                if adm.get('userId') == user_id and adm.get('email') == email:
+                    if verify_password_sha256_or_plain(adm.get('password'), new_password):
+                        return jsonify({'success': False, 'error': 'New password must be different from previous password'}), 400
+                    adm['password'] = hash_password_sha256(new_password)
+                    updated = adm
+                    break
+            if updated is None:
+                return jsonify({'success': False, 'error': 'Secondary admin not found'}), 404
+            save_secondary_admins(course, year, section, admins)
+        index_secondary_login(course, year, section, updated)
     else:
         return jsonify({'success': False, 'error': 'Invalid OTP role context'}), 400
 
-    OTP_STORE.pop(reset_id, None)
+    token_pop('otp', reset_id)
     return jsonify({'success': True})
 
 # Course management
@@ -763,6 +3611,7 @@ def add_course():
     course_path = os.path.join(DATA_DIR, course_name)
     if not os.path.exists(course_path):
         os.makedirs(course_path)
+        invalidate_hierarchy()
         return jsonify({'success': True})
 
     return jsonify({'success': False, 'error': 'Course already exists'})
@@ -777,6 +3626,9 @@ def delete_course(course_name):
     if os.path.exists(course_path):
         import shutil
         shutil.rmtree(course_path)
+        drop_section_docs(course_name)
+        unindex_logins_under(course_name)
+        invalidate_hierarchy()
         return jsonify({'success': True})
 
     return jsonify({'success': False, 'error': 'Course not found'})
@@ -791,6 +3643,9 @@ def delete_year(course, year_name):
     if os.path.exists(year_path):
         import shutil
         shutil.rmtree(year_path)
+        drop_section_docs(course, year_name)
+        unindex_logins_under(course, year_name)
+        invalidate_hierarchy()
         return jsonify({'success': True})
 
     return jsonify({'success': False, 'error': 'Year not found'})
@@ -805,10 +3660,39 @@ def delete_section(course, year, section_name):
     if os.path.exists(section_path):
         import shutil
         shutil.rmtree(section_path)
+        drop_section_docs(course, year, section_name)
+        unindex_logins_under(course, year, section_name)
+        invalidate_hierarchy()
         return jsonify({'success': True})
 
     return jsonify({'success': False, 'error': 'Section not found'})
 
+# Whole course/year/section tree in one call, from the hierarchy cache:
+#   [{name, years: [{name, sections: [{name, counts: {students, teachers, subjects}}]}]}]
+# depth=1 returns courses only, depth=2 adds years, depth=3 (default) sections.
+@app.route('/tree')
+def tree_api():
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        depth = int(request.args.get('depth') or 3)
+    except ValueError:
+        depth = 0
+    if depth not in (1, 2, 3):
+        return jsonify({'error': 'depth must be 1, 2 or 3'}), 400
+    out = []
+    for course, years in load_hierarchy().items():
+        node = {'name': course}
+        if depth >= 2:
+            node['years'] = []
+            for year, sections in years.items():
+                year_node = {'name': year}
+                if depth >= 3:
+                    year_node['sections'] = [{'name': sec, 'counts': section_counts(course, year, sec)} for sec in sections]
+                node['years'].append(year_node)
+        out.append(node)
+    return jsonify(out)
+
 # Year management
 @app.route('/get_years/<course>')
 def get_years_api(course):
@@ -833,6 +3717,7 @@ def add_year(course):
     year_path = os.path.join(DATA_DIR, course, year_name)
     if not os.path.exists(year_path):
         os.makedirs(year_path)
+        invalidate_hierarchy()
         return jsonify({'success': True})
 
     return jsonify({'success': False, 'error': 'Year already exists'})
@@ -872,16 +3757,16 @@ def add_section(course, year):
         save_secondary_admins(course, year, section_name, [])
         # Create chat storage file
         chat_path = os.path.join(DATA_DIR, course, year, section_name, 'chat.json')
-        with open(chat_path, 'w') as f:
-            json.dump({"groups": {}, "messages": {}}, f, indent=2)
+        write_section_json((course, year, section_name, 'chat'), chat_path, {"groups": {}})
         # Create certificates storage file
         cert_path = os.path.join(DATA_DIR, course, year, section_name, 'certificates.json')
-        with open(cert_path, 'w') as f:
-            json.dump({"byStudent": {}}, f, indent=2)
+        write_section_json((course, year, section_name, 'certificates'), cert_path, {"byStudent": {}})
         # Create scrutiny storage file
         scr_path = os.path.join(DATA_DIR, course, year, section_name, 'scrutiny.json')
-        with open(scr_path, 'w') as f:
-            json.dump({"requests": []}, f, indent=2)
+        write_section_json((course, year, section_name, 'scrutiny'), scr_path, {"requests": []})
+        # Nothing to migrate in a new section
+        save_schema_version(course, year, section_name, SCHEMA_VERSION)
+        invalidate_hierarchy()
         return jsonify({'success': True})
 
     return jsonify({'success': False, 'error': 'Section already exists'})
@@ -899,7 +3784,43 @@ def get_students_api(course, year, section):
         return jsonify({'error': str(e)}), 500
 
 
+# Students of every section matching q (name, roll number or email), best
+# matches first; secondary admins only see their own section.
+# Optional: course/year/section (narrow the search), offset, limit.
+@app.route('/search_students')
+def search_students_api():
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 401
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset') or 0))
+        limit = int(request.args.get('limit') or SEARCH_PAGE_DEFAULT)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    if session.get('user_type') == 'secondary':
+        scope = g.auth.scope
+        if not scope:
+            return jsonify({'error': 'Unauthorized'}), 401
+    else:
+        scope = []
+        for name in ('course', 'year', 'section'):
+            value = (request.args.get(name) or '').strip()
+            if not value:
+                break
+            scope.append(value)
+    total, results = search_students(query, scope, offset, limit)
+    next_offset = offset + len(results)
+    return jsonify({
+        'total': total,
+        'results': results,
+        'nextOffset': next_offset if next_offset < total else None,
+    })
+
+
 @app.route('/add_student/<course>/<year>/<section>', methods=['POST'])
+@with_section_lock
 def add_student(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -915,11 +3836,12 @@ def add_student(course, year, section):
             # Generate a unique filename
             ext = file.filename.rsplit('.', 1)[1].lower()
             filename = f"{uuid.uuid4().hex}.{ext}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            file.save(new_upload_path(filename))
+            queue_thumbnails(filename)
             photo_filename = filename
 
     # Generate a unique ID for the student
-    student_id = f"student_{len(students) + 1:03d}"
+    student_id = allocate_id(course, year, section, 'student', items_by_id(course, year, section, 'students', students))
 
     from datetime import datetime
 
@@ -941,11 +3863,13 @@ def add_student(course, year, section):
 
     students.append(student_data)
     save_students(course, year, section, students)
+    index_student_login(course, year, section, student_data)
 
     return jsonify({'success': True, 'studentId': student_id})
 
 # Delete student
 @app.route('/delete_student/<course>/<year>/<section>/<student_id>', methods=['DELETE'])
+@with_section_lock
 def delete_student(course, year, section, student_id):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -953,27 +3877,23 @@ def delete_student(course, year, section, student_id):
     students = get_students(course, year, section)
 
     # Find the student to be deleted and delete their photo if it exists
-    student_to_delete = None
-    for student in students:
-        if student['id'] == student_id:
-            student_to_delete = student
-            break
+    student_to_delete = find_student(course, year, section, student_id, students)
 
     if not student_to_delete:
         return jsonify({'success': False, 'error': 'Student not found'})
 
     # Delete the profile picture file if it exists
     if student_to_delete.get('photo'):
-        photo_path = os.path.join(app.config['UPLOAD_FOLDER'], student_to_delete['photo'])
-        if os.path.exists(photo_path):
-            os.remove(photo_path)
+        remove_upload(student_to_delete['photo'])
 
     updated_students = [s for s in students if s['id'] != student_id]
     save_students(course, year, section, updated_students)
+    unindex_student_login(course, year, section, student_to_delete)
     return jsonify({'success': True})
 
 # Edit student
 @app.route('/edit_student/<course>/<year>/<section>/<student_id>', methods=['PUT'])
+@with_section_lock
 def edit_student(course, year, section, student_id):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -981,41 +3901,38 @@ def edit_student(course, year, section, student_id):
     students = get_students(course, year, section)
     data = request.form if request.form else request.get_json()
 
-    student_found = False
-    for student in students:
-        if student['id'] == student_id:
-            student_found = True
-            # Update fields if present in data
-            for key in ['name', 'rollNumber', 'email', 'phone', 'fatherName', 'fatherPhone', 'motherName', 'motherPhone']:
-                if key in data:
-                    student[key] = data[key]
-
-            # Hash password if it is being changed
-            if hasattr(data, 'get'):
-                new_secret_password = data.get('secretPassword')
-                if new_secret_password is not None and str(new_secret_password).strip() != '':
-                    student['secretPassword'] = hash_password_sha256(str(new_secret_password).strip())
-
-            # Handle photo upload if present
-            if 'studentPhoto' in request.files:
-                file = request.files['studentPhoto']
-                if file and file.filename != '' and allowed_file(file.filename):
-                    # Delete the old photo file if it exists
-                    if student.get('photo'):
-                        old_photo_path = os.path.join(app.config['UPLOAD_FOLDER'], student['photo'])
-                        if os.path.exists(old_photo_path):
-                            os.remove(old_photo_path)
-
-                    ext = file.filename.rsplit('.', 1)[1].lower()
-                    filename = f"{uuid.uuid4().hex}.{ext}"
-                    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                    student['photo'] = filename
-            break
-
-    if not student_found:
+    student = find_student(course, year, section, student_id, students)
+    if student is None:
         return jsonify({'success': False, 'error': 'Student not found'})
 
+    old_login_key = student_login_key(student.get('rollNumber'), student.get('email'))
+    # Update fields if present in data
+    for key in ['name', 'rollNumber', 'email', 'phone', 'fatherName', 'fatherPhone', 'motherName', 'motherPhone']:
+        if key in data:
+            student[key] = data[key]
+
+    # Hash password if it is being changed
+    if hasattr(data, 'get'):
+        new_secret_password = data.get('secretPassword')
+        if new_secret_password is not None and str(new_secret_password).strip() != '':
+            student['secretPassword'] = hash_password_sha256(str(new_secret_password).strip())
+
+    # Handle photo upload if present
+    if 'studentPhoto' in request.files:
+        file = request.files['studentPhoto']
+        if file and file.filename != '' and allowed_file(file.filename):
+            # Delete the old photo file if it exists
+            if student.get('photo'):
+                remove_upload(student['photo'])
+
+            ext = file.filename.rsplit('.', 1)[1].lower()
+            filename = f"{uuid.uuid4().hex}.{ext}"
+            file.save(new_upload_path(filename))
+            queue_thumbnails(filename)
+            student['photo'] = filename
+
     save_students(course, year, section, students)
+    index_student_login(course, year, section, student, old_key=old_login_key)
     return jsonify({'success': True})
 
 # Secondary Admin (Faculty) management
@@ -1031,11 +3948,17 @@ def get_secondary_admins_api(course, year, section):
 
 
 @app.route('/add_secondary_admin/<course>/<year>/<section>', methods=['POST'])
+@with_section_lock
 def add_secondary_admin(course, year, section):
     if not is_main_admin():
         return jsonify({'error': 'Unauthorized'}), 401
 
     data = request.form
+    # Normalize subjects (required); checked before a photo is stored or an id is used up
+    subjects_raw = (data.get('subjects') or '').strip()
+    if not subjects_raw:
+        return jsonify({'success': False, 'error': 'Subjects are required'}), 400
+    subjects = [s.strip() for s in subjects_raw.split(',') if s.strip()]
     admins = get_secondary_admins(course, year, section)
 
     # Handle file upload
@@ -1044,17 +3967,12 @@ def add_secondary_admin(course, year, section):
         file = request.files['profPhoto']
         if file and file.filename != '' and allowed_file(file.filename):
             ext = file.filename.rsplit('.', 1)[1].lower()
-            filename = f"{uuid.uuid4().hex}.{ext}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            photo_filename = filename
-
-    prof_id = f"professor_{len(admins) + 1:03d}"
-
-    # Normalize subjects (required)
-    subjects_raw = (data.get('subjects') or '').strip()
-    if not subjects_raw:
-        return jsonify({'success': False, 'error': 'Subjects are required'}), 400
-    subjects = [s.strip() for s in subjects_raw.split(',') if s.strip()]
+            filename = f"{uuid.uuid4().hex}.{ext}"
+            file.save(new_upload_path(filename))
+            queue_thumbnails(filename)
+            photo_filename = filename
+
+    prof_id = allocate_id(course, year, section, 'professor', items_by_id(course, year, section, 'secondary_admin', admins))
 
     from datetime import datetime
 
@@ -1076,6 +3994,7 @@ def add_secondary_admin(course, year, section):
 
     admins.append(admin_data)
     save_secondary_admins(course, year, section, admins)
+    index_secondary_login(course, year, section, admin_data)
 
     # Auto-create assigned subjects in attendance for this section
     try:
@@ -1097,6 +4016,7 @@ def add_secondary_admin(course, year, section):
 
 
 @app.route('/edit_secondary_admin/<course>/<year>/<section>/<prof_id>', methods=['PUT'])
+@with_section_lock
 def edit_secondary_admin(course, year, section, prof_id):
     if not is_main_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1104,66 +4024,59 @@ def edit_secondary_admin(course, year, section, prof_id):
     admins = get_secondary_admins(course, year, section)
     data = request.form if request.form else request.get_json()
 
-    found = False
-    for adm in admins:
-        if adm['id'] == prof_id:
-            found = True
-            for key in ['name', 'userId', 'email', 'phone', 'fatherName', 'fatherPhone', 'motherName', 'motherPhone']:
-                if key in data:
-                    adm[key] = data[key]
-            # Hash password if it is being changed
-            if hasattr(data, 'get'):
-                new_password = data.get('password')
-                if new_password is not None and str(new_password).strip() != '':
-                    adm['password'] = hash_password_sha256(str(new_password).strip())
-            # Handle subjects
-            subj_raw = (data.get('subjects') or '').strip() if hasattr(data, 'get') else ''
-            if subj_raw:
-                adm['subjects'] = [s.strip() for s in subj_raw.split(',') if s.strip()]
-            # Handle photo
-            if 'profPhoto' in request.files:
-                file = request.files['profPhoto']
-                if file and file.filename != '' and allowed_file(file.filename):
-                    if adm.get('photo'):
-                        old_photo_path = os.path.join(app.config['UPLOAD_FOLDER'], adm['photo'])
-                        if os.path.exists(old_photo_path):
-                            os.remove(old_photo_path)
-                    ext = file.filename.rsplit('.', 1)[1].lower()
-                    filename = f"{uuid.uuid4().hex}.{ext}"
-                    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                    adm['photo'] = filename
-            break
-
-    if not found:
+    adm = find_secondary_admin(course, year, section, prof_id, admins)
+    if adm is None:
         return jsonify({'success': False, 'error': 'Secondary admin not found'})
 
+    old_user_id = adm.get('userId')
+    for key in ['name', 'userId', 'email', 'phone', 'fatherName', 'fatherPhone', 'motherName', 'motherPhone']:
+        if key in data:
+            adm[key] = data[key]
+    # Hash password if it is being changed
+    if hasattr(data, 'get'):
+        new_password = data.get('password')
+        if new_password is not None and str(new_password).strip() != '':
+            adm['password'] = hash_password_sha256(str(new_password).strip())
+    # Handle subjects
+    subj_raw = (data.get('subjects') or '').strip() if hasattr(data, 'get') else ''
+    if subj_raw:
+        adm['subjects'] = [s.strip() for s in subj_raw.split(',') if s.strip()]
+    # Handle photo
+    if 'profPhoto' in request.files:
+        file = request.files['profPhoto']
+        if file and file.filename != '' and allowed_file(file.filename):
+            if adm.get('photo'):
+                remove_upload(adm['photo'])
+            ext = file.filename.rsplit('.', 1)[1].lower()
+            filename = f"{uuid.uuid4().hex}.{ext}"
+            file.save(new_upload_path(filename))
+            queue_thumbnails(filename)
+            adm['photo'] = filename
+
     save_secondary_admins(course, year, section, admins)
+    index_secondary_login(course, year, section, adm, old_user_id=old_user_id)
     return jsonify({'success': True})
 
 
 @app.route('/delete_secondary_admin/<course>/<year>/<section>/<prof_id>', methods=['DELETE'])
+@with_section_lock
 def delete_secondary_admin(course, year, section, prof_id):
     if not is_main_admin():
         return jsonify({'error': 'Unauthorized'}), 401
 
     admins = get_secondary_admins(course, year, section)
 
-    target = None
-    for adm in admins:
-        if adm['id'] == prof_id:
-            target = adm
-            break
+    target = find_secondary_admin(course, year, section, prof_id, admins)
 
     if not target:
         return jsonify({'success': False, 'error': 'Secondary admin not found'})
 
     if target.get('photo'):
-        photo_path = os.path.join(app.config['UPLOAD_FOLDER'], target['photo'])
-        if os.path.exists(photo_path):
-            os.remove(photo_path)
+        remove_upload(target['photo'])
 
     admins = [a for a in admins if a['id'] != prof_id]
     save_secondary_admins(course, year, section, admins)
+    unindex_secondary_login(course, year, section, target)
     return jsonify({'success': True})
 
 # Activity management
@@ -1180,6 +4093,7 @@ def get_activities_api(course, year, section):
 
 
 @app.route('/add_activity/<course>/<year>/<section>', methods=['POST'])
+@with_section_lock
 def add_activity(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1188,7 +4102,7 @@ def add_activity(course, year, section):
     activities = get_activities(course, year, section)
 
     # Generate a unique ID for the activity
-    activity_id = f"activity_{len(activities) + 1:03d}"
+    activity_id = allocate_id(course, year, section, 'activity', items_by_id(course, year, section, 'activities', activities))
 
     activity_data = {
         'id': activity_id,
@@ -1204,21 +4118,22 @@ def add_activity(course, year, section):
 
 # Delete activity
 @app.route('/delete_activity/<course>/<year>/<section>/<activity_id>', methods=['DELETE'])
+@with_section_lock
 def delete_activity(course, year, section, activity_id):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
 
     activities = get_activities(course, year, section)
-    updated_activities = [a for a in activities if a['id'] != activity_id]
-
-    if len(updated_activities) == len(activities):
+    if find_activity(course, year, section, activity_id, activities) is None:
         return jsonify({'success': False, 'error': 'Activity not found'})
+    updated_activities = [a for a in activities if a['id'] != activity_id]
 
     save_activities(course, year, section, updated_activities)
     return jsonify({'success': True})
 
 # Edit activity
 @app.route('/edit_activity/<course>/<year>/<section>/<activity_id>', methods=['PUT'])
+@with_section_lock
 def edit_activity(course, year, section, activity_id):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1226,24 +4141,20 @@ def edit_activity(course, year, section, activity_id):
     activities = get_activities(course, year, section)
     data = request.get_json()
 
-    activity_found = False
-    for activity in activities:
-        if activity['id'] == activity_id:
-            activity_found = True
-            # Update fields if present in data
-            for key in ['name', 'details']:
-                if key in data:
-                    activity[key] = data[key]
-            break
-
-    if not activity_found:
+    activity = find_activity(course, year, section, activity_id, activities)
+    if activity is None:
         return jsonify({'success': False, 'error': 'Activity not found'})
+    # Update fields if present in data
+    for key in ['name', 'details']:
+        if key in data:
+            activity[key] = data[key]
 
     save_activities(course, year, section, activities)
     return jsonify({'success': True})
 
 # Student activity assignment
 @app.route('/assign_activities/<course>/<year>/<section>/<student_id>', methods=['POST'])
+@with_section_lock
 def assign_activities(course, year, section, student_id):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1252,11 +4163,10 @@ def assign_activities(course, year, section, student_id):
     students = get_students(course, year, section)
 
     # Find the student and update their activities
-    for student in students:
-        if student['id'] == student_id:
-            student['assignedActivities'] = data.get('activities', [])
-            student['remarks'] = data.get('remarks', '')
-            break
+    student = find_student(course, year, section, student_id, students)
+    if student is not None:
+        student['assignedActivities'] = data.get('activities', [])
+        student['remarks'] = data.get('remarks', '')
 
     save_students(course, year, section, students)
     return jsonify({'success': True})
@@ -1271,16 +4181,16 @@ def attendance_page():
 
 
 @app.route('/attendance/subjects/<course>/<year>/<section>')
+@with_section_lock
 def get_attendance_subjects(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
     data = load_attendance(course, year, section)
     # If secondary admin, restrict to their assigned subjects and their assigned section only
     if session.get('user_type') == 'secondary':
-        ctx = session.get('secondary_admin') or {}
-        if not (ctx.get('course') == course and ctx.get('year') == year and ctx.get('section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'error': 'Unauthorized'}), 401
-        prof_subs = set((ctx.get('profile') or {}).get('subjects') or [])
+        prof_subs = g.auth.subjects
         # Auto-sync: ensure teacher's subjects exist in attendance store for this section
         if prof_subs:
             changed = False
@@ -1300,6 +4210,7 @@ def get_attendance_subjects(course, year, section):
 
 
 @app.route('/attendance/subjects/<course>/<year>/<section>', methods=['POST'])
+@with_section_lock
 def add_attendance_subject(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1311,10 +4222,9 @@ def add_attendance_subject(course, year, section):
     # Permissions: secondary admins can only add subjects assigned to them and only within their section
     utype = session.get('user_type')
     if utype == 'secondary':
-        ctx = session.get('secondary_admin') or {}
-        if not (ctx.get('course') == course and ctx.get('year') == year and ctx.get('section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'error': 'Unauthorized'}), 401
-        assigned = set((ctx.get('profile') or {}).get('subjects') or [])
+        assigned = g.auth.subjects
         if name not in assigned:
             return jsonify({'success': False, 'error': 'You can only add your assigned subjects'}), 403
 
@@ -1331,6 +4241,7 @@ def add_attendance_subject(course, year, section):
 
 
 @app.route('/attendance/subjects/<course>/<year>/<section>/<subject>', methods=['DELETE'])
+@with_section_lock
 def delete_attendance_subject(course, year, section, subject):
     if not is_main_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1341,6 +4252,7 @@ def delete_attendance_subject(course, year, section, subject):
     subjects = [s for s in subjects if s != subject]
     data['subjects'] = subjects
     # Remove related records
+    drop_att_subject_totals(data, subject)
     if 'records' in data and subject in data['records']:
         del data['records'][subject]
     save_attendance(course, year, section, data)
@@ -1350,6 +4262,8 @@ def delete_attendance_subject(course, year, section, subject):
 @app.route('/attendance/records/<course>/<year>/<section>')
 def get_attendance_records(course, year, section):
     # Both admin roles and students can view, but students limited to their own
+    # The schema version is read before the snapshot: migrations save it last
+    current = schema_current(course, year, section)
     data = load_attendance(course, year, section)
     subject = request.args.get('subject')
     student_id = request.args.get('studentId')
@@ -1357,13 +4271,12 @@ def get_attendance_records(course, year, section):
         return jsonify({'error': 'subject and studentId are required'}), 400
     # If secondary admin, restrict by assigned section and subjects
     if session.get('user_type') == 'secondary':
-        ctx = session.get('secondary_admin') or {}
-        if not (ctx.get('course') == course and ctx.get('year') == year and ctx.get('section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'error': 'Unauthorized'}), 401
-        assigned = set((ctx.get('profile') or {}).get('subjects') or [])
+        assigned = g.auth.subjects
         if subject not in assigned:
             return jsonify({'error': 'Unauthorized'}), 401
-    entry = get_att_rec_entry(data, subject, student_id)
+    entry = get_att_rec_entry(data, subject, student_id, current)
     # Detailed view returns counts for present and absent
     if request.args.get('detailed') == '1':
         return jsonify({'present': entry.get('present', {}), 'absent': entry.get('absent', {})})
@@ -1372,6 +4285,7 @@ def get_attendance_records(course, year, section):
 
 
 @app.route('/attendance/records/<course>/<year>/<section>', methods=['POST'])
+@with_section_lock
 def save_attendance_records(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1383,61 +4297,254 @@ def save_attendance_records(course, year, section):
         return jsonify({'success': False, 'error': 'subject and studentId are required'}), 400
     # For secondary admin, enforce they can only mark within their section and assigned subjects
     if session.get('user_type') == 'secondary':
-        ctx = session.get('secondary_admin') or {}
-        if not (ctx.get('course') == course and ctx.get('year') == year and ctx.get('section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'success': False, 'error': 'Unauthorized'}), 401
-        assigned = set((ctx.get('profile') or {}).get('subjects') or [])
+        assigned = g.auth.subjects
         if subject not in assigned:
             return jsonify({'success': False, 'error': 'You can only mark attendance for your assigned subjects'}), 403
-    # Normalize dates to YYYY-MM-DD
-    norm_dates = []
-    for d in dates:
-        try:
-            norm_dates.append(str(d)[:10])
-        except Exception:
-            continue
+    norm_dates = normalize_att_dates(dates)
     data = load_attendance(course, year, section)
     data.setdefault('subjects', [])
     if subject not in data['subjects']:
         data['subjects'].append(subject)
 
-    # New model: counts per date, with status present/absent and operations
     status = (payload.get('status') or '').strip().lower()
     op = (payload.get('operation') or payload.get('op') or '').strip().lower()
     count = payload.get('count')
+    apply_att_change(data, subject, student_id, norm_dates, status, op, count)
 
-    entry = get_att_rec_entry(data, subject, student_id)
+    save_attendance(course, year, section, data)
+    return jsonify({'success': True})
 
-    if status in {'present', 'absent'} or op or (count is not None):
-        if status not in {'present', 'absent'}:
-            status = 'present'
-        if not op:
-            op = 'increment'
-        # default increment by 1 if not provided
+
+# Mark a whole class period in one request: one subject, one date (or a few),
+# and a list of {studentId, status, op, count}; the document is saved once.
+@app.route('/attendance/records/<course>/<year>/<section>/bulk', methods=['POST'])
+@with_section_lock
+def save_attendance_records_bulk(course, year, section):
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 401
+    payload = request.get_json() or {}
+    subject = payload.get('subject')
+    dates = payload.get('dates') or ([payload.get('date')] if payload.get('date') else [])
+    entries = payload.get('entries')
+    if not subject or not dates or not isinstance(entries, list) or not entries:
+        return jsonify({'success': False, 'error': 'subject, date and entries are required'}), 400
+    # Permissions are checked once for the whole batch
+    if session.get('user_type') == 'secondary':
+        if g.auth.scope != (course, year, section):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+        assigned = g.auth.subjects
+        if subject not in assigned:
+            return jsonify({'success': False, 'error': 'You can only mark attendance for your assigned subjects'}), 403
+    norm_dates = normalize_att_dates(dates)
+    known_ids = {s.get('id') for s in get_students(course, year, section)}
+
+    # Validate every entry before the document is touched
+    results = []
+    valid = []
+    for item in entries:
+        student_id = item.get('studentId') if isinstance(item, dict) else None
+        if not student_id:
+            results.append({'studentId': student_id, 'success': False, 'error': 'studentId is required'})
+            continue
+        if student_id not in known_ids:
+            results.append({'studentId': student_id, 'success': False, 'error': 'Student not found'})
+            continue
         try:
-            num = int(count) if count is not None else (1 if op == 'increment' else 0)
-        except Exception:
-            num = 1 if op == 'increment' else 0
-        # apply per date
-        for day in norm_dates:
-            cur = int(entry[status].get(day, 0))
-            if op == 'set':
-                entry[status][day] = max(int(count or 0), 0)
-            elif op in {'decrement', 'dec'}:
-                entry[status][day] = max(cur - (int(count or 1)), 0)
-            else:  # increment default
-                entry[status][day] = cur + (int(count or 1))
-        save_att_rec_entry(data, subject, student_id, entry)
-    else:
-        # Legacy behavior: replace present dates with single count each
-        entry['present'] = {}
-        for day in norm_dates:
-            entry['present'][day] = 1
-        # Keep existing absent counts intact
-        save_att_rec_entry(data, subject, student_id, entry)
+            int(item.get('count') or 0)
+        except (TypeError, ValueError):
+            results.append({'studentId': student_id, 'success': False, 'error': 'Invalid count'})
+            continue
+        valid.append((len(results), item))
+        results.append(None)
+    if not valid:
+        return jsonify({'success': False, 'error': 'No valid entries', 'subject': subject, 'dates': norm_dates, 'results': results}), 400
+
+    data = load_attendance(course, year, section)
+    data.setdefault('subjects', [])
+    if subject not in data['subjects']:
+        data['subjects'].append(subject)
+    for i, item in valid:
+        student_id = item['studentId']
+        status = (item.get('status') or '').strip().lower()
+        op = (item.get('operation') or item.get('op') or '').strip().lower()
+        entry = apply_att_change(data, subject, student_id, norm_dates, status, op, item.get('count'))
+        results[i] = {
+            'studentId': student_id,
+            'success': True,
+            'present': {d: entry['present'].get(d, 0) for d in norm_dates},
+            'absent': {d: entry['absent'].get(d, 0) for d in norm_dates}
+        }
 
     save_attendance(course, year, section, data)
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'subject': subject, 'dates': norm_dates, 'results': results})
+
+# Whole-section attendance in one response, columnar:
+#   students: student ids (row index), dates: sorted YYYY-MM-DD (column index),
+#   matrix[subject].present / .absent: flat row-major counts, len(students) * len(dates)
+# Optional filters: subject, from, to (inclusive YYYY-MM-DD).
+@app.route('/attendance/matrix/<course>/<year>/<section>')
+def get_attendance_matrix(course, year, section):
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 401
+    # One saved snapshot serves the whole response: the columnar one when the
+    # section has it, else the document. The schema version is read first
+    # because migrations save it after the document.
+    current = schema_current(course, year, section)
+    data = load_attendance_columns(course, year, section)
+    if data is not None:
+        records = {subj: data.student_ids(subj) for subj in data.subjects}
+        subjects = list(data.declared)
+    else:
+        data = load_attendance(course, year, section)
+        records = data.get('records') or {}
+        subjects = list(data.get('subjects') or [])
+    subjects.extend(s for s in records if s not in subjects)
+    subject = (request.args.get('subject') or '').strip()
+    # If secondary admin, restrict by assigned section and subjects
+    if session.get('user_type') == 'secondary':
+        if g.auth.scope != (course, year, section):
+            return jsonify({'error': 'Unauthorized'}), 401
+        assigned = g.auth.subjects
+        if subject and subject not in assigned:
+            return jsonify({'error': 'Unauthorized'}), 401
+        subjects = [s for s in subjects if s in assigned]
+    if subject:
+        subjects = [subject]
+    date_from = (request.args.get('from') or '').strip()[:10]
+    date_to = (request.args.get('to') or '').strip()[:10]
+
+    def in_range(day):
+        return (not date_from or day >= date_from) and (not date_to or day <= date_to)
+
+    # Roster order first, then ids that only appear in records (e.g. removed students)
+    student_ids = [s.get('id') for s in get_students(course, year, section) if s.get('id')]
+    seen = set(student_ids)
+    entries = {}
+    days = set()
+    for subj in subjects:
+        per_student = {}
+        for sid in (records.get(subj) or {}):
+            entry = get_att_rec_entry(data, subj, sid, current)
+            entry = {
+                'present': {d: n for d, n in entry['present'].items() if n > 0 and in_range(d)},
+                'absent': {d: n for d, n in entry['absent'].items() if n > 0 and in_range(d)}
+            }
+            if not entry['present'] and not entry['absent']:
+                continue
+            per_student[sid] = entry
+            days.update(entry['present'])
+            days.update(entry['absent'])
+            if sid not in seen:
+                seen.add(sid)
+                student_ids.append(sid)
+        entries[subj] = per_student
+
+    dates = sorted(days)
+    row_of = {sid: i for i, sid in enumerate(student_ids)}
+    col_of = {d: j for j, d in enumerate(dates)}
+    width = len(dates)
+    matrix = {}
+    for subj in subjects:
+        present = [0] * (len(student_ids) * width)
+        absent = [0] * (len(student_ids) * width)
+        for sid, entry in entries[subj].items():
+            base = row_of[sid] * width
+            for d, n in entry['present'].items():
+                present[base + col_of[d]] = n
+            for d, n in entry['absent'].items():
+                absent[base + col_of[d]] = n
+        matrix[subj] = {'present': present, 'absent': absent}
+
+    return jsonify({
+        'students': student_ids,
+        'dates': dates,
+        'subjects': subjects,
+        'matrix': matrix
+    })
+
+# Per-student attendance percentages served from the running totals.
+# Optional filters: subject, below=<percentage> (defaulters only).
+@app.route('/attendance/summary/<course>/<year>/<section>')
+def get_attendance_summary(course, year, section):
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 401
+    subject = (request.args.get('subject') or '').strip()
+    try:
+        below = float(request.args['below']) if request.args.get('below') else None
+    except ValueError:
+        return jsonify({'error': 'below must be a number'}), 400
+    assigned = None
+    if session.get('user_type') == 'secondary':
+        if g.auth.scope != (course, year, section):
+            return jsonify({'error': 'Unauthorized'}), 401
+        assigned = g.auth.subjects
+        if subject and subject not in assigned:
+            return jsonify({'error': 'Unauthorized'}), 401
+
+    data = load_attendance(course, year, section)
+    if 'totals' not in data or 'studentTotals' not in data:
+        with section_lock(course, year, section):
+            data = load_attendance(course, year, section)
+            if ensure_att_totals(data):
+                save_attendance(course, year, section, data)
+
+    totals = data['totals']
+    subjects = [subject] if subject else [s for s in totals if assigned is None or s in assigned]
+
+    def keep(view):
+        return below is None or (view['percentage'] is not None and view['percentage'] < below)
+
+    by_subject = {}
+    for subj in subjects:
+        rows = {}
+        for student_id, t in (totals.get(subj) or {}).items():
+            view = att_totals_view(t)
+            if keep(view):
+                rows[student_id] = view
+        by_subject[subj] = rows
+
+    # Overall per student: all subjects for admins, only assigned ones for secondary admins
+    if assigned is None and not subject:
+        overall_src = data['studentTotals']
+    else:
+        overall_src = {}
+        for subj in subjects:
+            for student_id, t in (totals.get(subj) or {}).items():
+                acc = overall_src.setdefault(student_id, {'present': 0, 'absent': 0, 'lastMarked': None})
+                acc['present'] += t['present']
+                acc['absent'] += t['absent']
+                if t['lastMarked'] and (acc['lastMarked'] or '') < t['lastMarked']:
+                    acc['lastMarked'] = t['lastMarked']
+    overall = {}
+    for student_id, t in overall_src.items():
+        view = att_totals_view(t)
+        if keep(view):
+            overall[student_id] = view
+
+    return jsonify({'subjects': by_subject, 'students': overall})
+
+
+@app.route('/reports/defaulters')
+def get_defaulters_report():
+    if not is_main_admin():
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        threshold = float(request.args.get('threshold') or 75)
+    except ValueError:
+        return jsonify({'error': 'threshold must be a number'}), 400
+    fmt = (request.args.get('format') or 'csv').lower()
+    if fmt not in {'csv', 'json'}:
+        return jsonify({'error': 'format must be csv or json'}), 400
+    course = (request.args.get('course') or '').strip() or None
+    date_from = (request.args.get('from') or '').strip()[:10] or None
+    date_to = (request.args.get('to') or '').strip()[:10] or None
+    rows = compute_defaulters(threshold, course, date_from, date_to)
+    if fmt == 'json':
+        return Response(stream_report_json(rows), mimetype='application/json')
+    return Response(stream_report_csv(rows), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=defaulters.csv'})
 
 # Attendance issues APIs
 @app.route('/attendance_issues/<course>/<year>/<section>')
@@ -1453,6 +4560,7 @@ def get_attendance_issues(course, year, section):
 
 
 @app.route('/student_attendance_issue', methods=['POST'])
+@with_section_lock
 def submit_student_attendance_issue():
     if session.get('user_type') != 'student':
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1472,7 +4580,7 @@ def submit_student_attendance_issue():
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data')
+    student = current_student()
     if not all([course, year, section, student]):
         return jsonify({'success': False, 'error': 'Student context missing'}), 400
     data = load_attendance_issues(course, year, section)
@@ -1494,6 +4602,7 @@ def submit_student_attendance_issue():
 
 
 @app.route('/attendance_issues/<course>/<year>/<section>/<issue_id>', methods=['PUT'])
+@with_section_lock
 def update_attendance_issue(course, year, section, issue_id):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1524,7 +4633,7 @@ def student_data():
     if session.get('user_type') != 'student':
         return jsonify({'error': 'Unauthorized'}), 401
 
-    student = session.get('student_data')
+    student = current_student()
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
@@ -1544,7 +4653,7 @@ def student_data():
             student_activities.append(activity_with_status)
 
     return jsonify({
-        'student': student,
+        'student': {k: v for k, v in student.items() if k != 'secretPassword'},
         'activities': student_activities,
         'course': course,
         'year': year,
@@ -1554,25 +4663,20 @@ def student_data():
 # Serve uploaded files
 # Student attendance APIs
 @app.route('/student_self_update', methods=['POST'])
+@with_section_lock
 def student_self_update():
     if session.get('user_type') != 'student':
         return jsonify({'error': 'Unauthorized'}), 401
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data') or {}
+    student = current_student() or {}
     if not all([course, year, section, student]):
         return jsonify({'success': False, 'error': 'Student context missing'}), 400
     students = get_students(course, year, section)
-    # Find current student index
-    idx = -1
-    for i, s in enumerate(students):
-        if s.get('id') == student.get('id'):
-            idx = i
-            break
-    if idx < 0:
+    cur = find_student(course, year, section, student.get('id'), students)
+    if cur is None:
         return jsonify({'success': False, 'error': 'Student not found'}), 404
-    cur = students[idx]
 
     # Handle password change (optional)
     new_pw = (request.form.get('newPassword') or '').strip()
@@ -1592,26 +4696,23 @@ def student_self_update():
             try:
                 old = cur.get('photo')
                 if old:
-                    old_path = os.path.join(app.config['UPLOAD_FOLDER'], old)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
+                    remove_upload(old)
             except Exception:
                 pass
             ext = f.filename.rsplit('.', 1)[-1].lower()
             saved = f"{uuid.uuid4().hex}.{ext}"
-            f.save(os.path.join(app.config['UPLOAD_FOLDER'], saved))
+            f.save(new_upload_path(saved))
+            queue_thumbnails(saved)
             cur['photo'] = saved
 
     # Persist
-    students[idx] = cur
     save_students(course, year, section, students)
-    # Update session
-    session['student_data'] = cur
 
     return jsonify({'success': True, 'student': {'id': cur.get('id'), 'photo': cur.get('photo')}})
 
 
 @app.route('/secondary_self_update_password', methods=['POST'])
+@with_section_lock
 def secondary_self_update_password():
     if session.get('user_type') != 'secondary':
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1624,11 +4725,10 @@ def secondary_self_update_password():
         return jsonify({'success': False, 'error': 'currentPassword and newPassword are required'}), 400
 
     ctx = session.get('secondary_admin') or {}
-    prof = ctx.get('profile') or {}
     course = ctx.get('course')
     year = ctx.get('year')
     section = ctx.get('section')
-    user_id = prof.get('userId') or session.get('user_id')
+    user_id = session.get('user_id')
 
     if not all([course, year, section, user_id]):
         return jsonify({'success': False, 'error': 'Secondary admin context missing'}), 400
@@ -1651,10 +4751,6 @@ def secondary_self_update_password():
 
     target['password'] = hash_password_sha256(new_password)
     save_secondary_admins(course, year, section, admins)
-
-    prof['password'] = hash_password_sha256(new_password)
-    ctx['profile'] = prof
-    session['secondary_admin'] = ctx
     return jsonify({'success': True})
 
 @app.route('/student_attendance_subjects')
@@ -1677,12 +4773,13 @@ def student_attendance_records():
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data')
+    student = current_student()
     subject = request.args.get('subject')
     if not all([course, year, section, student, subject]):
         return jsonify({'error': 'Missing parameters'}), 400
-    data = load_attendance(course, year, section)
-    entry = get_att_rec_entry(data, subject, student.get('id'))
+    current = schema_current(course, year, section)
+    data = load_attendance_columns(course, year, section) or load_attendance(course, year, section)
+    entry = get_att_rec_entry(data, subject, student.get('id'), current)
     # Detailed response returns counts for both present and absent per day
     if request.args.get('detailed') == '1':
         return jsonify({'present': entry.get('present', {}), 'absent': entry.get('absent', {})})
@@ -1697,7 +4794,7 @@ def student_attendance_issues():
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data')
+    student = current_student()
     if not all([course, year, section, student]):
         return jsonify({'error': 'Student context missing'}), 400
     subject = request.args.get('subject')
@@ -1710,7 +4807,20 @@ def student_attendance_issues():
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if not is_upload_name(filename):
+        abort(404)
+    width = thumb_width(request.args.get('w'))
+    thumb = make_thumbnail(filename, width) if width else None
+    try:
+        if thumb:
+            return upload_response(filename, thumb, etag=f"{filename}-w{width}")
+        return upload_response(filename, resolve_upload(filename))
+    except FileNotFoundError:
+        # Moved into its shard between resolving and opening
+        path = resolve_upload(filename)
+        if not os.path.isfile(path):
+            abort(404)
+        return upload_response(filename, path)
 
 
 @app.route('/logout')
@@ -1732,6 +4842,14 @@ def main_credentials():
     creds = load_main_credentials()
     return jsonify({'username': creds.get('username')})
 
+
+# Section document cache counters (protected: main admin only)
+@app.route('/cache_stats')
+def cache_stats():
+    if not is_main_admin():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'sections': section_cache_stats()})
+
 # Messages storage helpers
 
 def get_messages_path(course, year, section):
@@ -1743,25 +4861,41 @@ def get_messages_path(course, year, section):
 
 def load_messages(course, year, section):
     path = get_messages_path(course, year, section)
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return {"threads": {}}
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading messages file: {e}")
-            return {"threads": {}}
-    data = {"threads": {}}
+    data = read_section_json((course, year, section, 'messages'), path, lambda: {}, 'messages')
+    if data is not None:
+        if 'threads' in data:
+            data = move_dm_threads_to_logs(course, year, section)
+        return data
+    # If file doesn't exist, create default
+    data = {}
     save_messages(course, year, section, data)
     return data
 
 
+def dm_stream(student_id, teacher_id):
+    return f"dm/{student_id}|{teacher_id}"
+
+
+def move_dm_threads_to_logs(course, year, section):
+    # One-time move of threads stored inside messages.json into per-thread logs.
+    # Resumable: each thread continues from the number of messages already logged.
+    with section_lock(course, year, section):
+        data = read_section_json((course, year, section, 'messages'), get_messages_path(course, year, section),
+                                 lambda: {}, 'messages')
+        if data is None or 'threads' not in data:
+            return data if data is not None else {}
+        for key, thread in (data.get('threads') or {}).items():
+            stream = f"dm/{key}"
+            for msg in (thread or [])[log_count(course, year, section, stream):]:
+                log_append(course, year, section, stream, msg)
+        del data['threads']
+        save_messages(course, year, section, data)
+        return data
+
+
 def save_messages(course, year, section, data):
     path = get_messages_path(course, year, section)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    write_section_json((course, year, section, 'messages'), path, data)
 
 # Chat (group) storage helpers
 
@@ -1774,25 +4908,37 @@ def get_chat_path(course, year, section):
 
 def load_chat(course, year, section):
     path = get_chat_path(course, year, section)
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return {"groups": {}, "messages": {}}
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading chat file: {e}")
-            return {"groups": {}, "messages": {}}
-    data = {"groups": {}, "messages": {}}
+    data = read_section_json((course, year, section, 'chat'), path, lambda: {"groups": {}}, 'chat')
+    if data is not None:
+        if 'messages' in data:
+            data = move_chat_messages_to_logs(course, year, section)
+        return data
+    # If file doesn't exist, create default
+    data = {"groups": {}}
     save_chat(course, year, section, data)
     return data
 
 
+def move_chat_messages_to_logs(course, year, section):
+    # One-time move of messages stored inside chat.json into the group logs.
+    # Resumable: each group continues from the number of messages already logged.
+    with section_lock(course, year, section):
+        data = read_section_json((course, year, section, 'chat'), get_chat_path(course, year, section),
+                                 lambda: {"groups": {}}, 'chat')
+        if data is None or 'messages' not in data:
+            return data if data is not None else {"groups": {}}
+        for group_id, msgs in (data.get('messages') or {}).items():
+            stream = f'chat/{group_id}'
+            for msg in (msgs or [])[log_count(course, year, section, stream):]:
+                log_append(course, year, section, stream, msg)
+        del data['messages']
+        save_chat(course, year, section, data)
+        return data
+
+
 def save_chat(course, year, section, data):
     path = get_chat_path(course, year, section)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    write_section_json((course, year, section, 'chat'), path, data)
 
 # Certificates storage helpers
 
@@ -1805,16 +4951,10 @@ def get_certificates_path(course, year, section):
 
 def load_certificates(course, year, section):
     path = get_certificates_path(course, year, section)
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return {"byStudent": {}}
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading certificates file: {e}")
-            return {"byStudent": {}}
+    data = read_section_json((course, year, section, 'certificates'), path, lambda: {"byStudent": {}}, 'certificates')
+    if data is not None:
+        return data
+    # If file doesn't exist, create default
     data = {"byStudent": {}}
     save_certificates(course, year, section, data)
     return data
@@ -1822,8 +4962,7 @@ def load_certificates(course, year, section):
 
 def save_certificates(course, year, section, data):
     path = get_certificates_path(course, year, section)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    write_section_json((course, year, section, 'certificates'), path, data)
 
 # Scrutiny storage helpers
 
@@ -1836,16 +4975,10 @@ def get_scrutiny_path(course, year, section):
 
 def load_scrutiny(course, year, section):
     path = get_scrutiny_path(course, year, section)
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return {"requests": []}
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading scrutiny file: {e}")
-            return {"requests": []}
+    data = read_section_json((course, year, section, 'scrutiny'), path, lambda: {"requests": []}, 'scrutiny')
+    if data is not None:
+        return data
+    # If file doesn't exist, create default
     data = {"requests": []}
     save_scrutiny(course, year, section, data)
     return data
@@ -1853,8 +4986,7 @@ def load_scrutiny(course, year, section):
 
 def save_scrutiny(course, year, section, data):
     path = get_scrutiny_path(course, year, section)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    write_section_json((course, year, section, 'scrutiny'), path, data)
 
 # Certificates APIs
 
@@ -1871,6 +5003,7 @@ def get_certificates_api(course, year, section):
 
 
 @app.route('/certificates/<course>/<year>/<section>', methods=['POST'])
+@with_section_lock
 def add_certificate_api(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1880,12 +5013,8 @@ def add_certificate_api(course, year, section):
     file = request.files.get('certFile') if request.files else None
     if not student_id or not name or not file or not file.filename:
         return jsonify({'success': False, 'error': 'studentId, name and certFile are required'}), 400
-    # Save file with any extension
-    orig_fn = secure_filename(file.filename)
-    ext = orig_fn.rsplit('.', 1)[-1].lower() if '.' in orig_fn else ''
-    saved = f"cert_{uuid.uuid4().hex}.{ext}" if ext else f"cert_{uuid.uuid4().hex}"
-    save_path = os.path.join(app.config['UPLOAD_FOLDER'], saved)
-    file.save(save_path)
+    # Store file (any extension) as a shared blob
+    orig_fn, saved = store_upload(file)
     # Uploader info
     utype = session.get('user_type')
     uploader_id = session.get('user_id') or session.get('userId') or ''
@@ -1894,7 +5023,7 @@ def add_certificate_api(course, year, section):
         uploader_id = 'faculty'
         uploader_name = 'Main Admin'
     elif utype == 'secondary':
-        prof = (session.get('secondary_admin') or {}).get('profile') or {}
+        prof = current_secondary_profile() or {}
         if prof.get('name'):
             uploader_name = prof.get('name')
     entry = {
@@ -1915,6 +5044,7 @@ def add_certificate_api(course, year, section):
 
 
 @app.route('/certificates/<course>/<year>/<section>/<cert_id>', methods=['DELETE'])
+@with_section_lock
 def delete_certificate_api(course, year, section, cert_id):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1937,22 +5067,12 @@ def delete_certificate_api(course, year, section, cert_id):
     arr.pop(idx)
     by[student_id] = arr
     data['byStudent'] = by
-    # delete stored file if present
+    # release the stored file if present
     saved_name = found.get('storedFilename')
-    if not saved_name:
-        try:
-            url = found.get('url') or ''
-            saved_name = url.rsplit('/', 1)[-1] if '/uploads/' in url else None
-        except Exception:
-            saved_name = None
-    if saved_name:
-        try:
-            fpath = os.path.join(app.config['UPLOAD_FOLDER'], saved_name)
-            if os.path.exists(fpath):
-                os.remove(fpath)
-        except Exception:
-            pass
+    if not saved_name and not schema_current(course, year, section):
+        saved_name = upload_name_from_url(found.get('url'))
     save_certificates(course, year, section, data)
+    release_upload(saved_name)
     return jsonify({'success': True})
 
 
@@ -1963,7 +5083,7 @@ def student_certificates():
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data') or {}
+    student = current_student() or {}
     if not all([course, year, section, student]):
         return jsonify({'error': 'Student context missing'}), 400
     data = load_certificates(course, year, section)
@@ -1973,6 +5093,7 @@ def student_certificates():
 # Scrutiny APIs (certificate verification workflow)
 
 @app.route('/scrutiny/student_submit', methods=['POST'])
+@with_section_lock
 def scrutiny_student_submit():
     if session.get('user_type') != 'student':
         return jsonify({'error': 'Unauthorized'}), 401
@@ -1983,14 +5104,10 @@ def scrutiny_student_submit():
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data') or {}
+    student = current_student() or {}
     if not all([course, year, section, student]):
         return jsonify({'success': False, 'error': 'Student context missing'}), 400
-    fn = secure_filename(file.filename)
-    ext = fn.rsplit('.', 1)[-1].lower() if '.' in fn else ''
-    saved = f"scr_{uuid.uuid4().hex}.{ext}" if ext else f"scr_{uuid.uuid4().hex}"
-    save_path = os.path.join(app.config['UPLOAD_FOLDER'], saved)
-    file.save(save_path)
+    fn, saved = store_upload(file)
     item = {
         'id': f"scr_{uuid.uuid4().hex[:8]}",
         'studentId': student.get('id'),
@@ -2015,7 +5132,7 @@ def student_scrutiny():
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data') or {}
+    student = current_student() or {}
     if not all([course, year, section, student]):
         return jsonify({'error': 'Student context missing'}), 400
     data = load_scrutiny(course, year, section)
@@ -2032,6 +5149,7 @@ def list_scrutiny(course, year, section):
 
 
 @app.route('/scrutiny/<course>/<year>/<section>/<req_id>', methods=['PUT'])
+@with_section_lock
 def update_scrutiny(course, year, section, req_id):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -2049,7 +5167,7 @@ def update_scrutiny(course, year, section, req_id):
                 r['remark'] = remark
             r['remarkedAt'] = __import__('datetime').datetime.now().isoformat()
             utype = session.get('user_type')
-            who_name = 'Main Admin' if utype == 'faculty' else ((session.get('secondary_admin') or {}).get('profile') or {}).get('name')
+            who_name = 'Main Admin' if utype == 'faculty' else (current_secondary_profile() or {}).get('name')
             r['remarkedBy'] = {'type': 'teacher', 'id': session.get('user_id') or session.get('userId') or '', 'name': who_name}
             updated = True
             break
@@ -2060,6 +5178,7 @@ def update_scrutiny(course, year, section, req_id):
 
 
 @app.route('/scrutiny/student/<req_id>', methods=['DELETE'])
+@with_section_lock
 def delete_student_scrutiny(req_id):
     # Student can delete their own submission at any time
     if session.get('user_type') != 'student':
@@ -2067,7 +5186,7 @@ def delete_student_scrutiny(req_id):
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data') or {}
+    student = current_student() or {}
     if not all([course, year, section, student]):
         return jsonify({'success': False, 'error': 'Student context missing'}), 400
     data = load_scrutiny(course, year, section)
@@ -2081,19 +5200,11 @@ def delete_student_scrutiny(req_id):
             break
     if idx < 0:
         return jsonify({'success': False, 'error': 'Submission not found'}), 404
-    # Remove file if stored
-    try:
-        saved_name = (target.get('file') or {}).get('storedFilename')
-        if saved_name:
-            fpath = os.path.join(app.config['UPLOAD_FOLDER'], saved_name)
-            if os.path.exists(fpath):
-                os.remove(fpath)
-    except Exception:
-        pass
-    # Remove entry and save
+    # Remove entry and save, then release the stored file
     reqs.pop(idx)
     data['requests'] = reqs
     save_scrutiny(course, year, section, data)
+    release_upload((target.get('file') or {}).get('storedFilename'))
     return jsonify({'success': True})
 
 
@@ -2151,14 +5262,17 @@ def list_groups(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
     data = load_chat(course, year, section)
-    groups = list((data.get('groups') or {}).values())
-    # augment with counts
-    for g in groups:
-        g['memberCount'] = len(g.get('members', []))
+    groups = []
+    # augment with counts (on copies; the loaded document is cached)
+    for g in (data.get('groups') or {}).values():
+        gg = dict(g)
+        gg['memberCount'] = len(g.get('members', []))
+        groups.append(gg)
     return jsonify(groups)
 
 
 @app.route('/groups/<course>/<year>/<section>/auto', methods=['POST'])
+@with_section_lock
 def ensure_auto_group(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -2178,6 +5292,7 @@ def ensure_auto_group(course, year, section):
 
 
 @app.route('/groups/<course>/<year>/<section>/custom', methods=['POST'])
+@with_section_lock
 def create_custom_group(course, year, section):
     if not is_main_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -2210,7 +5325,8 @@ def create_custom_group(course, year, section):
         fn = secure_filename(photo_file.filename)
         ext = fn.rsplit('.', 1)[-1].lower() if '.' in fn else ''
         saved = f"group_{uuid.uuid4().hex}.{ext}" if ext else f"group_{uuid.uuid4().hex}"
-        photo_file.save(os.path.join(app.config['UPLOAD_FOLDER'], saved))
+        photo_file.save(new_upload_path(saved))
+        queue_thumbnails(saved)
         photo_name = saved
     # Build member objects from keys like 'student:<id>' or 'teacher:<id>'
     member_objs = []
@@ -2245,6 +5361,7 @@ def create_custom_group(course, year, section):
 
 
 @app.route('/groups/<course>/<year>/<section>/<group_id>', methods=['PUT'])
+@with_section_lock
 def update_group(course, year, section, group_id):
     if not is_main_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -2280,7 +5397,11 @@ def update_group(course, year, section, group_id):
         fn = secure_filename(photo_file.filename)
         ext = fn.rsplit('.', 1)[-1].lower() if '.' in fn else ''
         saved = f"group_{uuid.uuid4().hex}.{ext}" if ext else f"group_{uuid.uuid4().hex}"
-        photo_file.save(os.path.join(app.config['UPLOAD_FOLDER'], saved))
+        # Delete the old photo file (and its thumbnails) if it exists
+        if group.get('photo'):
+            remove_upload(group['photo'])
+        photo_file.save(new_upload_path(saved))
+        queue_thumbnails(saved)
         group['photo'] = saved
     save_chat(course, year, section, data)
     return jsonify({'success': True, 'group': group})
@@ -2297,16 +5418,21 @@ def get_group_messages(course, year, section, group_id):
         return jsonify({'error': 'Group not found'}), 404
     # students can only access if they are members
     if utype == 'student':
-        student = session.get('student_data') or {}
+        student = current_student() or {}
         sid = student.get('id')
         if not any(m for m in group.get('members', []) if m.get('type') == 'student' and m.get('id') == sid):
             return jsonify({'error': 'Unauthorized'}), 401
     # OK for admins
-    msgs = (data.get('messages') or {}).get(group_id, [])
+    try:
+        before, after, limit = parse_log_cursor()
+    except ValueError:
+        return jsonify({'error': 'before, after and limit must be integers'}), 400
+    msgs = log_page(course, year, section, f'chat/{group_id}', before=before, after=after, limit=limit)
     return jsonify(msgs)
 
 
 @app.route('/groups/messages/<course>/<year>/<section>/<group_id>', methods=['POST'])
+@with_section_lock
 def send_group_message(course, year, section, group_id):
     utype = session.get('user_type')
     if utype not in {'faculty', 'secondary', 'student'}:
@@ -2315,9 +5441,10 @@ def send_group_message(course, year, section, group_id):
     group = (data.get('groups') or {}).get(group_id)
     if not group:
         return jsonify({'success': False, 'error': 'Group not found'}), 404
+    auto_join = False
     # Determine sender
     if utype == 'student':
-        student = session.get('student_data') or {}
+        student = current_student() or {}
         sender_type = 'student'
         sender_id = student.get('id')
         # ensure student is member
@@ -2331,14 +5458,17 @@ def send_group_message(course, year, section, group_id):
             sender_id = 'faculty'
         # ensure teacher in the section's group; if not, allow main admin implicitly
         if not any(m for m in group.get('members', []) if m.get('type') == 'teacher' and m.get('id') == sender_id):
-            # auto-add teacher if main faculty
+            # auto-add teacher if main faculty (applied below, once sending is allowed)
             if sender_id == 'faculty':
-                group.setdefault('members', []).append({'type': 'teacher', 'id': 'faculty', 'name': 'Main Admin'})
+                auto_join = True
             else:
                 return jsonify({'success': False, 'error': 'Unauthorized'}), 401
     # permissions
     if not can_send_in_group(group, sender_type, sender_id):
         return jsonify({'success': False, 'error': 'Sending not allowed by group permissions'}), 403
+    if auto_join:
+        group.setdefault('members', []).append({'type': 'teacher', 'id': 'faculty', 'name': 'Main Admin'})
+        save_chat(course, year, section, data)
     # payload
     if request.content_type and 'application/json' in request.content_type:
         payload = request.get_json() or {}
@@ -2351,12 +5481,8 @@ def send_group_message(course, year, section, group_id):
     atts = []
     for f in (files or []):
         if f and f.filename:
-            fn = secure_filename(f.filename)
-            ext = fn.rsplit('.', 1)[-1].lower() if '.' in fn else ''
-            saved_name = f"grp_{uuid.uuid4().hex}.{ext}" if ext else f"grp_{uuid.uuid4().hex}"
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], saved_name)
-            f.save(save_path)
-            atts.append({'filename': fn, 'url': url_for('uploaded_file', filename=saved_name)})
+            fn, saved_name = store_upload(f)
+            atts.append({'filename': fn, 'url': url_for('uploaded_file', filename=saved_name), 'storedFilename': saved_name})
     msg = {
         'id': f"msg_{uuid.uuid4().hex[:8]}",
         'from': {'type': sender_type, 'id': sender_id},
@@ -2364,9 +5490,9 @@ def send_group_message(course, year, section, group_id):
         'attachments': atts,
         'ts': __import__('datetime').datetime.now().isoformat()
     }
-    msgs = data.setdefault('messages', {}).setdefault(group_id, [])
-    msgs.append(msg)
-    save_chat(course, year, section, data)
+    msg['seq'] = log_append(course, year, section, f'chat/{group_id}', msg)
+    hub_publish(course, year, section, f'chat/{group_id}')
+    index_content_message(course, year, section, f'chat/{group_id}', msg)
     return jsonify({'success': True, 'message': msg})
 
 
@@ -2382,16 +5508,10 @@ def get_notes_path(course, year, section):
 
 def load_notes(course, year, section):
     path = get_notes_path(course, year, section)
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return {"bySubject": {}}
-                return json.loads(content)
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error reading notes file: {e}")
-            return {"bySubject": {}}
+    data = read_section_json((course, year, section, 'notes'), path, lambda: {"bySubject": {}}, 'notes')
+    if data is not None:
+        return data
+    # If file doesn't exist, create default
     data = {"bySubject": {}}
     save_notes(course, year, section, data)
     return data
@@ -2399,8 +5519,7 @@ def load_notes(course, year, section):
 
 def save_notes(course, year, section, data):
     path = get_notes_path(course, year, section)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    write_section_json((course, year, section, 'notes'), path, data)
 
 # Notes APIs
 
@@ -2413,10 +5532,9 @@ def list_notes_api(course, year, section):
         return jsonify({'error': 'subject is required'}), 400
     # Permissions for secondary admin: enforce assigned section and subject
     if session.get('user_type') == 'secondary':
-        ctx = session.get('secondary_admin') or {}
-        if not (ctx.get('course') == course and ctx.get('year') == year and ctx.get('section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'error': 'Unauthorized'}), 401
-        assigned = set((ctx.get('profile') or {}).get('subjects') or [])
+        assigned = g.auth.subjects
         if subject not in assigned:
             return jsonify({'error': 'Unauthorized'}), 401
     data = load_notes(course, year, section)
@@ -2425,6 +5543,7 @@ def list_notes_api(course, year, section):
 
 
 @app.route('/notes/<course>/<year>/<section>', methods=['POST'])
+@with_section_lock
 def upload_note_api(course, year, section):
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -2439,10 +5558,9 @@ def upload_note_api(course, year, section):
     utype = session.get('user_type')
     # Secondary admin restriction: only their assigned section and subjects
     if utype == 'secondary':
-        ctx = session.get('secondary_admin') or {}
-        if not (ctx.get('course') == course and ctx.get('year') == year and ctx.get('section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'success': False, 'error': 'Unauthorized'}), 401
-        assigned = set((ctx.get('profile') or {}).get('subjects') or [])
+        assigned = g.auth.subjects
         if subject not in assigned:
             return jsonify({'success': False, 'error': 'You can only upload to your assigned subjects'}), 403
 
@@ -2459,16 +5577,12 @@ def upload_note_api(course, year, section):
         except Exception as e:
             print(f"Warning: failed to sync subject into attendance for notes: {e}")
 
-    # Save file with original extension
-    orig_fn = secure_filename(file.filename)
-    ext = orig_fn.rsplit('.', 1)[-1].lower() if '.' in orig_fn else ''
-    saved = f"note_{uuid.uuid4().hex}.{ext}" if ext else f"note_{uuid.uuid4().hex}"
-    save_path = os.path.join(app.config['UPLOAD_FOLDER'], saved)
-    file.save(save_path)
+    # Store file (original extension kept) as a shared blob
+    orig_fn, saved = store_upload(file)
 
     # Uploader info
     uploader_id = session.get('user_id') or session.get('userId') or ''
-    uploader_name = 'Main Admin' if utype == 'faculty' else ((session.get('secondary_admin') or {}).get('profile') or {}).get('name') or uploader_id
+    uploader_name = 'Main Admin' if utype == 'faculty' else (current_secondary_profile() or {}).get('name') or uploader_id
 
     item = {
         'id': f"note_{uuid.uuid4().hex[:8]}",
@@ -2484,10 +5598,12 @@ def upload_note_api(course, year, section):
     by.setdefault(subject, [])
     by[subject].append(item)
     save_notes(course, year, section, data)
+    index_content_note(course, year, section, item)
     return jsonify({'success': True, 'note': item})
 
 
 @app.route('/notes/<course>/<year>/<section>/<note_id>', methods=['DELETE'])
+@with_section_lock
 def delete_note_api(course, year, section, note_id):
     # Allow main admin or secondary admin (restricted to their own section and assigned subjects)
     if not is_admin():
@@ -2517,28 +5633,16 @@ def delete_note_api(course, year, section, note_id):
 
     # If secondary admin, enforce section and subject ownership of the note
     if session.get('user_type') == 'secondary':
-        ctx = session.get('secondary_admin') or {}
-        if not (ctx.get('course') == course and ctx.get('year') == year and ctx.get('section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'error': 'Unauthorized'}), 401
-        assigned = set((ctx.get('profile') or {}).get('subjects') or [])
+        assigned = g.auth.subjects
         if target_subject not in assigned:
             return jsonify({'error': 'Unauthorized'}), 401
 
-    # Delete stored file if present
+    # Stored file to release once the note is gone
     saved_name = (target_note.get('file') or {}).get('storedFilename')
-    if not saved_name:
-        try:
-            url = (target_note.get('file') or {}).get('url') or ''
-            saved_name = url.rsplit('/', 1)[-1] if '/uploads/' in url else None
-        except Exception:
-            saved_name = None
-    if saved_name:
-        try:
-            fpath = os.path.join(app.config['UPLOAD_FOLDER'], saved_name)
-            if os.path.exists(fpath):
-                os.remove(fpath)
-        except Exception:
-            pass
+    if not saved_name and not schema_current(course, year, section):
+        saved_name = upload_name_from_url((target_note.get('file') or {}).get('url'))
 
     # Remove note from list and persist
     arr = by.get(target_subject, [])
@@ -2549,41 +5653,10 @@ def delete_note_api(course, year, section, note_id):
         save_notes(course, year, section, data)
     else:
         return jsonify({'success': False, 'error': 'Note not found'}), 404
+    unindex_content_note(course, year, section, note_id)
+    release_upload(saved_name)
 
     return jsonify({'success': True})
-    data = load_notes(course, year, section)
-    by = data.get('bySubject', {})
-    found = None
-    found_key = None
-    idx = -1
-    for subj, arr in by.items():
-        for i, n in enumerate(arr or []):
-            if n.get('id') == note_id:
-                found = n
-                found_key = subj
-                idx = i
-                break
-        if found:
-            break
-    if found is None:
-        return jsonify({'success': False, 'error': 'Note not found'}), 404
-    # remove file
-    try:
-        saved_name = (found.get('file') or {}).get('storedFilename')
-        if saved_name:
-            path = os.path.join(app.config['UPLOAD_FOLDER'], saved_name)
-            if os.path.exists(path):
-                os.remove(path)
-    except Exception:
-        pass
-    # remove entry
-    try:
-        by[found_key].pop(idx)
-    except Exception:
-        pass
-    data['bySubject'] = by
-    save_notes(course, year, section, data)
-    return jsonify({'success': True})
 
 
 @app.route('/student_notes')
@@ -2653,7 +5726,7 @@ def student_groups():
     course = session.get('student_course')
     year = session.get('student_year')
     section = session.get('student_section')
-    student = session.get('student_data') or {}
+    student = current_student() or {}
     if not all([course, year, section, student]):
         return jsonify({'error': 'Student context missing'}), 400
     data = load_chat(course, year, section)
@@ -2681,11 +5754,11 @@ def get_message_thread(course, year, section):
     # Authorization: students can only read their own threads; admins can read any in a section
     utype = session.get('user_type')
     if utype == 'student':
-        student = session.get('student_data') or {}
+        student = current_student() or {}
         if student.get('id') != student_id:
             return jsonify({'error': 'Unauthorized'}), 401
         # Ensure the section matches student's section
-        if not (session.get('student_course') == course and session.get('student_year') == year and session.get('student_section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'error': 'Unauthorized'}), 401
     elif utype in {'faculty', 'secondary'}:
         # OK
@@ -2693,14 +5766,18 @@ def get_message_thread(course, year, section):
     else:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    data = load_messages(course, year, section)
-    key = f"{student_id}|{teacher_id}"
-    thread = data.get('threads', {}).get(key, [])
+    try:
+        before, after, limit = parse_log_cursor()
+    except ValueError:
+        return jsonify({'error': 'before, since and limit must be integers'}), 400
+    load_messages(course, year, section)  # moves legacy threads into logs on first use
+    thread = log_page(course, year, section, dm_stream(student_id, teacher_id), before=before, after=after, limit=limit)
     return jsonify(thread)
 
 
 # Send a message in a thread; supports text and optional file uploads
 @app.route('/messages/send/<course>/<year>/<section>', methods=['POST'])
+@with_section_lock
 def send_message(course, year, section):
     utype = session.get('user_type')
     if utype not in {'student', 'faculty', 'secondary'}:
@@ -2729,10 +5806,10 @@ def send_message(course, year, section):
 
     # Authorization checks and context matching
     if utype == 'student':
-        student = session.get('student_data') or {}
+        student = current_student() or {}
         if student.get('id') != student_id:
             return jsonify({'success': False, 'error': 'Unauthorized'}), 401
-        if not (session.get('student_course') == course and session.get('student_year') == year and session.get('student_section') == section):
+        if g.auth.scope != (course, year, section):
             return jsonify({'success': False, 'error': 'Unauthorized'}), 401
         sender = 'student'
     else:
@@ -2742,10 +5819,7 @@ def send_message(course, year, section):
             return jsonify({'success': False, 'error': 'Unauthorized'}), 401
         sender = 'teacher'
 
-    data = load_messages(course, year, section)
-    threads = data.setdefault('threads', {})
-    key = f"{student_id}|{teacher_id}"
-    thread = threads.setdefault(key, [])
+    load_messages(course, year, section)  # moves legacy threads into logs on first use
 
     # Handle file uploads
     atts = []
@@ -2753,12 +5827,8 @@ def send_message(course, year, section):
         for f in files:
             if f and f.filename:
                 # Save any file type; optionally restrict by ALLOWED_EXTENSIONS if desired
-                fn = secure_filename(f.filename)
-                ext = fn.rsplit('.', 1)[-1].lower() if '.' in fn else ''
-                saved_name = f"msg_{uuid.uuid4().hex}.{ext}" if ext else f"msg_{uuid.uuid4().hex}"
-                save_path = os.path.join(app.config['UPLOAD_FOLDER'], saved_name)
-                f.save(save_path)
-                atts.append({'filename': fn, 'url': url_for('uploaded_file', filename=saved_name)})
+                fn, saved_name = store_upload(f)
+                atts.append({'filename': fn, 'url': url_for('uploaded_file', filename=saved_name), 'storedFilename': saved_name})
 
     msg = {
         'id': f"msg_{uuid.uuid4().hex[:8]}",
@@ -2768,12 +5838,462 @@ def send_message(course, year, section):
         'ts': __import__('datetime').datetime.now().isoformat()
     }
 
-    thread.append(msg)
-    save_messages(course, year, section, data)
+    msg['seq'] = log_append(course, year, section, dm_stream(student_id, teacher_id), msg)
+    hub_publish(course, year, section, dm_stream(student_id, teacher_id))
+    index_content_message(course, year, section, dm_stream(student_id, teacher_id), msg)
 
     return jsonify({'success': True, 'message': msg})
 
+# Real-time message delivery
+# send_group_message/send_message publish the stream they appended to on an
+# in-process hub; /events/messages (Server-Sent Events) and
+# /events/messages/poll (long-poll fallback) wake on it and read the new
+# messages from the logs. Waits also time out every HUB_HEARTBEAT_SECONDS to
+# re-check the logs, so messages appended by other worker processes still
+# arrive, only later. Each open stream holds a server thread (or greenlet).
+
+HUB_HEARTBEAT_SECONDS = float(os.getenv('HUB_HEARTBEAT_SECONDS', '15'))
+HUB_POLL_MAX_SECONDS = 30
+HUB_SUBSCRIBERS = {}  # (course, year, section, stream) -> set of subscriber queues
+HUB_LOCK = threading.Lock()
+
+
+def hub_publish(course, year, section, stream):
+    with HUB_LOCK:
+        waiters = list(HUB_SUBSCRIBERS.get((course, year, section, stream), ()))
+    for q in waiters:
+        q.put(stream)
+
+
+def hub_subscribe(course, year, section, streams, q):
+    with HUB_LOCK:
+        for stream in streams:
+            HUB_SUBSCRIBERS.setdefault((course, year, section, stream), set()).add(q)
+
+
+def hub_unsubscribe(course, year, section, streams, q):
+    with HUB_LOCK:
+        for stream in streams:
+            key = (course, year, section, stream)
+            waiters = HUB_SUBSCRIBERS.get(key)
+            if waiters is not None:
+                waiters.discard(q)
+                if not waiters:
+                    del HUB_SUBSCRIBERS[key]
+
+
+def hub_wait(q, timeout):
+    # Streams published to while waiting, or None when the wait timed out
+    try:
+        dirty = {q.get(timeout=timeout)}
+    except queue.Empty:
+        return None
+    while True:
+        try:
+            dirty.add(q.get_nowait())
+        except queue.Empty:
+            return dirty
+
+
+def message_viewer(course, year, section):
+    # (member type, member id) of the logged-in user within the section, or None
+    utype = session.get('user_type')
+    if utype == 'student':
+        if g.auth.scope != (course, year, section):
+            return None
+        student_id = (current_student() or {}).get('id')
+        return ('student', student_id) if student_id else None
+    if utype == 'secondary':
+        if g.auth.scope != (course, year, section):
+            return None
+        return ('teacher', session.get('user_id'))
+    if utype == 'faculty':
+        return ('teacher', 'faculty')
+    return None
+
+
+def viewer_streams(viewer, course, year, section):
+    # Group chats the viewer belongs to and direct threads they are part of
+    member_type, member_id = viewer
+    streams = []
+    for group_id, group in (load_chat(course, year, section).get('groups') or {}).items():
+        if member_id == 'faculty' or any(m.get('type') == member_type and m.get('id') == member_id for m in group.get('members', [])):
+            streams.append(f'chat/{group_id}')
+    load_messages(course, year, section)  # moves legacy threads into logs on first use
+    if member_type == 'student':
+        teachers = ['faculty'] + [a.get('userId') for a in get_secondary_admins(course, year, section) if a.get('userId')]
+        streams += [dm_stream(member_id, t) for t in teachers]
+    else:
+        streams += [dm_stream(s.get('id'), member_id) for s in get_students(course, year, section) if s.get('id')]
+    return streams
+
+
+def describe_stream(stream):
+    kind, name = stream.split('/', 1)
+    if kind == 'chat':
+        return {'type': 'group', 'groupId': name}
+    student_id, teacher_id = name.split('|', 1)
+    return {'type': 'direct', 'studentId': student_id, 'teacherId': teacher_id}
+
+
+def collect_new_messages(course, year, section, cursors, streams=None):
+    # Reads messages past each stream's cursor (all streams, or just `streams`)
+    # and advances the cursors
+    out = []
+    for stream in (cursors if streams is None else [s for s in streams if s in cursors]):
+        if log_count(course, year, section, stream) <= cursors[stream]:
+            continue
+        for msg in log_page(course, year, section, stream, after=cursors[stream], limit=LOG_PAGE_MAX):
+            out.append(dict(describe_stream(stream), stream=stream, message=msg))
+            cursors[stream] = msg['seq']
+    return out
+
+
+def message_event_stream(viewer, course, year, section, only=None):
+    # Generator of SSE frames; runs after the request context is gone
+    q = queue.SimpleQueue()
+    streams = [s for s in viewer_streams(viewer, course, year, section) if not only or s in only]
+    cursors = {s: log_count(course, year, section, s) for s in streams}
+    hub_subscribe(course, year, section, streams, q)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            dirty = hub_wait(q, HUB_HEARTBEAT_SECONDS)
+            if dirty is None:
+                # Heartbeat: pick up membership changes and other processes' appends
+                current = [s for s in viewer_streams(viewer, course, year, section) if not only or s in only]
+                added = [s for s in current if s not in cursors]
+                removed = [s for s in cursors if s not in current]
+                hub_unsubscribe(course, year, section, removed, q)
+                for s in removed:
+                    del cursors[s]
+                for s in added:
+                    cursors[s] = log_count(course, year, section, s)
+                hub_subscribe(course, year, section, added, q)
+                yield ': keep-alive\n\n'
+            for event in collect_new_messages(course, year, section, cursors, dirty):
+                yield f"id: {event['stream']}:{event['message']['seq']}\nevent: message\ndata: {json.dumps(event)}\n\n"
+    finally:
+        hub_unsubscribe(course, year, section, list(cursors), q)
+
+
+def _event_section_args():
+    course = request.args.get('course') or session.get('student_course')
+    year = request.args.get('year') or session.get('student_year')
+    section = request.args.get('section') or session.get('student_section')
+    return course, year, section
+
+
+@app.route('/events/messages')
+def message_events():
+    course, year, section = _event_section_args()
+    if not all([course, year, section]):
+        return jsonify({'error': 'course, year and section are required'}), 400
+    viewer = message_viewer(course, year, section)
+    if viewer is None:
+        return jsonify({'error': 'Unauthorized'}), 401
+    only = set(request.args.getlist('stream')) or None
+    return Response(message_event_stream(viewer, course, year, section, only), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/events/messages/poll')
+def poll_message_events():
+    # Long-poll fallback: pass back the returned cursor to continue from it
+    course, year, section = _event_section_args()
+    if not all([course, year, section]):
+        return jsonify({'error': 'course, year and section are required'}), 400
+    viewer = message_viewer(course, year, section)
+    if viewer is None:
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        given = json.loads(request.args['cursor']) if request.args.get('cursor') else None
+        timeout = min(float(request.args.get('timeout') or 25), HUB_POLL_MAX_SECONDS)
+        if given is not None and not isinstance(given, dict):
+            raise ValueError
+        given = {k: int(v) for k, v in (given or {}).items()} if given is not None else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'cursor must be a JSON object of stream -> seq and timeout a number'}), 400
+    only = set(request.args.getlist('stream')) or None
+    streams = [s for s in viewer_streams(viewer, course, year, section) if not only or s in only]
+    if given is None:
+        # First call: establish the starting point without waiting
+        return jsonify({'messages': [], 'cursor': {s: log_count(course, year, section, s) for s in streams}})
+    cursors = {s: given[s] if s in given else log_count(course, year, section, s) for s in streams}
+    events = collect_new_messages(course, year, section, cursors)
+    if not events and timeout > 0:
+        q = queue.SimpleQueue()
+        hub_subscribe(course, year, section, streams, q)
+        try:
+            events = collect_new_messages(course, year, section, cursors)
+            if not events:
+                hub_wait(q, timeout)
+                events = collect_new_messages(course, year, section, cursors)
+        finally:
+            hub_unsubscribe(course, year, section, streams, q)
+    return jsonify({'messages': events, 'cursor': cursors})
+
+# Content search
+# Notes, group chats and direct messages of a section are searched through an
+# inverted index (word -> entries) held in memory and persisted as the
+# section's content_index.jsonl, an append-only log of {"add": ref, "words",
+# "hit"} and {"del": ref} lines, where ref is 'note/<id>' or '<stream>#<seq>'.
+# Note uploads and deletes and both message sends append to it as they write.
+# Before answering, a query applies lines other processes appended and indexes
+# messages its streams gained some other way (such as history from before the
+# index existed). Hits follow the usual rules: secondary admins see notes of
+# their subjects, and everyone sees only the chats and threads viewer_streams
+# gives them.
+
+CONTENT_INDEX_FILE = 'content_index.jsonl'
+CONTENT_INDEX_MAX_SECTIONS = 64
+CONTENT_SNIPPET_CHARS = 200
+CONTENT_INDEX = OrderedDict()  # (course, year, section) -> in-memory state, least recently used first
+CONTENT_INDEX_LOCK = threading.Lock()
+
+
+def content_index_path(course, year, section):
+    return os.path.join(DATA_DIR, course, year, section, CONTENT_INDEX_FILE)
+
+
+def content_index_lock(course, year, section):
+    return file_lock(os.path.join(DATA_DIR, course, year, section, '.content_index.lock'))
+
+
+def content_words(*texts):
+    return sorted({w for text in texts for w in search_words(text)})
+
+
+def note_content_record(note):
+    f = note.get('file') or {}
+    return {
+        'add': f"note/{note.get('id')}",
+        'words': content_words(note.get('title'), note.get('description'), f.get('filename')),
+        'hit': {
+            'type': 'note',
+            'noteId': note.get('id'),
+            'subject': note.get('subject'),
+            'title': note.get('title'),
+            'description': note.get('description', ''),
+            'file': {'filename': f.get('filename'), 'url': f.get('url')},
+            'uploadedBy': {'name': (note.get('uploadedBy') or {}).get('name')},
+            'ts': note.get('uploadedAt'),
+        },
+    }
+
+
+def message_content_record(stream, msg):
+    atts = [{'filename': a.get('filename'), 'url': a.get('url')} for a in msg.get('attachments') or []]
+    return {
+        'add': f"{stream}#{msg['seq']}",
+        'words': content_words(msg.get('text'), *[a['filename'] for a in atts]),
+        'hit': dict(describe_stream(stream), stream=stream, seq=msg['seq'], messageId=msg.get('id'),
+                    sender=msg.get('from'), text=(msg.get('text') or '')[:CONTENT_SNIPPET_CHARS],
+                    attachments=atts, ts=msg.get('ts')),
+    }
+
+
+def _new_content_state():
+    return {'inode': None, 'offset': 0, 'postings': {}, 'hits': {}, 'cursors': {}}
+
+
+def _apply_content_record(state, rec):
+    ref = rec.get('add') or rec.get('del')
+    old = state['hits'].pop(ref, None)
+    for word in (old[1] if old else ()):
+        refs = state['postings'].get(word)
+        if refs is not None:
+            refs.discard(ref)
+            if not refs:
+                del state['postings'][word]
+    if 'add' not in rec:
+        return
+    words = rec.get('words') or []
+    state['hits'][ref] = (rec.get('hit') or {}, words)
+    for word in words:
+        state['postings'].setdefault(word, set()).add(ref)
+    stream, _, seq = ref.rpartition('#')
+    if stream and seq.isdigit():
+        state['cursors'][stream] = max(state['cursors'].get(stream, 0), int(seq))
+
+
+def _read_content_lines(state, path):
+    # Applies lines appended since the last read, by this or any other process;
+    # the caller holds the content index lock. False when there is no file yet.
+    stamp = _file_stamp(path)
+    if stamp is None:
+        state.update(_new_content_state())
+        return False
+    inode, _, size = stamp
+    if state['inode'] != inode or size < state['offset']:
+        state.update(_new_content_state(), inode=inode)
+    if size > state['offset']:
+        with open(path, 'rb') as f:
+            f.seek(state['offset'])
+            chunk = f.read(size - state['offset'])
+        end = chunk.rfind(b'\n') + 1  # a torn trailing line is skipped
+        for line in chunk[:end].splitlines():
+            try:
+                _apply_content_record(state, json.loads(line))
+            except ValueError:
+                continue
+        state['offset'] += end
+    return True
+
+
+def _append_content_records(state, path, records):
+    # The state is caught up with the file, so anything past its offset is a
+    # torn line from an interrupted append
+    with open(path, 'ab') as f:
+        f.truncate(state['offset'])
+        f.write(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+    _read_content_lines(state, path)
+
+
+def open_content_index(course, year, section):
+    # The section's index, caught up with its file; the first use writes the
+    # file with every current note. The caller holds the content index lock.
+    key = (course, year, section)
+    with CONTENT_INDEX_LOCK:
+        state = CONTENT_INDEX.get(key)
+        if state is None:
+            state = CONTENT_INDEX[key] = _new_content_state()
+        CONTENT_INDEX.move_to_end(key)
+        while len(CONTENT_INDEX) > CONTENT_INDEX_MAX_SECTIONS:
+            CONTENT_INDEX.popitem(last=False)
+    path = content_index_path(course, year, section)
+    if not _read_content_lines(state, path):
+        by = load_notes(course, year, section).get('bySubject') or {}
+        records = [note_content_record(n) for arr in by.values() for n in arr or [] if n.get('id')]
+        _append_content_records(state, path, records)
+    return state
+
+
+def forget_content_index(course, year=None, section=None):
+    prefix = tuple(p for p in (course, year, section) if p is not None)
+    with CONTENT_INDEX_LOCK:
+        for key in [k for k in CONTENT_INDEX if k[:len(prefix)] == prefix]:
+            del CONTENT_INDEX[key]
+
+
+def _index_stream_messages(course, year, section, state, stream, msg=None):
+    # Indexes the stream's messages past the index cursor; msg, when given, is
+    # the one just appended (no need to read it back when it is the next one)
+    cursor = state['cursors'].get(stream, 0)
+    if msg is not None and msg.get('seq') == cursor + 1:
+        new = [msg]
+    else:
+        new = []
+        while True:
+            page = log_page(course, year, section, stream, after=cursor, limit=LOG_PAGE_MAX)
+            if not page:
+                break
+            new.extend(page)
+            cursor = page[-1]['seq']
+    if new:
+        _append_content_records(state, content_index_path(course, year, section),
+                                [message_content_record(stream, m) for m in new])
+
+
+def index_content_note(course, year, section, note):
+    try:
+        with content_index_lock(course, year, section):
+            state = open_content_index(course, year, section)
+            if f"note/{note.get('id')}" not in state['hits']:
+                _append_content_records(state, content_index_path(course, year, section), [note_content_record(note)])
+    except Exception as e:
+        print(f"Warning: failed to index note: {e}")
+
+
+def unindex_content_note(course, year, section, note_id):
+    try:
+        with content_index_lock(course, year, section):
+            state = open_content_index(course, year, section)
+            if f"note/{note_id}" in state['hits']:
+                _append_content_records(state, content_index_path(course, year, section), [{'del': f"note/{note_id}"}])
+    except Exception as e:
+        print(f"Warning: failed to unindex note: {e}")
+
+
+def index_content_message(course, year, section, stream, msg):
+    try:
+        with content_index_lock(course, year, section):
+            state = open_content_index(course, year, section)
+            _index_stream_messages(course, year, section, state, stream, msg)
+    except Exception as e:
+        print(f"Warning: failed to index message: {e}")
+
+
+def search_content(course, year, section, viewer, query, subjects=None, kind=None, offset=0, limit=SEARCH_PAGE_DEFAULT):
+    # Returns (total, page of hits), newest first. Every query word must occur.
+    # subjects: the notes the viewer may see (None: all); kind: 'note',
+    # 'group' or 'direct' to search only those
+    words = search_words(query)
+    if not words:
+        return 0, []
+    limit = max(1, min(int(limit), SEARCH_PAGE_MAX))
+    streams = set(viewer_streams(viewer, course, year, section))  # before the lock: it may migrate legacy threads
+    with content_index_lock(course, year, section):
+        state = open_content_index(course, year, section)
+        for stream in streams:
+            if log_count(course, year, section, stream) > state['cursors'].get(stream, 0):
+                _index_stream_messages(course, year, section, state, stream)
+        posting_sets = sorted((state['postings'].get(w, set()) for w in set(words)), key=len)
+        refs = set(posting_sets[0])
+        for other in posting_sets[1:]:
+            refs &= other
+        hits = []
+        for ref in refs:
+            hit = state['hits'][ref][0]
+            if kind and hit.get('type') != kind:
+                continue
+            if hit.get('type') == 'note':
+                if subjects is not None and hit.get('subject') not in subjects:
+                    continue
+            elif hit.get('stream') not in streams:
+                continue
+            hits.append((hit.get('ts') or '', ref, hit))
+    hits.sort(reverse=True)
+    return len(hits), [hit for _, _, hit in hits[offset:offset + limit]]
+
+
+# Notes, group chats and direct messages of the section matching q, newest
+# first, limited to what the caller may read. Optional: type (note, group or
+# direct), offset, limit.
+@app.route('/search/<course>/<year>/<section>')
+def search_content_api(course, year, section):
+    viewer = message_viewer(course, year, section)
+    if viewer is None or not viewer[1]:
+        return jsonify({'error': 'Unauthorized'}), 401
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    kind = (request.args.get('type') or '').strip() or None
+    if kind not in {None, 'note', 'group', 'direct'}:
+        return jsonify({'error': 'type must be note, group or direct'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset') or 0))
+        limit = int(request.args.get('limit') or SEARCH_PAGE_DEFAULT)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    if not os.path.isdir(os.path.join(DATA_DIR, course, year, section)):
+        return jsonify({'error': 'Section not found'}), 404
+    subjects = g.auth.subjects if session.get('user_type') == 'secondary' else None
+    total, results = search_content(course, year, section, viewer, query, subjects, kind, offset, limit)
+    next_offset = offset + len(results)
+    return jsonify({
+        'total': total,
+        'results': results,
+        'nextOffset': next_offset if next_offset < total else None,
+    })
+
 if __name__ == '__main__':
+    if os.getenv('UPLOAD_MIGRATION', '').lower() != 'off':
+        start_upload_migration()
+    if os.getenv('SCHEMA_MIGRATION', '').lower() != 'off':
+        start_schema_migration()
     app.run(host='0.0.0.0', port=5000, debug=True)
 
 #
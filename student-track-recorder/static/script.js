@@ -6,6 +6,8 @@ class StudentTrackRecorder {
         this.currentYear = null;
         this.currentSection = null;
         this.selectedStudent = null;
+        // Course/year/section tree from /tree, shared by the three selection steps
+        this.tree = null;
         // Student attendance calendar state
         this.studentViewYear = null;
         this.studentViewMonth = null;
@@ -720,9 +722,16 @@ class StudentTrackRecorder {
         await this.renderCourses();
     }
 
+    async loadTree(refresh = false) {
+        if (!this.tree || refresh) {
+            this.tree = await this.apiCall('/tree');
+        }
+        return this.tree;
+    }
+
     async renderCourses() {
         try {
-            const courses = await this.apiCall('/get_courses');
+            const courses = (await this.loadTree(true)).map(c => c.name);
             const container = document.getElementById('coursesList');
             container.innerHTML = '';
 
@@ -799,9 +808,10 @@ class StudentTrackRecorder {
         await this.renderYears();
     }
 
-    async renderYears() {
+    async renderYears(refresh = false) {
         try {
-            const years = await this.apiCall(`/get_years/${encodeURIComponent(this.currentCourse)}`);
+            const course = (await this.loadTree(refresh)).find(c => c.name === this.currentCourse);
+            const years = course ? course.years.map(y => y.name) : [];
             const container = document.getElementById('yearsList');
             container.innerHTML = '';
 
@@ -841,7 +851,7 @@ class StudentTrackRecorder {
             });
             
             if (result.success) {
-                await this.renderYears();
+                await this.renderYears(true);
                 this.closeModal('addYearModal');
                 this.showSuccess('Year added successfully!');
             } else {
@@ -858,7 +868,7 @@ class StudentTrackRecorder {
                 const result = await this.apiCall(`/delete_year/${encodeURIComponent(this.currentCourse)}/${encodeURIComponent(yearName)}`);
 
                 if (result.success) {
-                    await this.renderYears();
+                    await this.renderYears(true);
                     this.showSuccess('Year deleted successfully!');
                 } else {
                     this.showError('Delete Year Error', result.error);
@@ -875,16 +885,19 @@ class StudentTrackRecorder {
         document.getElementById('sectionSelection').classList.add('active');
         document.getElementById('sectionSectionTitle').textContent = `${this.currentCourse} ${this.currentYear} - Select Section`;
         if (!noPush) this._push('facultyDashboard', { step: 'section', course: this.currentCourse, year: this.currentYear });
-        await this.renderSections();
+        // Reloaded here so the section counts reflect edits made since
+        await this.renderSections(true);
     }
 
-    async renderSections() {
+    async renderSections(refresh = false) {
         try {
-            const sections = await this.apiCall(`/get_sections/${encodeURIComponent(this.currentCourse)}/${encodeURIComponent(this.currentYear)}`);
+            const course = (await this.loadTree(refresh)).find(c => c.name === this.currentCourse);
+            const year = course ? course.years.find(y => y.name === this.currentYear) : null;
+            const sections = year ? year.sections : [];
             const container = document.getElementById('sectionsList');
             container.innerHTML = '';
 
-            sections.forEach(section => {
+            sections.forEach(({ name: section, counts }) => {
                 const sectionCard = document.createElement('div');
                 sectionCard.className = 'card';
                 sectionCard.onclick = () => this.selectSection(section);
@@ -894,7 +907,7 @@ class StudentTrackRecorder {
                         <button class="action-btn delete-btn" onclick="event.stopPropagation(); app.deleteSection('${section}')">Delete</button>
                     </div>
                     <h3>${section}</h3>
-                    <p>Click to view students and activities</p>
+                    <p>${counts.students} students · ${counts.teachers} teachers · ${counts.subjects} subjects</p>
                 `;
 
                 container.appendChild(sectionCard);
@@ -920,7 +933,7 @@ class StudentTrackRecorder {
             });
             
             if (result.success) {
-                await this.renderSections();
+                await this.renderSections(true);
                 this.closeModal('addSectionModal');
                 this.showSuccess('Section added successfully!');
             } else {
@@ -937,7 +950,7 @@ class StudentTrackRecorder {
                 const result = await this.apiCall(`/delete_section/${encodeURIComponent(this.currentCourse)}/${encodeURIComponent(this.currentYear)}/${encodeURIComponent(sectionName)}`);
 
                 if (result.success) {
-                    await this.renderSections();
+                    await this.renderSections(true);
                     this.showSuccess('Section deleted successfully!');
                 } else {
                     this.showError('Delete Section Error', result.error);
@@ -1878,7 +1891,7 @@ class StudentTrackRecorder {
             // Create photo HTML - either display uploaded image or initials
             let photoHTML = '';
             if (student.photo) {
-                photoHTML = `<img src="/uploads/${student.photo}" alt="${student.name}" class="student-photo">`;
+                photoHTML = `<img src="/uploads/${student.photo}?w=160" alt="${student.name}" class="student-photo">`;
             } else {
                 photoHTML = `<div class="student-photo" style="width: 80px; height: 80px; background: #667eea; border-radius: 50%; display: flex; align-items: center; justify-content: center; color: white; font-size: 2rem;">
                     ${student.name.charAt(0)}
@@ -2481,6 +2494,7 @@ class StudentTrackRecorder {
 
     closeModal(modalId) {
         document.getElementById(modalId).classList.remove('active');
+        if (modalId === 'chatModal') this.stopChatEvents();
         // Clear form data
         const modal = document.getElementById(modalId);
         const form = modal.querySelector('form');
@@ -2767,7 +2781,7 @@ class StudentTrackRecorder {
             groups.forEach(g => {
                 const div = document.createElement('div');
                 div.className = 'item';
-                const photo = g.photo ? `<img src="/uploads/${g.photo}" style="width:36px;height:36px;border-radius:50%;object-fit:cover;margin-right:8px;">` : '';
+                const photo = g.photo ? `<img src="/uploads/${g.photo}?w=96" style="width:36px;height:36px;border-radius:50%;object-fit:cover;margin-right:8px;">` : '';
                 div.innerHTML = `
                     <div class="item-info" style="display:flex;align-items:center;gap:8px;">
                         ${photo}
@@ -2920,7 +2934,7 @@ class StudentTrackRecorder {
             section: this.currentSection,
             groupId: group.id,
             peerName: group.name,
-            peerPhoto: group.photo ? `/uploads/${group.photo}` : null,
+            peerPhoto: group.photo ? `/uploads/${group.photo}?w=96` : null,
             groupMembers: Array.isArray(group.members) ? group.members : []
         });
         const permBtn = document.getElementById('chatRestrictionBtn');
@@ -2935,23 +2949,45 @@ class StudentTrackRecorder {
         await this.loadGroupMessages();
     }
 
-    async loadGroupMessages() {
+    groupMessagesUrl(query) {
+        const { course, year, section, groupId } = this.chat;
+        return `/groups/messages/${encodeURIComponent(course)}/${encodeURIComponent(year)}/${encodeURIComponent(section)}/${encodeURIComponent(groupId)}?${query}`;
+    }
+
+    async loadGroupMessages(before) {
+        // Loads the latest page, or the page before `before` (a message seq) for "Load earlier"
         const box = document.getElementById('chatMessages');
         if (!this.chat || this.chat.mode !== 'group') { box.innerHTML = '<p class="muted">No group selected.</p>'; return; }
-        box.innerHTML = '<p class="muted">Loading...</p>';
-        try {
-            const { course, year, section, groupId } = this.chat;
-            const msgs = await this.apiCall(`/groups/messages/${encodeURIComponent(course)}/${encodeURIComponent(year)}/${encodeURIComponent(section)}/${encodeURIComponent(groupId)}`);
-            box.innerHTML = '';
-            if (!msgs || !msgs.length) { box.innerHTML = '<p class="muted">No messages yet. Say hello!</p>'; return; }
-            msgs.forEach(m => this.appendGroupMessage(m));
-            box.scrollTop = box.scrollHeight;
+        if (!before) box.innerHTML = '<p class="muted">Loading...</p>';
+        const limit = 50;
+        try {
+            const msgs = await this.apiCall(this.groupMessagesUrl(before ? `limit=${limit}&before=${before}` : `limit=${limit}`));
+            const earlierBtn = document.getElementById('chatLoadEarlier');
+            if (earlierBtn) earlierBtn.remove();
+            if (!before) {
+                box.innerHTML = '';
+                this.chat.lastSeq = msgs && msgs.length ? msgs[msgs.length - 1].seq : 0;
+                this.startChatEvents();
+                if (!msgs || !msgs.length) { box.innerHTML = '<p class="muted">No messages yet. Say hello!</p>'; return; }
+            }
+            const prevHeight = box.scrollHeight;
+            const firstNode = box.firstChild;
+            (msgs || []).forEach(m => this.appendGroupMessage(m, firstNode));
+            if (msgs && msgs.length === limit) {
+                const btn = document.createElement('button');
+                btn.id = 'chatLoadEarlier';
+                btn.className = 'cancel-btn';
+                btn.textContent = 'Load earlier messages';
+                btn.onclick = () => this.loadGroupMessages(msgs[0].seq);
+                box.insertBefore(btn, box.firstChild);
+            }
+            box.scrollTop = before ? box.scrollHeight - prevHeight : box.scrollHeight;
         } catch (e) {
-            box.innerHTML = '<p class="muted">Failed to load group messages.</p>';
+            if (!before) box.innerHTML = '<p class="muted">Failed to load group messages.</p>';
         }
     }
 
-    appendGroupMessage(m) {
+    appendGroupMessage(m, beforeNode) {
         const box = document.getElementById('chatMessages');
         const wrap = document.createElement('div');
         wrap.style.margin = '8px 0';
@@ -2970,7 +3006,8 @@ class StudentTrackRecorder {
         const attHtml = (m.attachments || []).map(a => `<div><a href=\"${a.url}\" target=\"_blank\" style=\"color:inherit;text-decoration:underline;\">${this.escapeHtml(a.filename || 'file')}</a></div>`).join('');
         bubble.innerHTML = `${senderLabel ? `<div class=\\"muted\\" style=\\"font-size:0.8rem; margin-bottom:4px;\\">${senderLabel}</div>` : ''}${textHtml}${attHtml}${time ? `<div class=\\"muted\\" style=\\"font-size:0.8rem; margin-top:4px;\\">${time}</div>` : ''}`;
         wrap.appendChild(bubble);
-        box.appendChild(wrap);
+        if (beforeNode) box.insertBefore(wrap, beforeNode);
+        else box.appendChild(wrap);
     }
 
     getGroupSenderName(from) {
@@ -3040,7 +3077,7 @@ class StudentTrackRecorder {
             studentId: student.id,
             teacherId,
             peerName: student.name,
-            peerPhoto: student.photo ? `/uploads/${student.photo}` : null
+            peerPhoto: student.photo ? `/uploads/${student.photo}?w=96` : null
         });
         this.renderChatHeader();
         this.showModal('chatModal');
@@ -3087,7 +3124,7 @@ class StudentTrackRecorder {
             studentId,
             teacherId: teacher.userId,
             peerName: teacher.name,
-            peerPhoto: teacher.photo ? `/uploads/${teacher.photo}` : null
+            peerPhoto: teacher.photo ? `/uploads/${teacher.photo}?w=96` : null
         });
         this.renderChatHeader();
         this.closeModal('selectTeacherModal');
@@ -3115,7 +3152,7 @@ class StudentTrackRecorder {
             groups.forEach(g => {
                 const div = document.createElement('div');
                 div.className = 'item';
-                const photo = g.photo ? `<img src="/uploads/${g.photo}" style="width:36px;height:36px;border-radius:50%;object-fit:cover;margin-right:8px;">` : '';
+                const photo = g.photo ? `<img src="/uploads/${g.photo}?w=96" style="width:36px;height:36px;border-radius:50%;object-fit:cover;margin-right:8px;">` : '';
                 div.innerHTML = `
                     <div class="item-info" style="display:flex;align-items:center;gap:8px;">
                         ${photo}
@@ -3147,7 +3184,7 @@ class StudentTrackRecorder {
             section: data.section,
             groupId: group.id,
             peerName: group.name,
-            peerPhoto: group.photo ? `/uploads/${group.photo}` : null,
+            peerPhoto: group.photo ? `/uploads/${group.photo}?w=96` : null,
             groupMembers: Array.isArray(group.members) ? group.members : []
         });
         const permBtn = document.getElementById('chatRestrictionBtn');
@@ -3168,23 +3205,82 @@ class StudentTrackRecorder {
         else { imgEl.style.display = 'none'; }
     }
 
-    async loadChatMessages() {
+    chatThreadUrl(query) {
+        const { course, year, section, studentId, teacherId } = this.chat;
+        return `/messages/thread/${encodeURIComponent(course)}/${encodeURIComponent(year)}/${encodeURIComponent(section)}?studentId=${encodeURIComponent(studentId)}&teacherId=${encodeURIComponent(teacherId)}&${query}`;
+    }
+
+    async loadChatMessages(before) {
+        // Loads the latest page, or the page before `before` (a message seq) for "Load earlier"
         const box = document.getElementById('chatMessages');
         if (!this.chat) { box.innerHTML = '<p class="muted">No chat context.</p>'; return; }
-        box.innerHTML = '<p class="muted">Loading...</p>';
-        try {
-            const { course, year, section, studentId, teacherId } = this.chat;
-            const msgs = await this.apiCall(`/messages/thread/${encodeURIComponent(course)}/${encodeURIComponent(year)}/${encodeURIComponent(section)}?studentId=${encodeURIComponent(studentId)}&teacherId=${encodeURIComponent(teacherId)}`);
-            box.innerHTML = '';
-            if (!msgs || !msgs.length) { box.innerHTML = '<p class="muted">No messages yet. Say hello!</p>'; return; }
-            msgs.forEach(m => this.appendChatMessage(m));
-            box.scrollTop = box.scrollHeight;
+        if (!before) box.innerHTML = '<p class="muted">Loading...</p>';
+        const limit = 50;
+        try {
+            const msgs = await this.apiCall(this.chatThreadUrl(before ? `limit=${limit}&before=${before}` : `limit=${limit}`));
+            const earlierBtn = document.getElementById('chatLoadEarlier');
+            if (earlierBtn) earlierBtn.remove();
+            if (!before) {
+                box.innerHTML = '';
+                this.chat.lastSeq = msgs && msgs.length ? msgs[msgs.length - 1].seq : 0;
+                this.startChatEvents();
+                if (!msgs || !msgs.length) { box.innerHTML = '<p class="muted">No messages yet. Say hello!</p>'; return; }
+            }
+            const prevHeight = box.scrollHeight;
+            const firstNode = box.firstChild;
+            (msgs || []).forEach(m => this.appendChatMessage(m, firstNode));
+            if (msgs && msgs.length === limit) {
+                const btn = document.createElement('button');
+                btn.id = 'chatLoadEarlier';
+                btn.className = 'cancel-btn';
+                btn.textContent = 'Load earlier messages';
+                btn.onclick = () => this.loadChatMessages(msgs[0].seq);
+                box.insertBefore(btn, box.firstChild);
+            }
+            box.scrollTop = before ? box.scrollHeight - prevHeight : box.scrollHeight;
         } catch (e) {
-            box.innerHTML = '<p class="muted">Failed to load messages.</p>';
+            if (!before) box.innerHTML = '<p class="muted">Failed to load messages.</p>';
+        }
+    }
+
+    syncChatMessages() {
+        // Appends only the messages newer than the last one shown; calls run one at a time
+        this.chatSync = (this.chatSync || Promise.resolve()).then(() => this.fetchNewChatMessages()).catch(() => {});
+        return this.chatSync;
+    }
+
+    async fetchNewChatMessages() {
+        const chat = this.chat;
+        if (!chat) return;
+        const isGroup = chat.mode === 'group';
+        const query = `since=${chat.lastSeq || 0}&limit=200`;
+        const msgs = await this.apiCall(isGroup ? this.groupMessagesUrl(query) : this.chatThreadUrl(query));
+        if (this.chat !== chat || !msgs || !msgs.length) return;
+        const box = document.getElementById('chatMessages');
+        if (!chat.lastSeq) box.innerHTML = '';
+        msgs.forEach(m => isGroup ? this.appendGroupMessage(m) : this.appendChatMessage(m));
+        chat.lastSeq = msgs[msgs.length - 1].seq;
+        box.scrollTop = box.scrollHeight;
+    }
+
+    startChatEvents() {
+        // Server-Sent Events for the open chat; each event triggers a sync
+        this.stopChatEvents();
+        if (!this.chat || typeof EventSource === 'undefined') return;
+        const { course, year, section } = this.chat;
+        const stream = this.chat.mode === 'group' ? `chat/${this.chat.groupId}` : `dm/${this.chat.studentId}|${this.chat.teacherId}`;
+        this.chatEvents = new EventSource(`/events/messages?course=${encodeURIComponent(course)}&year=${encodeURIComponent(year)}&section=${encodeURIComponent(section)}&stream=${encodeURIComponent(stream)}`);
+        this.chatEvents.addEventListener('message', () => this.syncChatMessages());
+    }
+
+    stopChatEvents() {
+        if (this.chatEvents) {
+            this.chatEvents.close();
+            this.chatEvents = null;
         }
     }
 
-    appendChatMessage(m) {
+    appendChatMessage(m, beforeNode) {
         const box = document.getElementById('chatMessages');
         const wrap = document.createElement('div');
         wrap.style.margin = '8px 0';
@@ -3202,7 +3298,8 @@ class StudentTrackRecorder {
         const attHtml = (m.attachments || []).map(a => `<div><a href="${a.url}" target="_blank" style="color:inherit;text-decoration:underline;">${this.escapeHtml(a.filename || 'file')}</a></div>`).join('');
         bubble.innerHTML = `${textHtml}${attHtml}${time ? `<div class=\"muted\" style=\"font-size:0.8rem; margin-top:4px;\">${time}</div>` : ''}`;
         wrap.appendChild(bubble);
-        box.appendChild(wrap);
+        if (beforeNode) box.insertBefore(wrap, beforeNode);
+        else box.appendChild(wrap);
     }
 
     escapeHtml(s) { return String(s || '').replace(/[&<>\"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;','\'':'&#39;'}[c])); }
@@ -3233,10 +3330,7 @@ class StudentTrackRecorder {
                 });
             }
             if (res && res.success && res.message) {
-                if (this.chat.mode === 'group') this.appendGroupMessage(res.message);
-                else this.appendChatMessage(res.message);
-                const box = document.getElementById('chatMessages');
-                box.scrollTop = box.scrollHeight;
+                await this.syncChatMessages();
                 textEl.value = ''; filesEl.value = '';
             }
         } catch (e) {}
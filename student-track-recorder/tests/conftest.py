@@ -0,0 +1,48 @@
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# The app reads its storage locations at import: point them at a scratch tree
+ROOT = tempfile.mkdtemp(prefix='student-track-tests-')
+os.environ['DATA_DIR'] = os.path.join(ROOT, 'data')
+os.environ['UPLOAD_FOLDER'] = os.path.join(ROOT, 'uploads')
+os.environ['TOKEN_DB_PATH'] = os.path.join(ROOT, 'tokens.sqlite3')
+os.environ['STORAGE_BACKEND'] = 'json'
+os.environ['UPLOAD_MIGRATION'] = 'off'
+os.environ['SCHEMA_MIGRATION'] = 'off'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+COURSE = 'B.Tech'
+YEAR = '1st Year'
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(ROOT, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture
+def admin():
+    client = app_module.app.test_client()
+    r = client.post('/faculty_login', json={'accountType': 'main', 'userId': 'faculty', 'password': '1'})
+    assert r.get_json()['success']
+    return client
+
+
+@pytest.fixture
+def section(admin):
+    # A fresh, empty section for each test
+    name = 'S' + uuid.uuid4().hex[:8]
+    r = admin.post(f'/add_section/{COURSE}/{YEAR}', json={'name': name})
+    assert r.get_json()['success']
+    return COURSE, YEAR, name
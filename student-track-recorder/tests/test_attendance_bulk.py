@@ -0,0 +1,38 @@
+import json
+
+
+def add_student(admin, course, year, name, roll):
+    r = admin.post(f'/add_student/{course}/{year}/{name}', data={'name': roll, 'rollNumber': roll, 'email': f'{roll}@x'})
+    return r.get_json()['studentId']
+
+
+def test_batch_without_valid_entries_changes_nothing(app, admin, section):
+    course, year, name = section
+    r = admin.post(f'/attendance/records/{course}/{year}/{name}/bulk', json={
+        'subject': 'Chem', 'date': '2026-03-02', 'entries': [{'studentId': 'nobody'}, {}]})
+    body = r.get_json()
+    assert r.status_code == 400
+    assert body['success'] is False
+    assert [e['error'] for e in body['results']] == ['Student not found', 'studentId is required']
+    assert 'Chem' not in admin.get(f'/attendance/subjects/{course}/{year}/{name}').get_json()
+    with open(app.get_attendance_path(*section)) as f:
+        assert 'Chem' not in json.load(f)['subjects']
+
+
+def test_batch_applies_valid_entries_and_reports_the_rest(app, admin, section):
+    course, year, name = section
+    first = add_student(admin, course, year, name, 'R1')
+    second = add_student(admin, course, year, name, 'R2')
+    r = admin.post(f'/attendance/records/{course}/{year}/{name}/bulk', json={
+        'subject': 'Chem', 'date': '2026-03-02', 'entries': [
+            {'studentId': first, 'status': 'present', 'count': 2},
+            {'studentId': 'nobody'},
+            {'studentId': second, 'status': 'absent', 'count': 'x'}]})
+    body = r.get_json()
+    assert body['success'] is True
+    assert [e['success'] for e in body['results']] == [True, False, False]
+    assert body['results'][0]['present'] == {'2026-03-02': 2}
+    with open(app.get_attendance_path(*section)) as f:
+        saved = json.load(f)
+    assert 'Chem' in saved['subjects']
+    assert second not in saved['records']['Chem']
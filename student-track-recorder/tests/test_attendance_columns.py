@@ -0,0 +1,57 @@
+import os
+
+
+def mark(admin, section, student_id, subject, day, status, count):
+    course, year, name = section
+    r = admin.post(f'/attendance/records/{course}/{year}/{name}', json={
+        'subject': subject, 'studentId': student_id, 'dates': [day],
+        'status': status, 'op': 'set', 'count': count})
+    assert r.get_json()['success']
+
+
+def add_student(admin, section, roll):
+    course, year, name = section
+    r = admin.post(f'/add_student/{course}/{year}/{name}', data={
+        'name': roll, 'rollNumber': roll, 'email': f'{roll}@x', 'secretPassword': 'pw'})
+    return r.get_json()['studentId']
+
+
+def without_columns(app, monkeypatch, fetch):
+    with monkeypatch.context() as m:
+        m.setattr(app, 'load_attendance_columns', lambda *a, **k: None)
+        return fetch()
+
+
+def test_matrix_is_served_from_the_snapshot(app, admin, section, monkeypatch):
+    course, year, name = section
+    first, second = add_student(admin, section, 'C1'), add_student(admin, section, 'C2')
+    mark(admin, section, first, 'Math', '2026-03-02', 'present', 2)
+    mark(admin, section, second, 'Math', '2026-03-04', 'absent', 1)
+    mark(admin, section, first, 'Physics', '2026-03-03', 'present', 1)
+    url = f'/attendance/matrix/{course}/{year}/{name}'
+    for query in ('', '?subject=Math', '?from=2026-03-03', '?to=2026-03-02'):
+        served = admin.get(url + query).get_json()
+        assert served == without_columns(app, monkeypatch, lambda: admin.get(url + query).get_json())
+    assert os.path.exists(os.path.join(app.DATA_DIR, course, year, name, app.ATT_COLUMNS_FILE))
+    # A later write replaces the snapshot on the next read
+    mark(admin, section, second, 'Math', '2026-03-05', 'present', 3)
+    matrix = admin.get(url).get_json()
+    assert matrix['dates'][-1] == '2026-03-05'
+    assert matrix == without_columns(app, monkeypatch, lambda: admin.get(url).get_json())
+
+
+def test_student_records_are_served_from_the_snapshot(app, admin, section, monkeypatch):
+    student_id = add_student(admin, section, 'C3')
+    mark(admin, section, student_id, 'Math', '2026-03-02', 'present', 2)
+    mark(admin, section, student_id, 'Math', '2026-03-03', 'absent', 1)
+    client = app.app.test_client()
+    assert client.post('/student_login', json={'rollNumber': 'C3', 'email': 'C3@x', 'password': 'pw'}).get_json()['success']
+    calls = []
+    load = app.load_attendance_columns
+    monkeypatch.setattr(app, 'load_attendance_columns', lambda *a: calls.append(a) or load(*a))
+    for query in ('?subject=Math&detailed=1', '?subject=Math', '?subject=Physics&detailed=1'):
+        served = client.get('/student_attendance_records' + query).get_json()
+        assert served == without_columns(app, monkeypatch, lambda: client.get('/student_attendance_records' + query).get_json())
+    assert calls
+    assert client.get('/student_attendance_records?subject=Math&detailed=1').get_json() == {
+        'present': {'2026-03-02': 2}, 'absent': {'2026-03-03': 1}}
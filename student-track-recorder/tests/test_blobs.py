@@ -0,0 +1,53 @@
+import hashlib
+import io
+import os
+
+
+def post_note(admin, course, year, name, content, filename):
+    r = admin.post(f'/notes/{course}/{year}/{name}', data={
+        'subject': 'Math', 'title': filename, 'file': (io.BytesIO(content), filename)})
+    return r.get_json()['note']
+
+
+def test_identical_uploads_share_one_blob(app, admin, section):
+    course, year, name = section
+    content = os.urandom(64 * 1024)
+    stored = hashlib.sha256(content).hexdigest() + '.pdf'
+    notes = [post_note(admin, course, year, name, content, f) for f in ('a.pdf', 'b.PDF', 'c.pdf')]
+    assert {n['file']['storedFilename'] for n in notes} == {stored}
+    assert [n['file']['filename'] for n in notes] == ['a.pdf', 'b.PDF', 'c.pdf']
+    assert app.get_blob_refs(stored) == 3
+    assert admin.get(f'/uploads/{stored}').data == content
+
+
+def test_blob_is_removed_with_its_last_reference(app, admin, section):
+    course, year, name = section
+    content = os.urandom(64 * 1024)
+    stored = hashlib.sha256(content).hexdigest() + '.pdf'
+    notes = [post_note(admin, course, year, name, content, f) for f in ('a.pdf', 'b.pdf')]
+    path = app.resolve_upload(stored)
+
+    assert admin.delete(f"/notes/{course}/{year}/{name}/{notes[0]['id']}").get_json()['success']
+    assert app.get_blob_refs(stored) == 1
+    assert os.path.exists(path)
+
+    assert admin.delete(f"/notes/{course}/{year}/{name}/{notes[1]['id']}").get_json()['success']
+    assert app.get_blob_refs(stored) is None
+    assert not os.path.exists(path)
+
+
+def test_file_without_refcount_is_released(app):
+    # Uploads stored before refcounting have no count: the first release deletes them
+    path = os.path.join(app.UPLOAD_FOLDER, 'legacy_note.pdf')
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    app.release_upload('legacy_note.pdf')
+    assert not os.path.exists(path)
+
+
+def test_refcounts_are_not_listed_as_a_course(app, admin, section):
+    course, year, name = section
+    post_note(admin, course, year, name, os.urandom(1024), 'a.pdf')
+    assert os.path.isdir(app.BLOB_REFS_DIR)
+    assert os.path.basename(app.BLOB_REFS_DIR) not in app.get_courses()
+    assert app.get_courses() == [course]
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+
+def login(app, path, **payload):
+    client = app.app.test_client()
+    assert client.post(path, json=payload).get_json()['success']
+    return client
+
+
+@pytest.fixture
+def content(app, admin, section):
+    # Notes, group chats and direct threads of one section that all mention a
+    # word unique to this test, and clients for the people who can read them
+    course, year, name = section
+    tag = 'w' + name.lower()
+    base = f'{course}/{year}/{name}'
+    ids = []
+    for roll in ('K1', 'K2'):
+        r = admin.post(f'/add_student/{base}', data={
+            'name': roll, 'rollNumber': roll, 'email': f'{roll}{name}@x', 'secretPassword': 'pw'})
+        ids.append(r.get_json()['studentId'])
+    prof_id = f'prof-{name}'
+    admin.post(f'/add_secondary_admin/{base}', data={'name': 'P', 'userId': prof_id, 'password': 'pp', 'subjects': 'Math'})
+    notes = {}
+    for subject in ('Math', 'Physics'):
+        r = admin.post(f'/notes/{base}', data={
+            'subject': subject, 'title': f'{subject} {tag}', 'file': (io.BytesIO(b'notes'), 'n.txt')})
+        notes[subject] = r.get_json()['note']['id']
+    for members in ([f'student:{ids[0]}'], [f'student:{ids[1]}']):
+        group = admin.post(f'/groups/{base}/custom', json={'name': 'G', 'members': members}).get_json()['group']
+        admin.post(f"/groups/messages/{base}/{group['id']}", json={'text': f'group {tag}'})
+    for student_id in ids:
+        admin.post(f'/messages/send/{base}', json={'studentId': student_id, 'teacherId': 'faculty', 'text': f'dm {tag}'})
+    prof = login(app, '/faculty_login', accountType='secondary', userId=prof_id, password='pp')
+    prof.post(f'/messages/send/{base}', json={'studentId': ids[0], 'teacherId': prof_id, 'text': f'prof {tag}'})
+    student = login(app, '/student_login', rollNumber='K1', email=f'K1{name}@x', password='pw')
+    return {'tag': tag, 'base': base, 'ids': ids, 'prof': prof, 'prof_id': prof_id, 'student': student, 'notes': notes}
+
+
+def search(client, content, q=None, **params):
+    r = client.get(f"/search/{content['base']}", query_string=dict(params, q=q or content['tag']))
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def kinds(result):
+    return sorted(hit['type'] for hit in result['results'])
+
+
+def test_main_admin_sees_all_notes_groups_and_own_threads(admin, content):
+    result = search(admin, content)
+    assert result['total'] == 6
+    assert kinds(result) == ['direct', 'direct', 'group', 'group', 'note', 'note']
+    # A secondary admin's thread with a student stays between them
+    assert search(admin, content, f"prof {content['tag']}")['total'] == 0
+
+
+def test_secondary_admin_sees_their_subjects_and_threads(content):
+    result = search(content['prof'], content)
+    assert kinds(result) == ['direct', 'note']
+    by_type = {hit['type']: hit for hit in result['results']}
+    assert by_type['note']['subject'] == 'Math'
+    assert by_type['direct']['teacherId'] == content['prof_id']
+
+
+def test_student_sees_their_groups_and_threads(content):
+    result = search(content['student'], content)
+    assert kinds(result) == ['direct', 'direct', 'group', 'note', 'note']
+    assert {hit['studentId'] for hit in result['results'] if hit['type'] == 'direct'} == {content['ids'][0]}
+    assert kinds(search(content['student'], content, type='direct')) == ['direct', 'direct']
+
+
+def test_other_sections_are_refused(app, admin, content):
+    course, year, _ = content['base'].split('/')
+    admin.post(f'/add_section/{course}/{year}', json={'name': 'X' + content['tag']})
+    r = content['student'].get(f"/search/{course}/{year}/X{content['tag']}", query_string={'q': content['tag']})
+    assert r.status_code == 401
+    r = app.app.test_client().get(f"/search/{content['base']}", query_string={'q': content['tag']})
+    assert r.status_code == 401
+
+
+def test_deleted_note_drops_out(admin, content):
+    admin.delete(f"/notes/{content['base']}/{content['notes']['Physics']}")
+    assert kinds(search(admin, content, type='note')) == ['note']
+    assert search(admin, content, f"physics {content['tag']}")['total'] == 0
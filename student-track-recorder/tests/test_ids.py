@@ -0,0 +1,35 @@
+def add_student(admin, course, year, name, roll):
+    r = admin.post(f'/add_student/{course}/{year}/{name}', data={'name': roll, 'rollNumber': roll, 'email': f'{roll}@x'})
+    return r.get_json()['studentId']
+
+
+def test_deleted_student_id_is_not_reused(admin, section):
+    course, year, name = section
+    assert [add_student(admin, course, year, name, r) for r in ('R1', 'R2')] == ['student_001', 'student_002']
+    assert admin.delete(f'/delete_student/{course}/{year}/{name}/student_002').get_json()['success']
+    assert add_student(admin, course, year, name, 'R3') == 'student_003'
+
+
+def test_deleted_activity_id_is_not_reused(admin, section):
+    course, year, name = section
+    ids = [admin.post(f'/add_activity/{course}/{year}/{name}', json={'name': n}).get_json()['activityId'] for n in 'AB']
+    assert ids == ['activity_001', 'activity_002']
+    assert admin.delete(f'/delete_activity/{course}/{year}/{name}/activity_002').get_json()['success']
+    r = admin.post(f'/add_activity/{course}/{year}/{name}', json={'name': 'C'})
+    assert r.get_json()['activityId'] == 'activity_003'
+
+
+def test_counter_starts_past_existing_ids(app, admin, section):
+    # Sections written before the counters existed have no sequences yet
+    with app.section_lock(*section):
+        app.save_students(*section, [{'id': 'student_007', 'name': 'Old'}])
+    assert add_student(admin, *section, 'R8') == 'student_008'
+
+
+def test_rejected_secondary_admin_does_not_use_an_id(admin, section):
+    course, year, name = section
+    url = f'/add_secondary_admin/{course}/{year}/{name}'
+    for _ in range(3):
+        assert admin.post(url, data={'name': 'P', 'userId': 'p', 'password': 'x'}).status_code == 400
+    r = admin.post(url, data={'name': 'P', 'userId': 'p', 'password': 'x', 'subjects': 'Math'})
+    assert r.get_json()['professorId'] == 'professor_001'
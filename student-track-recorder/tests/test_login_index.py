@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def two_sections(admin, section):
+    # The same roll number/email and userId in two sections, with different passwords
+    course, year, name = section
+    other = 'S2' + name
+    assert admin.post(f'/add_section/{course}/{year}', json={'name': other}).get_json()['success']
+    sections = [section, (course, year, other)]
+    for (course, year, name), password in zip(sections, ('alpha', 'beta')):
+        admin.post(f'/add_student/{course}/{year}/{name}', data={
+            'name': 'Dup', 'rollNumber': 'D1', 'email': f'{section[2]}@x', 'secretPassword': password})
+        admin.post(f'/add_secondary_admin/{course}/{year}/{name}', data={
+            'name': 'P', 'userId': f'prof-{section[2]}', 'password': password, 'subjects': 'Math'})
+    return sections
+
+
+def test_password_selects_among_duplicate_students(app, two_sections):
+    email = f'{two_sections[0][2]}@x'
+    for (course, year, name), password in zip(two_sections, ('alpha', 'beta')):
+        client = app.app.test_client()
+        r = client.post('/student_login', json={'rollNumber': 'D1', 'email': email, 'password': password})
+        assert r.get_json()['success']
+        with client.session_transaction() as s:
+            assert s['student_section'] == name
+    r = app.app.test_client().post('/student_login', json={'rollNumber': 'D1', 'email': email, 'password': 'nope'})
+    assert not r.get_json()['success']
+
+
+def test_password_selects_among_duplicate_secondary_admins(app, two_sections):
+    user_id = f'prof-{two_sections[0][2]}'
+    for (course, year, name), password in zip(two_sections, ('alpha', 'beta')):
+        client = app.app.test_client()
+        r = client.post('/faculty_login', json={'accountType': 'secondary', 'userId': user_id, 'password': password})
+        assert r.get_json()['success']
+        with client.session_transaction() as s:
+            assert s['secondary_admin']['section'] == name
+
+
+def test_deleting_a_section_keeps_the_other_candidate(app, admin, two_sections):
+    course, year, name = two_sections[1]
+    admin.get(f'/delete_section/{course}/{year}/{name}')
+    email = f'{two_sections[0][2]}@x'
+    assert [f[2] for f in app.find_students_by_login('D1', email)] == [two_sections[0][2]]
+
+
+def test_old_index_format_is_rebuilt(app, two_sections):
+    email = f'{two_sections[0][2]}@x'
+    with open(app.get_login_index_path(), 'w') as f:
+        json.dump({'students': {}, 'secondary': {}}, f)
+    assert len(app.find_students_by_login('D1', email)) == 2
+    assert app.load_login_index()['version'] == app.LOGIN_INDEX_VERSION
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def pupil(app, admin, section):
+    # A student of the section and a test client logged in as them
+    course, year, name = section
+    r = admin.post(f'/add_student/{course}/{year}/{name}', data={
+        'name': 'P', 'rollNumber': 'P1', 'email': f'{name}@x', 'secretPassword': 'pw'})
+    client = app.app.test_client()
+    assert client.post('/student_login', json={'rollNumber': 'P1', 'email': f'{name}@x', 'password': 'pw'}).get_json()['success']
+    return r.get_json()['studentId'], client
+
+
+def send(client, section, student_id, text):
+    course, year, name = section
+    r = client.post(f'/messages/send/{course}/{year}/{name}', json={
+        'studentId': student_id, 'teacherId': 'faculty', 'text': text})
+    assert r.get_json()['success']
+
+
+def poll(client, section, cursor=None, timeout=0):
+    course, year, name = section
+    query = {'course': course, 'year': year, 'section': name, 'timeout': timeout}
+    if cursor is not None:
+        query['cursor'] = json.dumps(cursor)
+    r = client.get('/events/messages/poll', query_string=query)
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def test_poll_delivers_messages_past_the_cursor(app, admin, section, pupil):
+    student_id, student = pupil
+    stream = app.dm_stream(student_id, 'faculty')
+    send(admin, section, student_id, 'before')
+    first = poll(student, section)
+    assert first == {'messages': [], 'cursor': {stream: 1}}
+    send(admin, section, student_id, 'one')
+    send(admin, section, student_id, 'two')
+    got = poll(student, section, first['cursor'])
+    assert [e['message']['text'] for e in got['messages']] == ['one', 'two']
+    assert got['messages'][0]['type'] == 'direct' and got['messages'][0]['studentId'] == student_id
+    assert got['cursor'] == {stream: 3}
+    assert poll(student, section, got['cursor']) == {'messages': [], 'cursor': {stream: 3}}
+    # An older cursor replays from where it points
+    assert [e['message']['seq'] for e in poll(student, section, {stream: 2})['messages']] == [3]
+
+
+def test_long_poll_wakes_on_send(app, admin, section, pupil):
+    student_id, student = pupil
+    cursor = poll(student, section)['cursor']
+    sender = threading.Timer(0.2, send, (admin, section, student_id, 'late'))
+    sender.start()
+    started = time.monotonic()
+    got = poll(student, section, cursor, timeout=10)
+    sender.join()
+    assert [e['message']['text'] for e in got['messages']] == ['late']
+    assert time.monotonic() - started < 5
+    assert app.HUB_SUBSCRIBERS == {}
+
+
+def test_poll_is_scoped_to_the_viewer(app, admin, section, pupil):
+    course, year, name = section
+    student_id, student = pupil
+    other = admin.post(f'/add_student/{course}/{year}/{name}', data={
+        'name': 'Q', 'rollNumber': 'Q1', 'email': f'q{name}@x'}).get_json()['studentId']
+    assert set(poll(student, section)['cursor']) == {app.dm_stream(student_id, 'faculty')}
+    assert set(poll(admin, section)['cursor']) >= {app.dm_stream(student_id, 'faculty'), app.dm_stream(other, 'faculty')}
+    r = student.get('/events/messages/poll', query_string={'course': course, 'year': year, 'section': 'elsewhere'})
+    assert r.status_code == 401
+    r = student.get('/events/messages/poll', query_string={'cursor': '[1]'})
+    assert r.status_code == 400
+
+
+def test_event_stream_sends_new_messages(app, admin, section, pupil):
+    course, year, name = section
+    student_id, student = pupil
+    r = student.get('/events/messages', query_string={'course': course, 'year': year, 'section': name})
+    assert r.mimetype == 'text/event-stream'
+    frames = (chunk.decode() for chunk in r.response)
+    assert next(frames) == 'retry: 3000\n\n'
+    send(admin, section, student_id, 'live')
+    frame = next(frames)
+    stream = app.dm_stream(student_id, 'faculty')
+    assert frame.startswith(f'id: {stream}:1\nevent: message\ndata: ')
+    assert json.loads(frame.split('data: ', 1)[1])['message']['text'] == 'live'
+    r.close()
+    assert app.HUB_SUBSCRIBERS == {}
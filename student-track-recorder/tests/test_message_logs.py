@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def stream(app, section, monkeypatch):
+    # 25 messages over segments of 10, so pages cross segment files
+    monkeypatch.setattr(app, 'LOG_SEGMENT_SIZE', 10)
+    for i in range(1, 26):
+        assert app.log_append(*section, 'chat/g1', {'text': f'm{i}'}) == i
+    return 'chat/g1'
+
+
+def seqs(page):
+    return [m['seq'] for m in page]
+
+
+def test_latest_page_by_default(app, section, stream):
+    page = app.log_page(*section, stream, limit=4)
+    assert seqs(page) == [22, 23, 24, 25]
+    assert [m['text'] for m in page] == ['m22', 'm23', 'm24', 'm25']
+
+
+def test_before_walks_back_across_segments(app, section, stream):
+    assert seqs(app.log_page(*section, stream, before=13, limit=5)) == [8, 9, 10, 11, 12]
+    assert seqs(app.log_page(*section, stream, before=3, limit=5)) == [1, 2]
+    assert app.log_page(*section, stream, before=1) == []
+
+
+def test_after_walks_forward_across_segments(app, section, stream):
+    assert seqs(app.log_page(*section, stream, after=8, limit=4)) == [9, 10, 11, 12]
+    assert seqs(app.log_page(*section, stream, after=23, limit=4)) == [24, 25]
+    assert app.log_page(*section, stream, after=25) == []
+
+
+def test_limit_is_clamped(app, section, stream, monkeypatch):
+    monkeypatch.setattr(app, 'LOG_PAGE_MAX', 6)
+    assert len(app.log_page(*section, stream, limit=1000)) == 6
+    assert seqs(app.log_page(*section, stream, limit=0)) == [25]
+
+
+def test_torn_index_entry_is_ignored(app, section, stream):
+    index = os.path.join(app.get_log_dir(*section, stream), 'index')
+    with open(index, 'ab') as f:
+        f.write(b'\x01\x02\x03')
+    assert app.log_count(*section, stream) == 25
+    assert app.log_append(*section, stream, {'text': 'm26'}) == 26
+    assert [m['text'] for m in app.log_page(*section, stream, limit=2)] == ['m25', 'm26']
+
+
+def test_group_messages_route_pages_legacy_chat(app, admin, section):
+    course, year, name = section
+    with app.section_lock(*section):
+        app.save_chat(*section, {
+            'groups': {'g1': {'id': 'g1', 'name': 'G', 'members': [], 'permissions': {'whoCanChat': 'all'}}},
+            'messages': {'g1': [{'id': f'm{i}', 'text': str(i)} for i in range(1, 121)]}})
+    assert 'messages' not in app.load_chat(*section)
+    url = f'/groups/messages/{course}/{year}/{name}/g1'
+    latest = admin.get(url).get_json()
+    assert len(latest) == app.LOG_PAGE_DEFAULT
+    assert latest[-1]['seq'] == 120 and latest[-1]['text'] == '120'
+    older = admin.get(url + f"?before={latest[0]['seq']}&limit=3").get_json()
+    assert [(m['seq'], m['text']) for m in older] == [(68, '68'), (69, '69'), (70, '70')]
+    newer = admin.get(url + '?after=118').get_json()
+    assert seqs(newer) == [119, 120]
+    assert admin.get(url + '?limit=x').status_code == 400
@@ -0,0 +1,53 @@
+import csv
+import io
+
+
+def mark(admin, section, student_id, subject, present, absent):
+    course, year, name = section
+    for status, count in (('present', present), ('absent', absent)):
+        if count:
+            admin.post(f'/attendance/records/{course}/{year}/{name}', json={
+                'subject': subject, 'studentId': student_id, 'dates': ['2026-03-02'],
+                'status': status, 'op': 'set', 'count': count})
+
+
+def defaulter_section(admin, section):
+    course, year, name = section
+    ids = []
+    for roll in ('R1', 'R2'):
+        r = admin.post(f'/add_student/{course}/{year}/{name}', data={'name': roll, 'rollNumber': roll, 'email': f'{roll}@x'})
+        ids.append(r.get_json()['studentId'])
+    mark(admin, section, ids[0], 'Math', 1, 3)  # 25%
+    mark(admin, section, ids[1], 'Math', 4, 0)  # 100%
+    return ids
+
+
+def test_defaulters_report(app, admin, section):
+    low, _ = defaulter_section(admin, section)
+    r = admin.get(f'/reports/defaulters?format=json&course={section[0]}')
+    assert r.status_code == 200
+    rows = [row for row in r.get_json() if row['section'] == section[2]]
+    assert rows == [{'course': section[0], 'year': section[1], 'section': section[2], 'studentId': low,
+                     'rollNumber': 'R1', 'name': 'R1', 'subject': 'Math', 'present': 1, 'absent': 3,
+                     'percentage': 25.0}]
+    r = admin.get('/reports/defaulters?threshold=20')
+    assert r.mimetype == 'text/csv'
+    lines = list(csv.reader(io.StringIO(r.data.decode())))
+    assert lines[0] == app.REPORT_COLUMNS
+    assert not [line for line in lines[1:] if line[2] == section[2]]
+
+
+def test_fallback_matches_numpy(app, admin, section, monkeypatch):
+    defaulter_section(admin, section)
+    expected = app.compute_defaulters(75)
+    monkeypatch.setattr(app, 'np', None)
+    assert sorted(app.compute_defaulters(75), key=repr) == sorted(expected, key=repr)
+
+
+def test_failure_is_an_error_not_a_truncated_report(app, admin, section, monkeypatch):
+    def fail(jobs, workers=1):
+        raise OSError('unreadable section')
+
+    monkeypatch.setattr(app, 'load_report_sections', fail)
+    monkeypatch.setitem(app.app.config, 'PROPAGATE_EXCEPTIONS', False)
+    assert admin.get('/reports/defaulters').status_code == 500
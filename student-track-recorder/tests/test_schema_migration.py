@@ -0,0 +1,66 @@
+import pytest
+
+LEGACY_DOCS = {
+    'students': [{'id': 'student_001', 'name': 'Old', 'rollNumber': 'L1', 'email': 'l@x', 'secretPassword': 'plain1'}],
+    'secondary_admin': [{'id': 'professor_001', 'userId': 'oldprof', 'password': 'pp', 'subjects': ['Math']}],
+    'attendance': {'subjects': ['Math'], 'records': {'Math': {
+        'student_001': ['2026-01-05T09:00', '2026-01-05T10:00', '2026-01-06'],
+        'student_002': {'present': {'2026-01-07': '2'}, 'absent': {}}}}},
+    'notes': {'bySubject': {'Math': [{'id': 'n1', 'title': 't', 'file': {'filename': 'a.pdf', 'url': '/uploads/legacynote.pdf'}}]}},
+    'certificates': {'byStudent': {'student_001': [{'id': 'c1', 'url': '/uploads/legacycert.pdf'}]}},
+}
+
+
+@pytest.fixture
+def legacy_section(app, section):
+    # A section as written before schema versions existed
+    with app.section_lock(*section):
+        for kind, doc in LEGACY_DOCS.items():
+            app.write_section_doc(*section, kind, doc)
+        app.save_schema_version(*section, 0)
+    return section
+
+
+def snapshot(app, section):
+    return {kind: app.read_section_uncached(*section, kind, None) for kind in app.SECTION_FILES}
+
+
+def test_migrating_twice_changes_nothing_more(app, legacy_section):
+    assert app.migrate_section_schema(*legacy_section) == app.SCHEMA_VERSION
+    first = snapshot(app, legacy_section)
+    assert app.migrate_section_schema(*legacy_section) == 0
+    assert app.migrate_all_sections() == (0, 0)
+    assert snapshot(app, legacy_section) == first
+
+
+def test_resumed_migration_matches_a_full_run(app, legacy_section):
+    app.migrate_section_schema(*legacy_section)
+    full = snapshot(app, legacy_section)
+    # An interrupted run leaves an intermediate version: the remaining steps rerun
+    app.save_schema_version(*legacy_section, 1)
+    assert app.migrate_section_schema(*legacy_section) == app.SCHEMA_VERSION - 1
+    assert snapshot(app, legacy_section) == full
+
+
+def test_migrated_section_keeps_its_data(app, legacy_section):
+    att = app.load_attendance(*legacy_section)
+    before = {sid: app.get_att_rec_entry(att, 'Math', sid) for sid in ('student_001', 'student_002')}
+    app.migrate_section_schema(*legacy_section)
+    att = app.load_attendance(*legacy_section)
+    assert app.schema_current(*legacy_section)
+    assert {sid: app.get_att_rec_entry(att, 'Math', sid, True) for sid in before} == before
+    assert before['student_001']['present'] == {'2026-01-05': 2, '2026-01-06': 1}
+    assert app.is_sha256_hex(app.get_students(*legacy_section)[0]['secretPassword'])
+    assert app.is_sha256_hex(app.get_secondary_admins(*legacy_section)[0]['password'])
+    cert = app.read_section_doc(*legacy_section, 'certificates')['byStudent']['student_001'][0]
+    assert cert['storedFilename'] == 'legacycert.pdf'
+
+
+def test_migrated_passwords_still_log_in(app, legacy_section):
+    app.migrate_section_schema(*legacy_section)
+    app.rebuild_login_index()
+    client = app.app.test_client()
+    r = client.post('/student_login', json={'rollNumber': 'L1', 'email': 'l@x', 'password': 'plain1'})
+    assert r.get_json()['success']
+    r = client.post('/student_login', json={'rollNumber': 'L1', 'email': 'l@x', 'password': 'bad'})
+    assert not r.get_json()['success']
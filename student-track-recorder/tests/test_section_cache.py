@@ -0,0 +1,68 @@
+import json
+import threading
+
+import pytest
+
+
+def disk_attendance(app, course, year, section):
+    with open(app.get_attendance_path(course, year, section)) as f:
+        return json.load(f)
+
+
+def subjects_seen_by_reader(app, section):
+    # Reads from another thread, which does not hold the section lock
+    seen = []
+    t = threading.Thread(target=lambda: seen.append(list(app.load_attendance(*section)['subjects'])))
+    t.start()
+    t.join()
+    return seen[0]
+
+
+def fail_write(path, data):
+    raise OSError('disk full')
+
+
+def test_failed_save_leaves_cache_matching_disk(app, section, monkeypatch):
+    before = disk_attendance(app, *section)
+    monkeypatch.setattr(app, 'atomic_write_json', fail_write)
+    with pytest.raises(OSError):
+        with app.section_lock(*section):
+            data = app.load_attendance(*section)
+            data['subjects'].append('Chem')
+            app.save_attendance(*section, data)
+    monkeypatch.undo()
+    assert disk_attendance(app, *section) == before
+    assert app.load_attendance(*section) == before
+
+
+def test_failed_route_write_is_not_served_afterwards(app, admin, section, monkeypatch):
+    course, year, name = section
+    r = admin.post(f'/add_student/{course}/{year}/{name}', data={'name': 'A', 'rollNumber': 'R1', 'email': 'a@x'})
+    student_id = r.get_json()['studentId']
+    monkeypatch.setattr(app, 'atomic_write_json', fail_write)
+    r = admin.post(f'/attendance/records/{course}/{year}/{name}/bulk', json={
+        'subject': 'Chem', 'date': '2026-03-02', 'entries': [{'studentId': student_id, 'status': 'present'}]})
+    assert r.status_code == 500
+    monkeypatch.undo()
+    assert 'Chem' not in admin.get(f'/attendance/subjects/{course}/{year}/{name}').get_json()
+    assert 'Chem' not in disk_attendance(app, *section)['subjects']
+
+
+def test_unsaved_edit_is_dropped_with_the_lock(app, section):
+    with app.section_lock(*section):
+        app.load_attendance(*section)['subjects'].append('Chem')
+    assert 'Chem' not in app.load_attendance(*section)['subjects']
+
+
+def test_edits_reach_readers_only_once_saved(app, section):
+    with app.section_lock(*section):
+        data = app.load_attendance(*section)
+        data['subjects'].append('Chem')
+        # The lock holder keeps one working copy; other threads still see the saved snapshot
+        assert app.load_attendance(*section) is data
+        assert 'Chem' not in subjects_seen_by_reader(app, section)
+        app.save_attendance(*section, data)
+        assert 'Chem' in subjects_seen_by_reader(app, section)
+        data['subjects'].append('Bio')
+        assert 'Bio' not in subjects_seen_by_reader(app, section)
+    assert disk_attendance(app, *section)['subjects'] == ['Chem']
@@ -0,0 +1,51 @@
+import os
+import threading
+import uuid
+
+
+def test_anonymous_request_takes_no_lock(app):
+    client = app.app.test_client()
+    outside = os.path.join(app.DATA_DIR, '..', '..', '..', '.lock')
+    existed = os.path.exists(outside)
+    r = client.post('/add_student/%2E%2E/%2E%2E/%2E%2E', data={'name': 'x'})
+    assert r.status_code == 401
+    assert os.path.exists(outside) == existed
+    for _ in range(5):
+        name = uuid.uuid4().hex
+        assert client.post(f'/add_student/{name}/{name}/{name}', data={'name': 'x'}).status_code == 401
+    assert app.FILE_LOCKS == {}
+
+
+def test_traversal_is_rejected_for_logged_in_users(app, admin):
+    outside = os.path.join(app.DATA_DIR, '..', '..', '..', '.lock')
+    existed = os.path.exists(outside)
+    r = admin.post('/add_student/%2E%2E/%2E%2E/%2E%2E', data={'name': 'x'})
+    assert r.status_code == 400
+    assert admin.post('/add_student/B.Tech/./x', data={'name': 'x'}).status_code == 400
+    assert os.path.exists(outside) == existed
+
+
+def test_lock_state_is_dropped_after_use(app, admin, section):
+    course, year, name = section
+    r = admin.post(f'/add_student/{course}/{year}/{name}', data={'name': 'A', 'rollNumber': 'R1', 'email': 'a@x'})
+    assert r.get_json()['success']
+    assert os.path.exists(os.path.join(app.DATA_DIR, course, year, name, '.lock'))
+    assert app.FILE_LOCKS == {}
+
+
+def test_lock_is_exclusive_and_reentrant(app, section):
+    entered = []
+
+    def other_thread():
+        with app.section_lock(*section):
+            entered.append(True)
+
+    with app.section_lock(*section):
+        with app.section_lock(*section):
+            t = threading.Thread(target=other_thread)
+            t.start()
+            t.join(0.2)
+            assert entered == []
+    t.join(2)
+    assert entered == [True]
+    assert app.FILE_LOCKS == {}
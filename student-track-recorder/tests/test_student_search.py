@@ -0,0 +1,73 @@
+import pytest
+
+
+def add_student(admin, section, name, roll):
+    course, year, sec = section
+    r = admin.post(f'/add_student/{course}/{year}/{sec}', data={
+        'name': name, 'rollNumber': roll, 'email': f'{roll}@x', 'secretPassword': 'pw'})
+    return r.get_json()['studentId']
+
+
+@pytest.fixture
+def sections(admin, section):
+    # Two sections whose students share a word unique to this test
+    course, year, name = section
+    other = (course, year, 'O' + name)
+    assert admin.post(f'/add_section/{course}/{year}', json={'name': other[2]}).get_json()['success']
+    tag = name.lower()
+    add_student(admin, section, f'Ada {tag}', f'A{tag}')
+    add_student(admin, other, f'Bob {tag}', f'B{tag}')
+    return section, other, tag
+
+
+def found(client, q, **params):
+    r = client.get('/search_students', query_string=dict(params, q=q))
+    assert r.status_code == 200
+    return [(hit['section'], hit['name']) for hit in r.get_json()['results']]
+
+
+def test_main_admin_searches_every_section(admin, sections):
+    section, other, tag = sections
+    assert set(found(admin, tag)) == {(section[2], f'Ada {tag}'), (other[2], f'Bob {tag}')}
+    assert found(admin, f'bob {tag}') == [(other[2], f'Bob {tag}')]
+    assert found(admin, tag, course=other[0], year=other[1], section=other[2]) == [(other[2], f'Bob {tag}')]
+    assert found(admin, f'b{tag}') == [(other[2], f'Bob {tag}')]  # by roll number
+
+
+def test_secondary_admin_sees_only_their_section(app, admin, sections):
+    section, other, tag = sections
+    course, year, name = section
+    admin.post(f'/add_secondary_admin/{course}/{year}/{name}', data={
+        'name': 'P', 'userId': f'prof-{name}', 'password': 'pp', 'subjects': 'Math'})
+    prof = app.app.test_client()
+    assert prof.post('/faculty_login', json={'accountType': 'secondary', 'userId': f'prof-{name}', 'password': 'pp'}).get_json()['success']
+    assert found(prof, tag) == [(name, f'Ada {tag}')]
+    # Asking for another section doesn't widen the scope
+    assert found(prof, tag, course=other[0], year=other[1], section=other[2]) == [(name, f'Ada {tag}')]
+    assert found(prof, f'bob {tag}') == []
+
+
+def test_students_and_anonymous_callers_are_refused(app, sections):
+    section, _, tag = sections
+    student = app.app.test_client()
+    assert student.post('/student_login', json={'rollNumber': f'A{tag}', 'email': f'A{tag}@x', 'password': 'pw'}).get_json()['success']
+    assert student.get('/search_students', query_string={'q': tag}).status_code == 401
+    assert app.app.test_client().get('/search_students', query_string={'q': tag}).status_code == 401
+
+
+def test_index_follows_adds_and_section_deletes(admin, sections):
+    section, other, tag = sections
+    found(admin, tag)  # builds the index
+    add_student(admin, section, f'Cy {tag}', f'C{tag}')
+    assert (section[2], f'Cy {tag}') in found(admin, tag)
+    admin.get(f'/delete_section/{other[0]}/{other[1]}/{other[2]}')
+    assert set(found(admin, tag)) == {(section[2], f'Ada {tag}'), (section[2], f'Cy {tag}')}
+
+
+def test_paging(admin, sections):
+    _, _, tag = sections
+    r = admin.get('/search_students', query_string={'q': tag, 'limit': 1}).get_json()
+    assert r['total'] == 2 and len(r['results']) == 1 and r['nextOffset'] == 1
+    r = admin.get('/search_students', query_string={'q': tag, 'limit': 1, 'offset': 1}).get_json()
+    assert len(r['results']) == 1 and r['nextOffset'] is None
+    assert admin.get('/search_students').status_code == 400
@@ -0,0 +1,44 @@
+import io
+import os
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def png(width, height):
+    buf = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def create_group(admin, course, year, name, photo):
+    r = admin.post(f'/groups/{course}/{year}/{name}/custom', data={
+        'name': 'G', 'groupPhoto': (io.BytesIO(photo), 'g.png')})
+    return r.get_json()['group']
+
+
+def test_width_param_serves_a_downscaled_copy(app, admin, section):
+    course, year, name = section
+    group = create_group(admin, course, year, name, png(800, 400))
+    r = admin.get(f"/uploads/{group['photo']}?w=90")
+    assert r.status_code == 200
+    assert Image.open(io.BytesIO(r.data)).size == (96, 48)
+    assert os.path.exists(app.thumb_path(group['photo'], 96))
+    original = admin.get(f"/uploads/{group['photo']}")
+    assert Image.open(io.BytesIO(original.data)).size == (800, 400)
+
+
+def test_replacing_group_photo_drops_old_file_and_thumbnails(app, admin, section):
+    course, year, name = section
+    old = create_group(admin, course, year, name, png(400, 400))
+    admin.get(f"/uploads/{old['photo']}?w=96")
+    assert os.path.exists(app.thumb_path(old['photo'], 96))
+    r = admin.put(f"/groups/{course}/{year}/{name}/{old['id']}", data={
+        'name': 'G', 'groupPhoto': (io.BytesIO(png(300, 300)), 'new.png')})
+    new_photo = r.get_json()['group']['photo']
+    assert new_photo != old['photo']
+    assert not os.path.exists(app.resolve_upload(old['photo']))
+    assert not os.path.exists(app.thumb_path(old['photo'], 96))
+    assert admin.get(f"/uploads/{old['photo']}").status_code == 404
+    assert admin.get(f'/uploads/{new_photo}?w=48').status_code == 200
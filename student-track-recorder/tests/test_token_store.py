@@ -0,0 +1,111 @@
+import itertools
+import time
+import uuid
+
+import pytest
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def backend(app, request, monkeypatch):
+    monkeypatch.setattr(app, 'TOKEN_BACKEND', request.param)
+    return request.param
+
+
+@pytest.fixture
+def outbox(app, monkeypatch):
+    # OTPs by address instead of mail
+    sent = {}
+
+    def send(to_email, otp, role_label='Account'):
+        sent[to_email] = otp
+        return True, None
+
+    monkeypatch.setattr(app, 'send_otp_email', send)
+    return sent
+
+
+ADDRESSES = (f'10.0.{i // 250}.{i % 250 + 1}' for i in itertools.count())
+
+
+def new_client(app):
+    # Its own client address, so per-address limits start from zero
+    client = app.app.test_client()
+    client.environ_base['REMOTE_ADDR'] = next(ADDRESSES)
+    return client
+
+
+@pytest.fixture
+def client(app):
+    return new_client(app)
+
+
+@pytest.fixture
+def student(admin, section):
+    course, year, name = section
+    email = f'{name}@x'
+    admin.post(f'/add_student/{course}/{year}/{name}', data={
+        'name': 'T', 'rollNumber': 'T1', 'email': email, 'secretPassword': 'old-pass'})
+    return {'role': 'student', 'rollNumber': 'T1', 'email': email}
+
+
+def request_reset(client, student):
+    return client.post('/otp/request_password_reset', json=student)
+
+
+def verify(client, reset_id, otp, password='new-pass'):
+    return client.post('/otp/verify_password_reset', json={'resetId': reset_id, 'otp': otp, 'newPassword': password})
+
+
+def test_correct_otp_resets_once(app, backend, outbox, client, student):
+    reset_id = request_reset(client, student).get_json()['resetId']
+    assert verify(client, reset_id, outbox[student['email']]).get_json()['success']
+    assert verify(client, reset_id, outbox[student['email']], 'other-pass').status_code == 400
+    r = app.app.test_client().post('/student_login', json={
+        'rollNumber': 'T1', 'email': student['email'], 'password': 'new-pass'})
+    assert r.get_json()['success']
+
+
+def test_wrong_otps_exhaust_the_reset(app, backend, outbox, client, student):
+    reset_id = request_reset(client, student).get_json()['resetId']
+    otp = outbox[student['email']]
+    wrong = f'{(int(otp) + 1) % 1000000:06d}'
+    for _ in range(app.OTP_MAX_VERIFY_ATTEMPTS - 1):
+        r = verify(client, reset_id, wrong)
+        assert r.status_code == 400 and r.get_json()['error'] == 'Invalid OTP'
+    assert verify(client, reset_id, wrong).status_code == 429
+    # The reset is void: even the right code is refused now
+    r = verify(client, reset_id, otp)
+    assert r.status_code == 400 and not r.get_json()['success']
+    assert app.token_get('otp', reset_id) is None
+
+
+def test_reset_requests_are_limited_per_email(app, backend, outbox, client, student):
+    for _ in range(app.OTP_MAX_REQUESTS_PER_EMAIL):
+        assert request_reset(client, student).status_code == 200
+    assert request_reset(client, student).status_code == 429
+    assert request_reset(new_client(app), student).status_code == 429
+
+
+def test_verify_attempts_are_limited_per_address(app, backend, client, monkeypatch):
+    monkeypatch.setattr(app, 'OTP_MAX_VERIFY_PER_ADDR', 3)
+    for _ in range(3):
+        assert verify(client, 'no-such-reset', '000000').status_code == 400
+    assert verify(client, 'no-such-reset', '000000').status_code == 429
+
+
+def test_counters_and_entries_expire(app, backend, monkeypatch):
+    key = uuid.uuid4().hex
+    assert not app.rate_limited('test', key, 1, 0.2)
+    assert app.rate_limited('test', key, 1, 0.2)
+    app.token_put('test', key, {'v': 1}, 0.2)
+    assert app.token_get('test', key) == {'v': 1}
+    time.sleep(0.3)
+    assert app.token_get('test', key) is None
+    assert not app.rate_limited('test', key, 1, 0.2)
+    monkeypatch.setitem(app.TOKEN_STATE, 'purged_at', 0.0)
+    time.sleep(0.3)
+    app.purge_expired_tokens()
+    if backend == 'memory':
+        assert ('test', key) not in app.TOKEN_MEMORY
+    else:
+        assert app.get_token_conn().execute('SELECT COUNT(*) FROM tokens WHERE key = ?', (key,)).fetchone()[0] == 0
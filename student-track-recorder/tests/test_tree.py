@@ -0,0 +1,62 @@
+import io
+import os
+import uuid
+
+
+def tree_sections(client, course, year):
+    # section name -> counts under course/year, from /tree
+    r = client.get('/tree')
+    assert r.status_code == 200
+    for course_node in r.get_json():
+        if course_node['name'] == course:
+            for year_node in course_node['years']:
+                if year_node['name'] == year:
+                    return {s['name']: s['counts'] for s in year_node['sections']}
+    return {}
+
+
+def test_counts_follow_section_edits(admin, section):
+    course, year, name = section
+    assert tree_sections(admin, course, year)[name] == {'students': 0, 'teachers': 0, 'subjects': 0}
+    admin.post(f'/add_student/{course}/{year}/{name}', data={'name': 'T', 'rollNumber': 'T1', 'email': 't@x'})
+    admin.post(f'/add_secondary_admin/{course}/{year}/{name}', data={
+        'name': 'P', 'userId': f'prof-{name}', 'password': 'pp', 'subjects': 'Math'})
+    admin.post(f'/notes/{course}/{year}/{name}', data={
+        'subject': 'Physics', 'title': 't', 'file': (io.BytesIO(b'x'), 'n.txt')})
+    # Math comes with the secondary admin, Physics with the note
+    assert tree_sections(admin, course, year)[name] == {'students': 1, 'teachers': 1, 'subjects': 2}
+
+
+def test_added_and_deleted_sections(admin, section):
+    course, year, name = section
+    other = 'T' + name
+    assert other not in tree_sections(admin, course, year)
+    admin.post(f'/add_section/{course}/{year}', json={'name': other})
+    assert set(tree_sections(admin, course, year)) >= {name, other}
+    admin.get(f'/delete_section/{course}/{year}/{other}')
+    sections = tree_sections(admin, course, year)
+    assert other not in sections and name in sections
+
+
+def test_changes_from_another_process_show_up(app, admin, section):
+    course, year, name = section
+    tree_sections(admin, course, year)  # cached now
+    other = 'P' + name
+    # Another worker creates the section and touches the stamp; this process's cache is left alone
+    os.makedirs(os.path.join(app.DATA_DIR, course, year, other))
+    app.atomic_write_json(app.HIERARCHY_STAMP_FILE, {'changedAt': 0})
+    assert tree_sections(admin, course, year)[other] == {'students': 0, 'teachers': 0, 'subjects': 0}
+
+
+def test_depth_and_access(app, admin):
+    course = 'C' + uuid.uuid4().hex[:8]
+    admin.post('/add_course', json={'name': course})
+    admin.post(f'/add_year/{course}', json={'name': 'Y1'})
+    nodes = {n['name']: n for n in admin.get('/tree?depth=1').get_json()}
+    assert nodes[course] == {'name': course}
+    nodes = {n['name']: n for n in admin.get('/tree?depth=2').get_json()}
+    assert nodes[course] == {'name': course, 'years': [{'name': 'Y1'}]}
+    admin.get(f'/delete_course/{course}')
+    assert course not in {n['name'] for n in admin.get('/tree').get_json()}
+    assert admin.get('/tree?depth=4').status_code == 400
+    assert app.app.test_client().get('/tree').status_code == 401
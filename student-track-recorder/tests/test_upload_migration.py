@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imports the app, gives any background migration time to run, then reports where the file is
+SCRIPT = """
+import time, app
+time.sleep(1.0)
+print(app.resolve_upload('flat.png') == app.upload_shard_path('flat.png'))
+"""
+
+
+def import_app(tmp_path, **env):
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir(exist_ok=True)
+    (uploads / 'flat.png').write_bytes(b'x')
+    full_env = dict(os.environ, DATA_DIR=str(tmp_path / 'data'), UPLOAD_FOLDER=str(uploads),
+                    TOKEN_DB_PATH=str(tmp_path / 'tokens.sqlite3'), **env)
+    for key in ('UPLOAD_MIGRATION', 'SCHEMA_MIGRATION'):
+        if key not in env:
+            full_env.pop(key, None)
+    out = subprocess.run([sys.executable, '-c', SCRIPT], cwd=APP_DIR, env=full_env,
+                         capture_output=True, text=True, timeout=60)
+    assert out.returncode == 0, out.stderr
+    return out.stdout.strip().splitlines()[-1] == 'True'
+
+
+def test_import_does_not_move_uploads(tmp_path):
+    assert not import_app(tmp_path)
+    assert (tmp_path / 'uploads' / 'flat.png').exists()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='the migrator needs fcntl')
+def test_explicit_opt_in_moves_uploads(tmp_path):
+    assert import_app(tmp_path, UPLOAD_MIGRATION='on')
+    assert not (tmp_path / 'uploads' / 'flat.png').exists()
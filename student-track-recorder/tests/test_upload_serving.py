@@ -0,0 +1,59 @@
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+BODY = bytes(range(256)) * 8
+
+
+@pytest.fixture
+def upload(app):
+    _, stored = app.store_upload(FileStorage(io.BytesIO(BODY), filename='data.bin'))
+    yield stored
+    app.remove_upload(stored)
+
+
+def test_full_response_carries_validators(admin, upload):
+    r = admin.get(f'/uploads/{upload}')
+    assert r.status_code == 200
+    assert r.data == BODY
+    assert r.headers['ETag'] == f'"{upload}"'
+    assert r.headers['Accept-Ranges'] == 'bytes'
+    assert 'immutable' in r.headers['Cache-Control']
+
+
+def test_range_request_gets_206(admin, upload):
+    r = admin.get(f'/uploads/{upload}', headers={'Range': 'bytes=100-199'})
+    assert r.status_code == 206
+    assert r.data == BODY[100:200]
+    assert r.headers['Content-Range'] == f'bytes 100-199/{len(BODY)}'
+    r = admin.get(f'/uploads/{upload}', headers={'Range': f'bytes={len(BODY)}-'})
+    assert r.status_code == 416
+
+
+def test_matching_etag_gets_304(admin, upload):
+    r = admin.get(f'/uploads/{upload}', headers={'If-None-Match': f'"{upload}"'})
+    assert r.status_code == 304
+    assert r.data == b''
+    r = admin.get(f'/uploads/{upload}', headers={'If-None-Match': '"something-else"'})
+    assert r.status_code == 200
+    # A stale If-Range falls back to the whole body
+    r = admin.get(f'/uploads/{upload}', headers={'Range': 'bytes=0-9', 'If-Range': '"something-else"'})
+    assert r.status_code == 200 and r.data == BODY
+
+
+def test_accel_offload_answers_conditionals_itself(app, admin, upload, monkeypatch):
+    monkeypatch.setattr(app, 'UPLOAD_OFFLOAD', 'accel')
+    r = admin.get(f'/uploads/{upload}')
+    assert r.status_code == 200 and r.data == b''
+    rel = os.path.relpath(app.resolve_upload(upload), app.UPLOAD_FOLDER).replace(os.sep, '/')
+    assert r.headers['X-Accel-Redirect'] == app.UPLOAD_ACCEL_PREFIX + rel
+    r = admin.get(f'/uploads/{upload}', headers={'If-None-Match': f'"{upload}"'})
+    assert r.status_code == 304
+    assert 'X-Accel-Redirect' not in r.headers
+
+
+def test_missing_upload_is_404(admin):
+    assert admin.get('/uploads/nothing-here.bin').status_code == 404
+    assert admin.get('/uploads/.hidden').status_code == 404